@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Compare encoding of orders stored by `RedisPriorityQueue`: legacy repr of
+order decoded by `eval` and compact `order_encoding`. With `--redis` orders
+are stored in redis sorted set and its memory is reported per million orders.
+
+Usage: python -m benchmarks.order_encoding [-n NUMBER] [--redis [--orders ORDERS]]
+"""
+
+import argparse
+import asyncio
+import timeit
+
+import aioredis
+from tabulate import tabulate
+
+import wood.settings as settings
+from wood.orders import AskOrder, BidOrder, MarketAskOrder, MarketBidOrder
+from wood.priority_queue.order_encoding import decode_order, encode_order
+
+
+def legacy_encode(order):
+    return str(order).encode()
+
+
+def legacy_decode(record):
+    return eval(record, {"AskOrder": AskOrder,
+                         "BidOrder": BidOrder,
+                         "MarketAskOrder": MarketAskOrder,
+                         "MarketBidOrder": MarketBidOrder})
+
+
+encodings = {
+    "legacy": (legacy_encode, legacy_decode),
+    "compact": (encode_order, decode_order),
+}
+
+
+def get_orders(count):
+    return [BidOrder(1500000000.0 + i / 1000, i, ("127.0.0.1", 40000 + i % 20000), 100 + i % 50, 10 + i % 100)
+            for i in range(count)]
+
+
+def run(number):
+    orders = get_orders(100)
+    table = []
+    for name, (encode, decode) in sorted(encodings.items()):
+        records = [encode(order) for order in orders]
+        encode_duration = timeit.timeit(lambda: [encode(order) for order in orders], number=number)
+        decode_duration = timeit.timeit(lambda: [decode(record) for record in records], number=number)
+        count = number * len(orders)
+        size = sum(len(record) for record in records) / len(records)
+        table.append((name, encode_duration / count * 1e6, decode_duration / count * 1e6, size))
+    return table
+
+
+@asyncio.coroutine
+async def redis_memory(loop, count):
+    """ Return bytes of redis memory per million orders for every encoding. """
+    redis = await aioredis.create_redis((settings.redis["host"], settings.redis["port"]), loop=loop)
+    orders = get_orders(count)
+    memory = {}
+    try:
+        for name, (encode, _) in sorted(encodings.items()):
+            key = "benchmark:order_encoding:" + name
+            await redis.delete(key)
+            before = (await redis.info("memory"))["memory"]["used_memory"]
+            for start in range(0, count, 1000):
+                pairs = []
+                for order in orders[start:start + 1000]:
+                    pairs.extend((order.price, encode(order)))
+                await redis.zadd(key, *pairs)
+            after = (await redis.info("memory"))["memory"]["used_memory"]
+            await redis.delete(key)
+            memory[name] = (int(after) - int(before)) * 1000000 / count
+    finally:
+        redis.close()
+    return memory
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", default=1000, type=int, help="Number of repetitions.")
+    parser.add_argument("--redis", action="store_true", help="Measure memory of orders stored in redis.")
+    parser.add_argument("--orders", default=100000, type=int, help="Number of orders stored in redis.")
+    args = parser.parse_args()
+    table = run(args.number)
+    headers = ["Encoding", "encode us/order", "decode us/order", "bytes/order"]
+    if args.redis:
+        loop = asyncio.get_event_loop()
+        memory = loop.run_until_complete(redis_memory(loop, args.orders))
+        table = [row + (memory[row[0]] / 2 ** 20,) for row in table]
+        headers.append("redis MiB/1M orders")
+    print(tabulate(table, headers=headers, floatfmt=".2f"))
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite of priority queues, limit order books, stock exchange and
+public fan-out. Every case runs `--repeat` times and the best time is
+reported. Results are printed as table or with `--json` as document that can
+be stored and later passed to `--compare` to see changes between commits.
+Redis cases run only with `--redis` against redis from `wood.settings`, they
+use their own keys and delete them at the end.
+
+    queue           put, get and cancel of `depth` orders in every priority queue
+    book_sweep      order sweeping `levels` price levels of book with `depth` asks
+    stock_exchange  `StockExchange.handle_order` of json messages end to end
+    broadcast       public message written to `subscribers` clients
+
+Usage: python -m benchmarks.suite [-k NAME] [--repeat N] [--redis] [--json] [--output FILE] [--compare FILE]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import random
+import subprocess
+import time
+
+from tabulate import tabulate
+
+from wood import codec
+from wood.clients import PublicClients
+from wood.limit_order_book import LimitOrderBook, SyncLimitOrderBook
+from wood.orders import AskOrder, BidOrder
+from wood.priority_queue import LadderPriorityQueue, MemoryPriorityQueue, RedisPriorityQueue
+from wood.pubsub import direct_pubsub_factory
+from wood.redis_connections import get_connections
+from wood.replay import ReplayPublisher
+from wood.stock_exchange import StockExchange
+from wood.utils import get_logger
+
+DEPTHS = (100, 1000, 10000)
+SWEEPS = (1, 10, 100)
+SUBSCRIBERS = (10, 100, 1000)
+REDIS_SYMBOL = "benchmark"
+
+
+def get_orders(order_type, count, levels=100, seed=0):
+    generator = random.Random(seed)
+    return [order_type(1500000000.0 + i / 1000, i, ("127.0.0.1", 40000 + i % 100), 100 + generator.randrange(levels),
+                       10) for i in range(count)]
+
+
+@asyncio.coroutine
+async def delete_keys(loop, keys):
+    async with get_connections(loop).command() as redis:
+        await redis.delete(*keys)
+
+
+@asyncio.coroutine
+async def queue_case(loop, queue_type, depth):
+    """ Return seconds of put, get and cancel of `depth` orders. """
+    orders = get_orders(BidOrder, depth)
+    cancelled = list(orders)
+    random.Random(1).shuffle(cancelled)
+    queue = queue_type(loop, reverse=True, name="benchmark:queue")
+    await queue.connect()
+    seconds = {}
+    try:
+        start = time.perf_counter()
+        for order in orders:
+            await queue.put(order)
+        seconds["put"] = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in orders:
+            await queue.get()
+        seconds["get"] = time.perf_counter() - start
+        for order in orders:
+            await queue.put(order)
+        start = time.perf_counter()
+        for order in cancelled:
+            await queue.remove(order)
+        seconds["cancel"] = time.perf_counter() - start
+    finally:
+        if queue_type is RedisPriorityQueue:
+            await delete_keys(loop, queue.keys)
+        queue.close()
+    return seconds
+
+
+def create_book(loop, book_type, depth):
+    """ Return book with `depth` asks, one on every price level from 100 up. """
+    book = SyncLimitOrderBook(loop) if book_type is SyncLimitOrderBook else LimitOrderBook(loop, LadderPriorityQueue)
+    book.ask_queue.load(AskOrder(1.0, i, "seller", 100 + i, 10) for i in range(depth))
+    return book
+
+
+def book_sweep_case(loop, book_type, depth, levels, number=100):
+    """ Return seconds of `number` bids that sweep `levels` levels of fresh books. """
+    seconds = 0.0
+    for _ in range(number):
+        book = create_book(loop, book_type, depth)
+        bid = BidOrder(2.0, depth, "buyer", 100 + levels - 1, 10 * levels)
+        start = time.perf_counter()
+        if book_type is SyncLimitOrderBook:
+            book.add(bid)
+            trades = book.match()
+        else:
+            loop.run_until_complete(book.add(bid))
+            trades = loop.run_until_complete(book.check_trades())
+        seconds += time.perf_counter() - start
+        assert len(trades) == levels
+    return seconds
+
+
+def get_messages(count, symbol=None):
+    """ Return create order messages, every buy crosses the previous sell. """
+    messages = []
+    for i in range(count):
+        message = {"message": "createOrder", "orderId": i, "side": "BUY" if i % 2 else "SELL",
+                   "price": 100 + i % 7, "quantity": 10}
+        if symbol is not None:
+            message["symbol"] = symbol
+        messages.append(codec.dumps(message))
+    return messages
+
+
+@asyncio.coroutine
+async def handle_orders(stock_exchange, messages):
+    start = time.perf_counter()
+    for message in messages:
+        await stock_exchange.handle_order(message, ("127.0.0.1", 40000))
+    return time.perf_counter() - start
+
+
+def stock_exchange_case(loop, count, multiple_servers=False):
+    """ Return seconds of handling `count` messages by one participant. """
+    symbol = REDIS_SYMBOL if multiple_servers else None
+    stock_exchange = StockExchange(ReplayPublisher(loop), ReplayPublisher(loop), loop, multiple_servers,
+                                   symbols=[REDIS_SYMBOL])
+    stock_exchange.order_book_tick = 0
+    try:
+        return loop.run_until_complete(handle_orders(stock_exchange, get_messages(count, symbol)))
+    finally:
+        if multiple_servers:
+            book = stock_exchange.limit_order_books[REDIS_SYMBOL]
+            loop.run_until_complete(delete_keys(loop, book.bid_queue.keys + book.ask_queue.keys))
+        stock_exchange.close()
+
+
+class NullTransport:
+    def write(self, data):
+        pass
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        pass
+
+
+class NullClient:
+    def __init__(self, port):
+        self.peername = ("127.0.0.1", port)
+        self.transport = NullTransport()
+
+
+def broadcast_case(loop, subscribers, count):
+    """ Return seconds of broadcasting `count` messages to `subscribers` clients. """
+    subscriber, _ = direct_pubsub_factory(loop)
+    clients = PublicClients(subscriber)
+    for port in range(subscribers):
+        clients.add(NullClient(port))
+    messages = [codec.order_book_report("bid" if i % 2 else "ask", 100 + i % 50, i) for i in range(count)]
+    start = time.perf_counter()
+    for message in messages:
+        clients.broadcast(message)
+    return time.perf_counter() - start
+
+
+def cases(loop, use_redis):
+    """
+    Yield (benchmark, params, operations, function) of all cases. Function
+    returns seconds or dict of seconds of every operation of the case.
+    """
+    queue_types = [MemoryPriorityQueue, LadderPriorityQueue] + ([RedisPriorityQueue] if use_redis else [])
+    for queue_type in queue_types:
+        for depth in DEPTHS:
+            if queue_type is RedisPriorityQueue and depth > 1000:
+                continue
+            yield ("queue", {"queue": queue_type.__name__, "depth": depth}, depth,
+                   lambda queue_type=queue_type, depth=depth: loop.run_until_complete(queue_case(loop, queue_type,
+                                                                                                 depth)))
+    for book_type in (SyncLimitOrderBook, LimitOrderBook):
+        for levels in SWEEPS:
+            yield ("book_sweep", {"book": book_type.__name__, "depth": 1000, "levels": levels}, 100 * levels,
+                   lambda book_type=book_type, levels=levels: book_sweep_case(loop, book_type, 1000, levels))
+    for multiple_servers in ([False, True] if use_redis else [False]):
+        count = 1000 if multiple_servers else 10000
+        yield ("stock_exchange", {"books": "redis" if multiple_servers else "memory"}, count,
+               lambda multiple_servers=multiple_servers, count=count:
+               stock_exchange_case(loop, count, multiple_servers))
+    for subscribers in SUBSCRIBERS:
+        yield ("broadcast", {"subscribers": subscribers}, 1000,
+               lambda subscribers=subscribers: broadcast_case(loop, subscribers, 1000))
+
+
+def run(loop, use_redis=False, repeat=3, name=None):
+    """ Return list of results of cases whose benchmark contains `name`, the best of `repeat` runs. """
+    results = []
+    for benchmark, params, operations, case in cases(loop, use_redis):
+        if name is not None and name not in benchmark:
+            continue
+        runs = [case() for _ in range(repeat)]
+        if isinstance(runs[0], dict):
+            timings = [(dict(params, operation=operation), min(seconds[operation] for seconds in runs))
+                       for operation in runs[0]]
+        else:
+            timings = [(params, min(runs))]
+        for case_params, seconds in timings:
+            results.append({
+                "benchmark": benchmark,
+                "params": case_params,
+                "operations": operations,
+                "seconds": seconds,
+                "us_per_operation": seconds / operations * 1e6,
+                "operations_per_second": operations / seconds,
+            })
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    return result["benchmark"], json.dumps(result["params"], sort_keys=True)
+
+
+def table(results, baseline=None):
+    """ Return rows of `results`, with `baseline` results also their speed up against baseline. """
+    previous = {} if baseline is None else {result_key(result): result for result in baseline["results"]}
+    rows = []
+    for result in results:
+        row = [result["benchmark"], " ".join("{}={}".format(*item) for item in sorted(result["params"].items())),
+               result["us_per_operation"], result["operations_per_second"]]
+        if baseline is not None:
+            old = previous.get(result_key(result))
+            row.append(None if old is None else old["us_per_operation"] / result["us_per_operation"])
+        rows.append(row)
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-k", "--name", default=None, help="Run only benchmarks whose name contains NAME.")
+    parser.add_argument("--repeat", default=3, type=int, help="Number of runs of every case, the best one counts.")
+    parser.add_argument("--redis", action="store_true", help="Run also cases with redis.")
+    parser.add_argument("--json", action="store_true", help="Print results as json.")
+    parser.add_argument("--output", default=None, help="Write results as json to file.")
+    parser.add_argument("--compare", default=None, help="Json results of previous run to compare with.")
+    args = parser.parse_args()
+
+    # logging would be measured too
+    get_logger().setLevel(logging.WARNING)
+    loop = asyncio.get_event_loop()
+    document = {
+        "commit": git_commit(),
+        "time": time.time(),
+        "python": platform.python_version(),
+        "codec": codec.name,
+        "results": run(loop, args.redis, args.repeat, args.name),
+    }
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+    if args.json:
+        print(json.dumps(document, indent=2, sort_keys=True))
+    else:
+        baseline = None
+        if args.compare is not None:
+            with open(args.compare) as f:
+                baseline = json.load(f)
+        headers = ["Benchmark", "Parameters", "us/operation", "operations/s"]
+        if baseline is not None:
+            headers.append("speed up")
+        print(tabulate(table(document["results"], baseline), headers=headers, floatfmt=".2f"))
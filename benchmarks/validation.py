@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Compare compiled validator from `wood.validation` with voluptuous
+`message_schema` on valid and invalid messages.
+
+Usage: python -m benchmarks.validation [-n NUMBER]
+"""
+
+import argparse
+import timeit
+
+from tabulate import tabulate
+from voluptuous import Invalid
+
+from wood.stock_exchange import validators
+from wood.validation import InvalidMessage
+
+traffic = {
+    "valid": [
+        {"message": "createOrder", "orderId": 1, "side": "BUY", "price": 100, "quantity": 10},
+        {"message": "cancelOrder", "orderId": 1},
+        {"message": "marketOrder", "orderId": 1, "side": "SELL", "quantity": 10},
+    ],
+    "invalid": [
+        {"message": "cancelOrder"},
+        {"message": "createOrder", "orderId": 1, "side": "BUY", "price": -1, "quantity": 10},
+        {"message": "marketOrder", "orderId": "1", "side": "SELL", "quantity": 10},
+    ],
+}
+
+
+def validate_all(validator, messages):
+    for message in messages:
+        try:
+            validator(message)
+        except (Invalid, InvalidMessage):
+            pass
+
+
+def run(number):
+    table = []
+    for traffic_name, messages in sorted(traffic.items()):
+        for validator_name, validator in sorted(validators.items()):
+            duration = timeit.timeit(lambda: validate_all(validator, messages), number=number)
+            per_message = duration / (number * len(messages))
+            table.append((traffic_name, validator_name, per_message * 1e6, 1 / per_message))
+    return table
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", default=10000, type=int, help="Number of repetitions.")
+    args = parser.parse_args()
+    print(tabulate(run(args.number), headers=["Traffic", "Validator", "us/message", "messages/s"], floatfmt=".2f"))
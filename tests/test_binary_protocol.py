@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+from wood import binary_protocol
+from wood.orders import BidOrder, MarketAskOrder
+from wood.stock_exchange import StockExchange
+from .test_stock_exchange import RecordingPublisher
+
+PARTICIPANT = ("127.0.0.1", 12345, binary_protocol.PARTICIPANT_TAG)
+
+
+def test_decode_orders():
+    data = (binary_protocol.encode_create_order(1, binary_protocol.BUY, 100, 50) +
+            binary_protocol.encode_market_order(2, binary_protocol.SELL, 30) +
+            binary_protocol.encode_cancel_order(1))
+    records, consumed = binary_protocol.decode(data, PARTICIPANT)
+
+    assert consumed == len(data)
+    assert isinstance(records[0], BidOrder)
+    assert (records[0].order_id, records[0].participant, records[0].price, records[0].quantity) == \
+        (1, PARTICIPANT, 100, 50)
+    assert isinstance(records[1], MarketAskOrder)
+    assert records[1].price == -1
+    assert records[2] == binary_protocol.Cancel(1)
+
+
+def test_decode_stops_on_incomplete_record():
+    data = binary_protocol.encode_cancel_order(1) + binary_protocol.encode_create_order(2, binary_protocol.BUY, 1, 1)
+    records, consumed = binary_protocol.decode(data[:-3], PARTICIPANT)
+
+    assert records == [binary_protocol.Cancel(1)]
+    assert consumed == binary_protocol.cancel_order_record.size
+
+
+def test_decode_rejects_invalid_side():
+    records, _ = binary_protocol.decode(binary_protocol.encode_create_order(3, 7, 1, 1), PARTICIPANT)
+
+    assert records[0].order_id == 3
+    assert isinstance(records[0], binary_protocol.Rejected)
+
+
+def test_execution_report_round_trip():
+    data = (binary_protocol.encode_execution_report(1, "NEW") +
+            binary_protocol.encode_execution_report(1, "FILL", 100, 20))
+    reports = binary_protocol.decode_execution_reports(data)
+
+    assert reports == [binary_protocol.ExecutionReport(1, "NEW", 0, 0),
+                       binary_protocol.ExecutionReport(1, "FILL", 100, 20)]
+
+
+def test_is_binary():
+    assert binary_protocol.is_binary(PARTICIPANT)
+    assert not binary_protocol.is_binary(("127.0.0.1", 12345))
+    assert not binary_protocol.is_binary(None)
+
+
+def test_trade_at_the_highest_price(event_loop):
+    private_publisher, public_publisher = RecordingPublisher(event_loop), RecordingPublisher(event_loop)
+    stock_exchange = StockExchange(private_publisher, public_publisher, event_loop)
+    price = 2 ** 64 - 1
+    data = (binary_protocol.encode_create_order(1, binary_protocol.SELL, price, 5) +
+            binary_protocol.encode_create_order(2, binary_protocol.BUY, price, 5))
+    records, _ = binary_protocol.decode(data, PARTICIPANT)
+    event_loop.run_until_complete(stock_exchange.handle_records(records, PARTICIPANT))
+    stock_exchange.close()
+
+    reports = binary_protocol.decode_execution_reports(b"".join(message for batch in private_publisher.batches
+                                                                for _, message in batch))
+    assert binary_protocol.ExecutionReport(1, "FILL", price, 5) in reports
+    assert binary_protocol.ExecutionReport(2, "FILL", price, 5) in reports
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import struct
+
+from wood.capture import Capture, read_capture, resend
+from wood.server import StockServer
+from .test_server import get_create_order, send_message, server  # noqa: F401
+
+
+def test_capture_file_ends_with_complete_record(tmpdir):
+    path = str(tmpdir.join("capture"))
+    capture = Capture(path)
+    assert capture.connection_id() == 1
+    assert capture.connection_id() == 2
+    capture.record(1, [b"first", b"second"], timestamp=1.5)
+    capture.record(2, [b"third"], timestamp=2.5)
+    capture.close()
+    with open(path, "ab") as f:
+        # record cut after 3 bytes of 10 bytes long message
+        f.write(struct.pack("<dII", 3.5, 1, 10) + b"cut")
+
+    assert read_capture(path) == [(1.5, 1, b"first"), (1.5, 1, b"second"), (2.5, 2, b"third")]
+
+
+def test_server_captures_private_messages(event_loop, unused_tcp_port_factory, tmpdir):
+    path = str(tmpdir.join("capture"))
+    stock_server = StockServer(public_port=unused_tcp_port_factory(), private_port=unused_tcp_port_factory(),
+                               loop=event_loop, capture=path)
+    stock_server.initialize_tasks()
+    messages = [get_create_order(1, side="SELL"), get_create_order(2)]
+    for message in messages:
+        event_loop.run_until_complete(send_message(stock_server.private_port, event_loop, message))
+    stock_server.shutdown_tasks()
+
+    records = read_capture(path)
+    assert [(connection_id, message) for _, connection_id, message in records] == \
+        [(1, messages[0].encode()), (2, messages[1].encode())]
+    assert records[0][0] <= records[1][0]
+
+
+def test_resend_keeps_connections_and_scaled_timing(server):
+    loop = server.loop
+    records = [(10.0, 7, get_create_order(1, side="SELL").encode()),
+               (10.0, 7, get_create_order(2, side="SELL", price=101).encode()),
+               (10.5, 9, get_create_order(3).encode())]
+    stats = loop.run_until_complete(resend(records, "127.0.0.1", server.private_port, speed=10, wait=0.1,
+                                           loop=loop))
+
+    assert stats["connections"] == 2 and stats["messages"] == 3
+    assert stats["seconds"] >= 0.05
+    # NEW for every order and FILL for both sides of the trade
+    assert stats["reports"] == 5
+
+    stats = loop.run_until_complete(resend(records, "127.0.0.1", server.private_port, speed=0, wait=0.1, loop=loop))
+    assert stats["seconds"] < 0.05
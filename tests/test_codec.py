@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from wood import codec
+
+
+def test_dumps_is_terminated_by_newline():
+    message = codec.dumps({"error": "Message 'ž' is not valid json."})
+    assert message.endswith(b"\n")
+    assert json.loads(message.decode()) == {"error": "Message 'ž' is not valid json."}
+
+
+def test_execution_report():
+    report = codec.execution_report(12, "NEW")
+    assert json.loads(report.decode()) == {"message": "executionReport", "orderId": 12, "report": "NEW"}
+
+
+def test_fill_report_with_big_order_id():
+    order_id = 2 ** 70
+    report = codec.fill_report(order_id, 100, 10)
+    assert report.endswith(b"\n")
+    assert json.loads(report.decode()) == {"message": "executionReport", "orderId": order_id, "report": "FILL",
+                                           "price": 100, "quantity": 10}
+
+
+def test_loads_big_order_id():
+    order_id = 2 ** 70
+    message = codec.loads(b'{"message": "cancelOrder", "orderId": %d}' % order_id)
+    assert message["orderId"] == order_id
+    assert type(message["orderId"]) is int
+
+
+def test_trade_report():
+    report = codec.trade_report(1461700000.123456, 100, 10)
+    assert json.loads(report.decode()) == {"type": "trade", "time": 1461700000.123456, "price": 100, "quantity": 10}
+
+
+def test_order_book_report_fallback_for_non_int():
+    report = codec.order_book_report("bid", 100.5, 10)
+    assert json.loads(report.decode()) == {"type": "orderbook", "side": "bid", "price": 100.5, "quantity": 10}
+
+
+def test_public_reports_with_symbol():
+    trade = codec.trade_report(1461700000.5, 100, 10, symbol="OAK")
+    level = codec.order_book_report("ask", 100, 10, symbol="OAK")
+    assert json.loads(trade.decode()) == {"type": "trade", "time": 1461700000.5, "price": 100, "quantity": 10,
+                                          "symbol": "OAK"}
+    assert json.loads(level.decode()) == {"type": "orderbook", "side": "ask", "price": 100, "quantity": 10,
+                                          "symbol": "OAK"}
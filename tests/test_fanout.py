@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from wood import codec
+from wood.fanout import FanOut
+
+
+class RecordingTransport:
+    def __init__(self):
+        self.written = []
+        self.aborted = False
+
+    def write(self, data):
+        self.written.append(data)
+
+    def abort(self):
+        self.aborted = True
+
+
+def level(side, price, quantity, symbol=None):
+    return codec.order_book_report(side, price, quantity, symbol)
+
+
+def trade(price, quantity):
+    return codec.trade_report(1.0, price, quantity)
+
+
+def written(transport):
+    return b"".join(transport.written)
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        FanOut("drop")
+
+
+def test_publish_writes_the_same_bytes_to_all():
+    fanout = FanOut()
+    transports = [RecordingTransport() for _ in range(3)]
+    for key, transport in enumerate(transports):
+        fanout.add(key, transport)
+    message = level("bid", 100, 10)
+    fanout.publish(message)
+    for transport in transports:
+        assert transport.written[0] is message
+    fanout.remove(0)
+    fanout.publish(message)
+    assert len(transports[0].written) == 1
+    assert len(transports[1].written) == 2
+
+
+def test_snapshot_policy():
+    fanout = FanOut("snapshot")
+    fast, slow = RecordingTransport(), RecordingTransport()
+    fanout.add("fast", fast)
+    fanout.add("slow", slow)
+    fanout.publish(level("bid", 100, 10))
+    fanout.publish(level("ask", 110, 10))
+    fanout.pause("slow")
+    fanout.publish(level("bid", 100, 20))
+    fanout.publish(level("bid", 100, 30))
+    fanout.publish(trade(110, 10))
+    fanout.publish(level("ask", 110, 0))
+    assert written(slow) == level("bid", 100, 10) + level("ask", 110, 10)
+    fanout.resume("slow")
+    assert slow.written[-1] == level("bid", 100, 30) + level("ask", 110, 0)
+    fanout.publish(level("bid", 90, 5))
+    assert slow.written[-1] == level("bid", 90, 5)
+    assert len(fast.written) == 7
+    # empty levels are not kept when nobody needs them
+    assert fanout.levels == [(None, "bid", 100), (None, "bid", 90)]
+
+
+def test_snapshot_contains_all_levels():
+    fanout = FanOut("snapshot")
+    slow = RecordingTransport()
+    fanout.add("slow", slow)
+    fanout.publish(level("bid", 100, 10))
+    fanout.pause("slow")
+    fanout.publish(level("ask", 110, 10))
+    fanout.resume("slow")
+    assert slow.written[-1] == level("bid", 100, 10) + level("ask", 110, 10)
+
+
+def test_skip_policy():
+    fanout = FanOut("skip")
+    slow = RecordingTransport()
+    fanout.add("slow", slow)
+    fanout.publish(level("bid", 100, 10))
+    fanout.publish(level("bid", 90, 10))
+    fanout.pause("slow")
+    fanout.publish(level("bid", 100, 20))
+    fanout.publish(level("ask", 110, 10))
+    fanout.publish(level("bid", 100, 0))
+    fanout.publish(trade(110, 10))
+    fanout.resume("slow")
+    assert slow.written[-1] == level("ask", 110, 10) + level("bid", 100, 0)
+    assert len(slow.written) == 3
+
+
+def test_resume_without_changes_writes_nothing():
+    fanout = FanOut("skip")
+    slow = RecordingTransport()
+    fanout.add("slow", slow)
+    fanout.pause("slow")
+    fanout.resume("slow")
+    assert slow.written == []
+
+
+def test_disconnect_policy():
+    fanout = FanOut("disconnect")
+    slow = RecordingTransport()
+    fanout.add("slow", slow)
+    fanout.pause("slow")
+    assert slow.aborted
+    fanout.publish(level("bid", 100, 10))
+    assert slow.written == []
+    fanout.remove("slow")
+    assert len(fanout) == 0
+
+
+def test_snapshot_keeps_levels_of_every_symbol():
+    fanout = FanOut("snapshot")
+    slow = RecordingTransport()
+    fanout.add("slow", slow)
+    fanout.pause("slow")
+    fanout.publish(level("bid", 100, 10))
+    fanout.publish(level("bid", 100, 20, symbol="OAK"))
+    fanout.resume("slow")
+    assert slow.written[-1] == level("bid", 100, 10) + level("bid", 100, 20, symbol="OAK")
+
+
+def test_levels_of_plain_bytes_are_remembered():
+    # reports that came through redis lost their level
+    fanout = FanOut("snapshot")
+    fanout.publish(bytes(level("bid", 100, 20, symbol="OAK")))
+    fanout.publish(bytes(trade(100, 10)))
+    assert fanout.levels == [("OAK", "bid", 100)]
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import pickle
+
+from wood import binary_protocol, settings
+from wood.gateway import GatewayServer, MatchingEngine, RingStockExchange, ORDERS_FRAME
+from .test_server import get_create_order
+from .test_stock_exchange import RecordingPublisher
+
+
+@asyncio.coroutine
+async def connect(port, loop):
+    """ Gateways are spawned, so wait until some of them listens. """
+    for _ in range(100):
+        try:
+            return await asyncio.open_connection("127.0.0.1", port, loop=loop)
+        except OSError:
+            await asyncio.sleep(0.05, loop=loop)
+    raise TimeoutError
+
+
+@asyncio.coroutine
+async def read_reports(reader, count):
+    return [json.loads((await asyncio.wait_for(reader.readline(), 5)).decode()) for _ in range(count)]
+
+
+def test_clients_of_gateways_trade_together(event_loop, unused_tcp_port_factory):
+    server = GatewayServer(private_port=unused_tcp_port_factory(), public_port=unused_tcp_port_factory(),
+                           gateways=2)
+    server.start()
+
+    async def trade():
+        clients = [await connect(server.private_port, event_loop) for _ in range(4)]
+        sellers, buyer = clients[:3], clients[3]
+        for order_id, (_, writer) in enumerate(sellers, 1):
+            writer.write(get_create_order(order_id, side="SELL", quantity=10).encode() + b"\n")
+        for reader, _ in sellers:
+            await read_reports(reader, 1)
+        buyer[1].write(get_create_order(4, quantity=30).encode() + b"\n{}\n")
+        reports = await read_reports(buyer[0], 5)
+        fills = [await read_reports(reader, 1) for reader, _ in sellers]
+        for _, writer in clients:
+            writer.close()
+        return reports, fills
+
+    try:
+        reports, fills = event_loop.run_until_complete(trade())
+    finally:
+        server.stop()
+
+    assert reports[0] == {"message": "executionReport", "orderId": 4, "report": "NEW"}
+    assert reports[1:4] == [{"message": "executionReport", "orderId": 4, "report": "FILL", "price": 100,
+                             "quantity": 10}] * 3
+    # error of invalid message follows reports of the order sent before it
+    assert "error" in reports[4]
+    assert fills == [[{"message": "executionReport", "orderId": order_id, "report": "FILL", "price": 100,
+                       "quantity": 10}] for order_id in (1, 2, 3)]
+    assert not server.engine.is_alive()
+    assert server.engine.exitcode == 0
+
+
+class FrameReader:
+    """ Reader of ring buffer that returns `frames` one by one and then end of stream, bytes are not pickled. """
+    def __init__(self, frames):
+        self.batches = [[frame if isinstance(frame, bytes) else pickle.dumps(frame)] for frame in frames] + [[]]
+
+    @asyncio.coroutine
+    async def read(self):
+        return self.batches.pop(0)
+
+    def close(self):
+        pass
+
+
+def test_engine_forgets_disconnected_participant(event_loop):
+    order_dict = json.loads(get_create_order(1))
+    frames = [("orders", "alice", [order_dict]), ("orders", "bob", [dict(order_dict, orderId=2)]),
+              ("disconnect", "alice", [])]
+    engine = MatchingEngine(event_loop, [FrameReader(frames)], [])
+    event_loop.run_until_complete(engine.serve())
+    engine.close()
+
+    assert engine.owners == {"bob": 0}
+    assert len(engine.stock_exchange.limit_order_book.bid_queue) == 2
+
+
+class FrameWriter:
+    """ Writer of ring buffer that keeps written frames. """
+    def __init__(self):
+        self.frames = []
+
+    @asyncio.coroutine
+    async def write(self, data):
+        self.frames.append(data)
+
+    def close(self):
+        pass
+
+
+def test_orders_are_passed_to_engine_as_binary_records(event_loop, monkeypatch):
+    monkeypatch.setattr(settings, "symbols", ("AAPL",))
+    do = event_loop.run_until_complete
+    writer = FrameWriter()
+    gateway = RingStockExchange(RecordingPublisher(event_loop), RecordingPublisher(event_loop), event_loop, writer,
+                                FrameReader([]))
+    messages = [get_create_order(1), json.dumps(dict(json.loads(get_create_order(2)), symbol="AAPL")),
+                json.dumps({"message": "cancelOrder", "orderId": 1}), "{}", get_create_order(-1)]
+    do(gateway.handle_orders([message.encode() for message in messages], ("127.0.0.1", 7001)))
+    data = (binary_protocol.encode_create_order(3, binary_protocol.BUY, 90, 5) +
+            binary_protocol.encode_create_order(5, 7, 90, 5) +
+            binary_protocol.encode_create_order(4, binary_protocol.SELL, 110, 5))
+    binary_participant = ("127.0.0.1", 7002, binary_protocol.PARTICIPANT_TAG)
+    records, _ = binary_protocol.decode(data, binary_participant)
+    do(gateway.handle_records(records, binary_participant))
+    gateway.close()
+
+    # only error reports and the order id that doesn't fit the record are pickled
+    assert [frame[0] == ORDERS_FRAME for frame in writer.frames] == [True, True, True, False, False,
+                                                                      True, False, True]
+    engine = MatchingEngine(event_loop, [FrameReader(writer.frames)], [])
+    do(engine.serve())
+    engine.close()
+
+    limit_order_book = engine.stock_exchange.limit_order_book
+    assert [order.order_id for order in limit_order_book.bid_queue] == [-1, 3]
+    assert [order.order_id for order in limit_order_book.ask_queue] == [4]
+    assert [order.order_id for order in engine.stock_exchange.limit_order_books["AAPL"].bid_queue] == [2]
+    assert engine.owners == {("127.0.0.1", 7001): 0, binary_participant: 0}
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from wood.histogram import Histogram
+
+
+def test_percentiles_within_precision():
+    histogram = Histogram(significant_bits=7)
+    for value in range(1, 10001):
+        histogram.record(value)
+
+    assert histogram.count == 10000 and histogram.min == 1 and histogram.max == 10000
+    assert histogram.mean() == 5000.5
+    for percentile, value, count in histogram.percentiles((50, 90, 99.9, 100)):
+        exact = percentile * 100
+        assert exact <= value <= exact * (1 + 2 ** -6)
+        assert count >= exact
+    assert histogram.percentile(100) == 10000
+    assert Histogram().percentile(50) == 0
+
+
+def test_small_values_are_exact_and_histograms_merge():
+    first, second = Histogram(), Histogram()
+    first.record(3, count=9)
+    second.record(1000)
+    second.record(10 ** 9)
+    first.merge(second)
+
+    assert first.count == 11 and first.min == 3 and first.max == 10 ** 9
+    assert first.percentile(50) == 3
+    assert first.percentile(90) == 1000
+    with pytest.raises(ValueError):
+        first.merge(Histogram(significant_bits=5))
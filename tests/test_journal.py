@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import os
+
+from wood.journal import CANCEL, ORDER, TRADE, Journal, decode_event, decode_records, encode_record
+from wood.orders import BidOrder
+from wood.stock_exchange import StockExchange
+from .test_stock_exchange import RecordingPublisher, get_create_order
+
+
+def get_cancel_order(order_id, symbol=None):
+    message = {"message": "cancelOrder", "orderId": order_id}
+    if symbol is not None:
+        message["symbol"] = symbol
+    return json.dumps(message).encode()
+
+
+def test_incomplete_record_ends_journal():
+    order = BidOrder(1.5, 1, ("127.0.0.1", 7000), 100, 10)
+    data = encode_record(ORDER, None, b"order") + encode_record(CANCEL, "OAK", b"1")
+    records, length = decode_records(data + encode_record(ORDER, None, b"cut")[:-1])
+    assert records == [(ORDER, None, b"order"), (CANCEL, "OAK", b"1")]
+    assert length == len(data)
+    damaged = bytearray(data)
+    damaged[-1] ^= 1
+    assert decode_records(bytes(damaged))[0] == [(ORDER, None, b"order")]
+    (kind, symbol, record), = decode_records(Journal.order_record("OAK", order))[0]
+    assert (kind, symbol, decode_event(kind, record)) == (ORDER, "OAK", order)
+    assert decode_event(TRADE, b"1.5|100|10|1|2") == (1.5, 100, 10, 1, 2)
+
+
+def create_stock_exchange(loop, path, durability="batch"):
+    private_publisher, public_publisher = RecordingPublisher(loop), RecordingPublisher(loop)
+    journal = Journal(str(path), loop, durability=durability, commit_interval=0.001)
+    stock_exchange = StockExchange(private_publisher, public_publisher, loop, symbols=["OAK"], journal=journal)
+    stock_exchange.order_book_tick = 0
+    return stock_exchange, private_publisher
+
+
+def book_state(stock_exchange):
+    return {symbol: (list(book.bid_queue), list(book.ask_queue))
+            for symbol, book in stock_exchange.limit_order_books.items()}
+
+
+def test_books_are_rebuilt_from_journal(event_loop, tmpdir):
+    path = tmpdir.join("journal")
+    stock_exchange, _ = create_stock_exchange(event_loop, path)
+    messages = [get_create_order(1, side="SELL", price=101),
+                get_create_order(2, side="SELL", price=100, quantity=5),
+                get_create_order(3, price=102, quantity=8),
+                get_create_order(1, side="SELL", price=110),
+                get_create_order(4, price=95, symbol="OAK"),
+                get_create_order(5, price=96, symbol="OAK"),
+                get_cancel_order(4, symbol="OAK"),
+                get_cancel_order(6)]
+    event_loop.run_until_complete(stock_exchange.handle_orders(messages, ("127.0.0.1", 7000)))
+    state = book_state(stock_exchange)
+    stock_exchange.close()
+
+    kinds = [kind for kind, _, _ in Journal(str(path)).read()]
+    assert kinds == [ORDER, ORDER, ORDER, TRADE, TRADE, ORDER, ORDER, CANCEL]
+    stock_exchange, _ = create_stock_exchange(event_loop, path)
+    assert book_state(stock_exchange) == state
+    assert len(state[None][1]) == 1 and state[None][1][0].quantity == 7
+    assert [order.order_id for order in state["OAK"][0]] == [5]
+    assert not stock_exchange.limit_order_book.pop_changed_levels()
+
+    # journal continues after replayed records
+    event_loop.run_until_complete(stock_exchange.handle_order(get_create_order(7, price=99), "other"))
+    stock_exchange.close()
+    assert len(Journal(str(path)).read()) == 9
+
+
+def test_sync_durability_commits_concurrent_events_together(event_loop, tmpdir):
+    stock_exchange, private_publisher = create_stock_exchange(event_loop, tmpdir.join("journal"), "sync")
+    journal = stock_exchange.journal
+    writes = []
+    write = journal._write
+
+    def record_write(data):
+        writes.append(len(decode_records(data)[0]))
+        write(data)
+
+    journal._write = record_write
+    orders = [stock_exchange.handle_order(get_create_order(order_id, price=order_id), ("127.0.0.1", order_id))
+              for order_id in range(1, 11)]
+    event_loop.run_until_complete(asyncio.gather(*orders, loop=event_loop))
+
+    assert sum(writes) == 10
+    assert len(writes) < 10
+    assert len(private_publisher.batches) == 10
+    stock_exchange.close()
+
+
+def test_partial_writes_are_completed(event_loop, tmpdir, monkeypatch):
+    path = str(tmpdir.join("journal"))
+    journal = Journal(path, event_loop, durability="none")
+    journal.open()
+    write = os.write
+    monkeypatch.setattr(os, "write", lambda fd, data: write(fd, data[:3]))
+    journal._write(encode_record(ORDER, "OAK", b"order") + encode_record(CANCEL, None, b"1"))
+    monkeypatch.undo()
+    journal.close()
+
+    assert Journal(path).read() == [(ORDER, "OAK", b"order"), (CANCEL, None, b"1")]
+
+
+def test_replay_does_not_log_every_order(event_loop, tmpdir, caplog):
+    path = tmpdir.join("journal")
+    stock_exchange, _ = create_stock_exchange(event_loop, path)
+    messages = [get_create_order(1, side="SELL"), get_create_order(2)]
+    event_loop.run_until_complete(stock_exchange.handle_orders(messages, ("127.0.0.1", 7000)))
+    stock_exchange.close()
+    caplog.clear()
+
+    stock_exchange, _ = create_stock_exchange(event_loop, path)
+    stock_exchange.close()
+    assert [record.getMessage() for record in caplog.records if record.name == "wood"] == \
+        ["Replayed 2 events from journal {}".format(path)]
@@ -1,7 +1,13 @@
 # -*- coding: utf-8 -*-
 
-from wood.limit_order_book import LimitOrderBook
-from .utils import get_bid_order, get_ask_order, get_market_bid_order, get_market_ask_order
+from random import Random
+
+import pytest
+
+from wood.limit_order_book import LimitOrderBook, RedisLimitOrderBook, SyncLimitOrderBook
+from wood.priority_queue import RedisPriorityQueue
+from wood.priority_queue.redis_scripts import MAX_QUANTITY
+from .utils import get_bid_order, get_ask_order, get_market_bid_order, get_market_ask_order, redis_command
 
 
 def test_add(event_loop):
@@ -142,3 +148,196 @@ def test_two_market_orders(event_loop):
     assert trades[0].ask_order == ma_order
     assert len(l.bid_queue) == 0
     assert len(l.ask_queue) == 0
+
+
+def test_sync_trade_multiple_orders():
+    l = SyncLimitOrderBook()
+    b_order1 = get_bid_order(order_id=1, price=100, quantity=100)
+    b_order2 = get_bid_order(order_id=2, price=110, quantity=50)
+    b_order3 = get_bid_order(order_id=3, price=120, quantity=150)
+    a_order1 = get_ask_order(price=100, quantity=350)
+    l.add(b_order1)
+    l.add(b_order2)
+    l.add(b_order3)
+    l.add(a_order1)
+    trades = l.match()
+
+    assert [trade.price for trade in trades] == [120, 110, 100]
+    assert [trade.bid_order for trade in trades] == [b_order3, b_order2, b_order1]
+    assert len(l.bid_queue) == 0
+    assert len(l.ask_queue) == 1
+    assert l.ask_queue.peek_nowait().quantity == 50
+
+
+def test_sync_partially_traded_order_keeps_priority():
+    l = SyncLimitOrderBook()
+    l.add(get_bid_order(order_id=1, time=1, price=100, quantity=100))
+    l.add(get_bid_order(order_id=2, time=1, price=100, quantity=100))
+    l.add(get_ask_order(order_id=3, price=100, quantity=30))
+    trades = l.match()
+
+    assert len(trades) == 1
+    assert trades[0].quantity == 30
+    assert l.bid_queue.peek_nowait().order_id == 1
+    assert l.bid_queue.peek_nowait().quantity == 70
+
+
+def test_sync_cancel_order():
+    l = SyncLimitOrderBook()
+    l.add(get_bid_order(order_id=123))
+
+    assert l.cancel(123)
+    assert not l.cancel(123)
+    assert len(l.bid_queue) == 0
+
+
+def test_sync_two_market_orders():
+    l = SyncLimitOrderBook()
+    ma_order = get_market_ask_order(quantity=100)
+    mb_order = get_market_bid_order(order_id=2, quantity=100)
+    l.add(ma_order)
+    l.add(mb_order)
+    trades = l.match()
+
+    assert len(trades) == 1
+    assert trades[0].price == 0
+    assert trades[0].bid_order == mb_order
+    assert trades[0].ask_order == ma_order
+    assert len(l.bid_queue) == 0
+    assert len(l.ask_queue) == 0
+
+
+@pytest.fixture
+def redis_order_book(event_loop):
+    if not pytest.config.getoption("--redis"):
+        pytest.skip("need --redis option to run")
+    l = RedisLimitOrderBook(event_loop)
+    yield l
+    for queue in (l.bid_queue, l.ask_queue):
+        event_loop.run_until_complete(redis_command(l.connections, "delete", *queue.keys))
+    l.close()
+
+
+def get_trade_summary(trades):
+    return [(t.price, t.quantity, t.bid_order.order_id, t.ask_order.order_id) for t in trades]
+
+
+def test_redis_script_trades_like_client_matching(event_loop, redis_order_book):
+    do = event_loop.run_until_complete
+    l = LimitOrderBook(event_loop)
+    random = Random(7)
+    for order_id in range(1, 301):
+        get_order = random.choice((get_bid_order, get_ask_order))
+        order = get_order(order_id=order_id, participant=("127.0.0.1", order_id), time=1000 + order_id,
+                          price=random.randint(95, 105), quantity=random.randint(1, 20))
+        assert get_trade_summary(do(redis_order_book.add_and_match(order))) == \
+            get_trade_summary(do(l.add_and_match(order)))
+    for side in ("bid", "ask"):
+        for price in range(95, 106):
+            assert do(redis_order_book.level_quantity(side, price)) == do(l.level_quantity(side, price))
+    levels = [(side, price) for price in range(95, 106) for side in ("bid", "ask")]
+    assert do(redis_order_book.level_quantities(levels)) == do(l.level_quantities(levels))
+    assert do(l.level_quantities(levels)) == [do(l.level_quantity(side, price)) for side, price in levels]
+    assert redis_order_book.pop_changed_levels() == l.pop_changed_levels()
+
+
+def test_redis_script_partial_fill_keeps_priority(event_loop, redis_order_book):
+    do = event_loop.run_until_complete
+    l = redis_order_book
+    do(l.add_and_match(get_ask_order(order_id=1, time=1001, price=100, quantity=30)))
+    do(l.add_and_match(get_ask_order(order_id=2, time=1002, price=100, quantity=30)))
+    trades = do(l.add_and_match(get_bid_order(order_id=3, time=1003, price=100, quantity=10)))
+
+    assert get_trade_summary(trades) == [(100, 10, 3, 1)]
+    assert trades[0].ask_order.quantity == 30
+    assert do(l.ask_queue.peek_by_id(1)).quantity == 20
+    assert do(l.ask_queue.peek(0)).order_id == 1
+    assert do(l.level_quantity("ask", 100)) == 50
+    assert do(l.bid_queue.cardinality()) == 0
+
+    trades = do(l.add_and_match(get_bid_order(order_id=4, time=1004, price=110, quantity=60)))
+    assert get_trade_summary(trades) == [(110, 20, 4, 1), (110, 30, 4, 2)]
+    assert trades[1].bid_order.quantity == 40
+    assert do(l.bid_queue.peek_by_id(4)).quantity == 10
+    assert do(l.level_quantity("bid", 110)) == 10
+    assert do(l.level_quantity("ask", 100)) == 0
+    assert do(l.cancel(4))
+    assert do(l.level_quantity("bid", 110)) == 0
+
+
+def test_redis_script_market_order(event_loop, redis_order_book):
+    do = event_loop.run_until_complete
+    l = redis_order_book
+    do(l.add_and_match(get_bid_order(order_id=1, time=1001, price=100, quantity=30)))
+    do(l.add_and_match(get_bid_order(order_id=2, time=1002, price=110, quantity=30)))
+    trades = do(l.add_and_match(get_market_ask_order(order_id=3, time=1003, quantity=40)))
+
+    assert get_trade_summary(trades) == [(110, 30, 2, 3), (100, 10, 1, 3)]
+    assert do(l.ask_queue.cardinality()) == 0
+    assert do(l.level_quantity("bid", 100)) == 20
+
+
+def test_redis_match_against_migrated_legacy_book(event_loop, redis_order_book):
+    do = event_loop.run_until_complete
+    l = redis_order_book
+    for order in (get_ask_order(order_id=1, time=1001, price=100, quantity=30),
+                  get_ask_order(order_id=2, time=1002, price=101, quantity=20)):
+        do(redis_command(l.connections, "zadd", l.ask_queue.zset_name, order.price, str(order)))
+    assert do(l.ask_queue.migrate()) == 2
+    assert do(l.level_quantity("ask", 100)) == 30
+
+    trades = do(l.add_and_match(get_bid_order(order_id=3, time=1003, price=101, quantity=40)))
+    assert get_trade_summary(trades) == [(101, 30, 3, 1), (101, 10, 3, 2)]
+    assert do(l.level_quantity("ask", 100)) == 0
+    assert do(l.level_quantity("ask", 101)) == 10
+
+
+def test_redis_script_trades_prices_above_double_precision(event_loop, redis_order_book):
+    do = event_loop.run_until_complete
+    l = redis_order_book
+    low, high = 2 ** 63 + 1, 2 ** 63 + 2
+    do(l.add_and_match(get_ask_order(order_id=1, time=1001, price=high, quantity=30)))
+    assert do(l.add_and_match(get_bid_order(order_id=2, time=1002, price=low, quantity=10))) == []
+    trades = do(l.add_and_match(get_bid_order(order_id=3, time=1003, price=high, quantity=10)))
+
+    assert get_trade_summary(trades) == [(high, 10, 3, 1)]
+    assert do(l.level_quantities([("ask", high), ("bid", low)])) == [20, 10]
+    with pytest.raises(ValueError):
+        do(l.add_and_match(get_bid_order(order_id=4, time=1004, price=high, quantity=MAX_QUANTITY + 1)))
+
+
+def test_redis_cancel_removes_stored_order(event_loop, redis_order_book):
+    do = event_loop.run_until_complete
+    l = redis_order_book
+    do(l.add_and_match(get_ask_order(order_id=1, time=1001, price=100, quantity=30)))
+    do(l.add_and_match(get_bid_order(order_id=2, time=1002, price=100, quantity=10)))
+    # the stale copy with original quantity must not change depth by its quantity
+    stale = get_ask_order(order_id=1, time=1001, price=100, quantity=30)
+    do(l.ask_queue.remove(stale))
+
+    assert do(l.ask_queue.cardinality()) == 0
+    assert do(l.level_quantity("ask", 100)) == 0
+    assert not do(l.cancel(1))
+    assert do(redis_command(l.connections, "hkeys", l.ask_queue.orders_name)) == []
+
+
+@pytest.mark.parametrize("matching", ["script", "client"])
+def test_redis_priority_does_not_depend_on_clock(event_loop, redis_order_book, matching):
+    do = event_loop.run_until_complete
+    l = redis_order_book
+    if matching == "client":
+        l = LimitOrderBook(event_loop, RedisPriorityQueue, "client")
+    # clock of the server of the second order is behind
+    do(l.add_and_match(get_ask_order(order_id=1, time=2001, price=100, quantity=30)))
+    do(l.add_and_match(get_ask_order(order_id=2, time=1001, price=100, quantity=30)))
+    trades = do(l.add_and_match(get_bid_order(order_id=3, time=2002, price=100, quantity=10)))
+    assert get_trade_summary(trades) == [(100, 10, 3, 1)]
+
+    # remainder keeps its place
+    assert do(l.ask_queue.peek(0)) == get_ask_order(order_id=1, time=2001, price=100, quantity=20)
+    trades = do(l.add_and_match(get_bid_order(order_id=4, time=2003, price=100, quantity=30)))
+    assert get_trade_summary(trades) == [(100, 20, 4, 1), (100, 10, 4, 2)]
+    if matching == "client":
+        for queue in (l.bid_queue, l.ask_queue):
+            do(redis_command(l.bid_queue.connections, "delete", *queue.keys))
+        l.close()
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+import random
+
+import pytest
+
+from wood.load_generator import OrderGenerator, generate, parse_mix
+from .test_server import server  # noqa: F401
+
+
+def test_order_generator_mix():
+    assert parse_mix("limit=3, cancel=1") == {"limit": 3.0, "cancel": 1.0}
+    with pytest.raises(ValueError):
+        parse_mix("stop=1")
+    generator = OrderGenerator({"limit": 1, "market": 1, "cancel": 2}, random.Random(0))
+    messages = [generator.next() for _ in range(200)]
+    kinds = {message["message"] for _, message in messages}
+
+    assert kinds == {"createOrder", "marketOrder", "cancelOrder"}
+    created = set()
+    for (kind, order_id), message in messages:
+        assert message["orderId"] == order_id
+        if kind == "cancel":
+            # only resting limit orders are cancelled, each at most once
+            assert order_id in created
+            created.remove(order_id)
+        elif message["message"] == "createOrder":
+            created.add(order_id)
+
+
+def test_every_message_gets_correlated_reply(server):
+    loop = server.loop
+    stats, histogram = loop.run_until_complete(generate(loop, "127.0.0.1", server.private_port, connections=5,
+                                                        rate=500, duration=0.2, mix=parse_mix("limit=2,cancel=1"),
+                                                        wait=2, seed=1))
+
+    assert stats["connections"] == 5
+    assert stats["sent"] > 0 and stats["lost"] == 0
+    assert stats["replies"] == stats["sent"] == histogram.count
+    assert 0 < histogram.min <= histogram.max
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from wood.orders import AskOrder, MarketBidOrder
+from wood.priority_queue.order_encoding import decode_order, encode_order, is_legacy, sequence
+from .utils import get_bid_order, get_ask_order, get_market_bid_order, get_market_ask_order
+
+orders = [
+    get_bid_order(participant=("127.0.0.1", 7001)),
+    get_ask_order(order_id=-5, participant=("::1", 7003, 0, 0, "binary"), time=1.25),
+    get_market_bid_order(order_id=2 ** 70, participant="a|b,c"),
+    get_market_ask_order(participant=()),
+]
+
+
+@pytest.mark.parametrize("order", orders)
+def test_encode_decode(order):
+    record = encode_order(order)
+    decoded = decode_order(record)
+
+    assert not is_legacy(record)
+    assert decoded == order
+    assert type(decoded) is type(order)
+    assert type(decoded.participant) is type(order.participant)
+    assert encode_order(decoded) == record
+
+
+def test_encoding_is_compact():
+    order = get_bid_order(participant=("127.0.0.1", 7001))
+
+    assert encode_order(order, 7) == b"3|1ffffffffffffff9b00000000000007|B|1.0|1|100|50|ts127.0.0.1,i7001"
+    assert sequence(encode_order(order, 7)) == 7
+
+
+def test_records_are_sorted_by_price_and_sequence():
+    # sequence is given by order_id, time of orders doesn't matter
+    bids = [
+        get_market_bid_order(order_id=1, time=2),
+        get_market_bid_order(order_id=2, time=1),
+        get_bid_order(order_id=3, price=256, time=4),
+        get_bid_order(order_id=4, price=100, time=1),
+        get_bid_order(order_id=5, price=100, time=0.5),
+        get_bid_order(order_id=6, price=99, time=0.5),
+    ]
+    asks = [
+        get_market_ask_order(order_id=1, time=10),
+        get_ask_order(order_id=2, price=9, time=4),
+        get_ask_order(order_id=3, price=10, time=100),
+        get_ask_order(order_id=4, price=10, time=1),
+        get_ask_order(order_id=5, price=100, time=0.5),
+    ]
+    for orders in (bids, asks):
+        assert sorted(orders, key=lambda order: encode_order(order, order.order_id)) == orders
+
+
+def test_decode_version_2():
+    record = b"2|1ffffffffffffff9b000000000f4240|B|1.0|1|100|50|ts127.0.0.1,i7001"
+
+    assert is_legacy(record)
+    assert decode_order(record) == get_bid_order(participant=("127.0.0.1", 7001))
+
+
+def test_decode_version_1():
+    record = b"1|B|1.0|1|100|50|ts127.0.0.1,i7001"
+
+    assert is_legacy(record)
+    assert decode_order(record) == get_bid_order(participant=("127.0.0.1", 7001))
+
+
+@pytest.mark.parametrize("order", orders)
+def test_decode_legacy(order):
+    record = str(order).encode()
+
+    assert is_legacy(record)
+    assert decode_order(record) == order
+
+
+def test_legacy_record_is_not_evaluated():
+    with pytest.raises(ValueError):
+        decode_order(b"__import__('os').system('true')")
+    with pytest.raises(ValueError):
+        decode_order(b"AskOrder(time=__import__('os').getpid(), order_id=1, participant=1, price=1, quantity=1)")
+
+
+def test_tuple_participant_with_separator_can_not_be_encoded():
+    with pytest.raises(ValueError):
+        encode_order(AskOrder(1, 1, ("a,b", 1), 100, 1))
+    assert decode_order(encode_order(MarketBidOrder(1, 1, "a,b", -1, 1))).participant == "a,b"
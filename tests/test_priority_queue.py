@@ -3,10 +3,11 @@
 import pytest
 
 from wood.priority_queue import MemoryPriorityQueue
+from wood.priority_queue import LadderPriorityQueue
 from wood.priority_queue import RedisPriorityQueue
-from .utils import get_bid_order
+from .utils import get_bid_order, get_ask_order, get_market_bid_order, redis_command
 
-priority_queues = [MemoryPriorityQueue]
+priority_queues = [MemoryPriorityQueue, LadderPriorityQueue]
 if pytest.config.getoption("--redis"):
     priority_queues.append(RedisPriorityQueue)
 
@@ -91,7 +92,7 @@ def test_peek_by_id(event_loop, priority_queue):
     assert order.price == 200
 
 
-@pytest.mark.parametrize("priority_queue", [MemoryPriorityQueue])
+@pytest.mark.parametrize("priority_queue", [MemoryPriorityQueue, LadderPriorityQueue])
 # RedisPriorityQueue does not raise the exception
 def test_non_unique_order_id_raises_exception(event_loop, priority_queue):
     do = event_loop.run_until_complete
@@ -101,3 +102,142 @@ def test_non_unique_order_id_raises_exception(event_loop, priority_queue):
     with pytest.raises(ValueError):
         do(q.put(get_bid_order(order_id=1, price=100)))
 
+
+def test_ladder_ask_side_get_lowest_price(event_loop):
+    do = event_loop.run_until_complete
+    q = LadderPriorityQueue(event_loop)
+    do(q.put(get_ask_order(order_id=1, price=200)))
+    do(q.put(get_ask_order(order_id=2, price=100)))
+    do(q.put(get_ask_order(order_id=3, price=300)))
+
+    assert q.best_price() == 100
+    assert [q.get_nowait().order_id for _ in range(3)] == [2, 1, 3]
+    assert q.get_nowait() is None
+
+
+def test_ladder_market_orders_on_top(event_loop):
+    do = event_loop.run_until_complete
+    q = LadderPriorityQueue(event_loop, reverse=True)
+    do(q.put(get_bid_order(order_id=1, price=300)))
+    do(q.put(get_market_bid_order(order_id=2, time=2)))
+    do(q.put(get_market_bid_order(order_id=3, time=1)))
+
+    assert [order.order_id for order in q] == [3, 2, 1]
+
+
+def test_ladder_remove_keeps_levels_consistent(event_loop):
+    q = LadderPriorityQueue(event_loop, reverse=True)
+    orders = [get_bid_order(order_id=i, time=i, price=100 * (i % 3 + 1)) for i in range(1, 7)]
+    for order in orders:
+        q.put_nowait(order)
+
+    q.remove_nowait(orders[2])
+    q.remove_nowait(orders[5])
+    q.remove_nowait(orders[1])
+
+    assert len(q) == 3
+    assert q.best_price() == 300
+    assert q.peek_by_id_nowait(3) is None
+    assert [order.order_id for order in q] == [5, 1, 4]
+
+
+def test_ladder_reinserted_order_keeps_time_priority(event_loop):
+    q = LadderPriorityQueue(event_loop, reverse=True)
+    q.put_nowait(get_bid_order(order_id=1, time=1))
+    q.put_nowait(get_bid_order(order_id=2, time=2))
+    order = q.get_nowait()
+    q.put_nowait(order._replace(quantity=10))
+    q.put_nowait(get_bid_order(order_id=3, time=1.5))
+
+    assert [order.order_id for order in q] == [1, 3, 2]
+
+
+def test_ladder_load_keeps_priority_and_levels(event_loop):
+    q = LadderPriorityQueue(event_loop, reverse=True)
+    for i in range(1, 7):
+        q.put_nowait(get_bid_order(order_id=i, time=i, price=100 * (i % 3 + 1), quantity=i))
+    q.put_nowait(get_market_bid_order(order_id=7, time=7))
+
+    loaded = LadderPriorityQueue(event_loop, reverse=True)
+    loaded.load(q)
+
+    assert list(loaded) == list(q)
+    assert loaded.best_price() == q.best_price()
+    assert loaded.level_quantity_nowait(100) == q.level_quantity_nowait(100) == 9
+    loaded.remove_nowait(loaded.peek_by_id_nowait(2))
+    assert loaded.best_price() == 300
+    with pytest.raises(ValueError):
+        loaded.load([])
+
+
+@pytest.mark.skipif(not pytest.config.getoption("--redis"), reason="need --redis option to run")
+def test_redis_migrate_legacy_orders(event_loop):
+    do = event_loop.run_until_complete
+    q = RedisPriorityQueue(event_loop, reverse=True)
+    do(q.connect())
+    legacy = get_bid_order(order_id=1, participant=("127.0.0.1", 7001), price=100)
+    removed = get_bid_order(order_id=2, participant=("127.0.0.1", 7001), price=90)
+    for order in (legacy, removed):
+        do(redis_command(q.connections, "zadd", q.zset_name, order.price, str(order)))
+    do(q.remove(removed))
+    do(q.put(get_bid_order(order_id=3, price=80)))
+
+    assert do(q.peek_by_id(1)) is None
+    assert do(q.migrate()) == 1
+    assert do(q.migrate()) == 0
+    assert do(q.peek_by_id(1)) == legacy
+    assert do(q.cardinality()) == 2
+    assert do(q.get()) == legacy
+    q.close()
+
+
+@pytest.mark.skipif(not pytest.config.getoption("--redis"), reason="need --redis option to run")
+def test_redis_connect_migrates_legacy_orders_at_price_0(event_loop):
+    do = event_loop.run_until_complete
+    q = RedisPriorityQueue(event_loop, reverse=True)
+    legacy = get_bid_order(order_id=1, participant=("127.0.0.1", 7001), price=0)
+    do(q.connections.connect())
+    do(redis_command(q.connections, "zadd", q.zset_name, legacy.price, str(legacy)))
+    do(q.connect())
+
+    assert do(q.peek_by_id(1)) == legacy
+    assert do(q.level_quantity(0)) == legacy.quantity
+    assert do(q.get()) == legacy
+    q.close()
+
+
+@pytest.mark.skipif(not pytest.config.getoption("--redis"), reason="need --redis option to run")
+def test_redis_order_id_index(event_loop):
+    do = event_loop.run_until_complete
+    q = RedisPriorityQueue(event_loop, reverse=True)
+    do(q.connect())
+    orders = [get_bid_order(order_id=i, price=100 + i, time=i) for i in range(1, 4)]
+    for order in orders:
+        do(q.put(order))
+    do(q.remove(orders[1]))
+
+    assert do(q.get()) == orders[2]
+    assert do(q.peek_by_id(3)) is None
+    assert do(q.peek_by_id(2)) is None
+    assert do(q.peek_by_id(1)) == orders[0]
+    assert do(redis_command(q.connections, "hkeys", q.orders_name)) == [b"1"]
+    q.close()
+
+
+@pytest.mark.skipif(not pytest.config.getoption("--redis"), reason="need --redis option to run")
+def test_redis_connect_migrates_version_2_orders(event_loop):
+    do = event_loop.run_until_complete
+    q = RedisPriorityQueue(event_loop)
+    do(q.connect())
+    do(q.put(get_ask_order(order_id=1, price=100, time=5)))
+    # older version stored time in priority
+    record = b"2|1000000000000006400000000989680|A|10.0|2|100|50|s1"
+    do(redis_command(q.connections, "zadd", q.zset_name, 0, record))
+    do(q.connect())
+
+    assert do(q.peek(0)).order_id == 1
+    assert do(q.peek_by_id(2)) == get_ask_order(order_id=2, price=100, time=10, participant="1")
+    assert do(q.level_quantity(100)) == 100
+    assert do(q.get()).order_id == 1
+    assert do(q.get()).order_id == 2
+    q.close()
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import pytest
-from wood.pubsub import redis_pubsub_factory
+from wood.pubsub import asyncio_queue_pubsub_factory, direct_pubsub_factory, redis_pubsub_factory
 
 use_redis = pytest.mark.skipif(not pytest.config.getoption("--redis"), reason="need --runslow option to run")
 
@@ -16,7 +16,7 @@ def test_redis_pubsub(event_loop):
     subscriber.subscribe(channel)
     event_loop.run_until_complete(publisher.publish(channel, publish_message))
     _, response_message = event_loop.run_until_complete(subscriber.get())
-    assert publish_message == response_message
+    assert publish_message.encode() == response_message
 
 
 @use_redis
@@ -28,7 +28,7 @@ def test_redis_dont_get_unsubscribed_messages(event_loop):
     event_loop.run_until_complete(publisher.publish('1', 'Message#1'))
     event_loop.run_until_complete(publisher.publish('2', 'Message#2'))
     _, response_message = event_loop.run_until_complete(subscriber.get())
-    assert "Message#2" == response_message
+    assert b"Message#2" == response_message
 
 
 @use_redis
@@ -42,5 +42,90 @@ def test_redis_subscribe_to_multiple_channels(event_loop):
     event_loop.run_until_complete(publisher.publish('2', 'Message#2'))
     channel1, response_message1 = event_loop.run_until_complete(subscriber.get())
     channel2, response_message2 = event_loop.run_until_complete(subscriber.get())
-    assert "Message#1" == response_message1
-    assert "Message#2" == response_message2
+    assert b"Message#1" == response_message1
+    assert b"Message#2" == response_message2
+
+
+def test_direct_pubsub_delivers_during_publish(event_loop):
+    subscriber, publisher = direct_pubsub_factory(event_loop)
+    received = []
+    event_loop.run_until_complete(subscriber.listen(lambda channel, message: received.append((channel, message))))
+    subscriber.subscribe(1)
+    event_loop.run_until_complete(publisher.publish(1, b"Message#1"))
+    assert received == [("1", b"Message#1")]
+
+
+def test_direct_pubsub_drops_unsubscribed_messages(event_loop):
+    subscriber, publisher = direct_pubsub_factory(event_loop)
+    received = []
+    event_loop.run_until_complete(subscriber.listen(lambda channel, message: received.append((channel, message))))
+    subscriber.subscribe("2")
+    event_loop.run_until_complete(publisher.publish("1", b"Message#1"))
+    event_loop.run_until_complete(publisher.publish("2", b"Message#2"))
+    subscriber.unsubscribe("2")
+    event_loop.run_until_complete(publisher.publish("2", b"Message#3"))
+    assert received == [("2", b"Message#2")]
+
+
+def test_direct_pubsub_get_before_listen(event_loop):
+    subscriber, publisher = direct_pubsub_factory(event_loop)
+    subscriber.subscribe(1)
+    event_loop.run_until_complete(publisher.publish(1, b"Message#1"))
+    event_loop.run_until_complete(publisher.publish(1, b"Message#2"))
+    assert event_loop.run_until_complete(subscriber.get()) == ("1", b"Message#1")
+    received = []
+    event_loop.run_until_complete(subscriber.listen(lambda channel, message: received.append((channel, message))))
+    event_loop.run_until_complete(publisher.publish(1, b"Message#3"))
+    assert received == [("1", b"Message#2"), ("1", b"Message#3")]
+
+
+def test_asyncio_queue_drops_unsubscribed_messages_on_publish(event_loop):
+    subscriber, publisher = asyncio_queue_pubsub_factory(event_loop)
+    subscriber.subscribe("2")
+    event_loop.run_until_complete(publisher.publish("1", b"Message#1"))
+    event_loop.run_until_complete(publisher.publish("2", b"Message#2"))
+    assert subscriber._queue.qsize() == 1
+    assert event_loop.run_until_complete(subscriber.get()) == ("2", b"Message#2")
+
+
+def test_direct_publish_many(event_loop):
+    subscriber, publisher = direct_pubsub_factory(event_loop)
+    received = []
+    event_loop.run_until_complete(subscriber.listen(lambda channel, message: received.append((channel, message))))
+    subscriber.subscribe("1")
+    event_loop.run_until_complete(publisher.publish_many([(1, b"Message#1"), (2, b"Message#2"), (1, b"Message#3")]))
+    assert received == [("1", b"Message#1"), ("1", b"Message#3")]
+
+
+@use_redis
+def test_redis_publish_many(event_loop):
+    subscriber, publisher = redis_pubsub_factory(event_loop)
+    event_loop.run_until_complete(subscriber.connect())
+    event_loop.run_until_complete(publisher.connect())
+    subscriber.subscribe('1')
+    event_loop.run_until_complete(publisher.publish_many([('1', 'Message#1'), ('2', 'Message#2'), ('1', 'Message#3')]))
+    _, response_message1 = event_loop.run_until_complete(subscriber.get())
+    _, response_message2 = event_loop.run_until_complete(subscriber.get())
+    assert b"Message#1" == response_message1
+    assert b"Message#3" == response_message2
+
+
+@use_redis
+def test_redis_subscriptions_run_in_order(event_loop):
+    subscriber, publisher = redis_pubsub_factory(event_loop)
+    event_loop.run_until_complete(subscriber.connect())
+    event_loop.run_until_complete(publisher.connect())
+    subscriber.subscribe('1')
+    subscriber.unsubscribe('1')
+    subscriber.unsubscribe('1')
+    subscriber.subscribe('2')
+    subscriber.unsubscribe('2')
+    subscriber.subscribe('2')
+    event_loop.run_until_complete(subscriber.wait_subscribed('1'))
+    event_loop.run_until_complete(subscriber.wait_subscribed('2'))
+    event_loop.run_until_complete(publisher.publish_many([('1', 'Message#1'), ('2', 'Message#2')]))
+    channel, response_message = event_loop.run_until_complete(subscriber.get())
+    assert (channel, response_message) == ('2', b"Message#2")
+    assert subscriber.subscribed == {'2'}
+    subscriber.close()
+    publisher.close()
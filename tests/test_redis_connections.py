@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+import pytest
+
+from wood.pubsub import redis_pubsub_factory
+from wood.redis_connections import get_connections
+
+use_redis = pytest.mark.skipif(not pytest.config.getoption("--redis"), reason="need --redis option to run")
+
+
+@use_redis
+def test_connections_are_shared_by_loop(event_loop):
+    connections = get_connections(event_loop)
+    subscriber, publisher = redis_pubsub_factory(event_loop)
+    event_loop.run_until_complete(subscriber.connect())
+    event_loop.run_until_complete(publisher.connect())
+
+    assert get_connections(event_loop) is connections
+    assert connections.users == 4
+    assert connections.metrics()["channels"] == 0
+    connections.release()
+    subscriber.close()
+    publisher.close()
+    assert not connections.closed
+    connections.release()
+    assert connections.closed
+    assert get_connections(event_loop) is not connections
+
+
+@use_redis
+def test_concurrent_commands_use_more_connections(event_loop):
+    connections = get_connections(event_loop)
+    event_loop.run_until_complete(connections.connect())
+
+    async def ping():
+        async with connections.command() as redis:
+            return await redis.ping()
+
+    results = event_loop.run_until_complete(asyncio.gather(*[ping() for _ in range(5)], loop=event_loop))
+    metrics = connections.metrics()
+
+    assert results == [b"PONG"] * 5
+    assert metrics["acquired"] == 5
+    assert 1 < metrics["pool_size"] <= 5
+    assert metrics["pool_used"] == 0
+    connections.release()
+
+
+@use_redis
+def test_subscriber_receives_only_subscribed_channels(event_loop):
+    connections = get_connections(event_loop)
+    subscriber, publisher = redis_pubsub_factory(event_loop)
+    event_loop.run_until_complete(subscriber.connect())
+    event_loop.run_until_complete(publisher.connect())
+
+    async def receive():
+        subscriber.subscribe("mine")
+        await subscriber.wait_subscribed("mine")
+        channels = connections.metrics()["channels"]
+        await publisher.publish("other", b"not for me")
+        await publisher.publish("mine", b"for me")
+        message = await asyncio.wait_for(subscriber.get(), 1, loop=event_loop)
+        subscriber.unsubscribe("mine")
+        return channels, message
+
+    channels, message = event_loop.run_until_complete(receive())
+    event_loop.run_until_complete(asyncio.sleep(0.05, loop=event_loop))
+
+    assert channels == 1
+    assert message == ("mine", b"for me")
+    assert connections.metrics()["dispatched"] == 1
+    assert connections.metrics()["channels"] == 0
+    subscriber.close()
+    publisher.close()
+    connections.release()
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+from wood.capture import Capture
+from wood.replay import DEFAULT_PARTICIPANT, Replay, parse_line, read_recording
+from .test_stock_exchange import get_create_order
+
+RECORDING = b"""
+1000.5 alice {"message": "createOrder", "orderId": 1, "side": "SELL", "price": 101, "quantity": 10}
+1001.0 bob {"message": "createOrder", "orderId": 2, "side": "BUY", "price": 102, "quantity": 4}
+1001.5 bob {"message": "createOrder", "orderId": 3, "side": "BUY", "price": 99, "quantity": 5, "symbol": "OAK"}
+1002.0 alice {"message": "cancelOrder", "orderId": 1}
+1002.5 bob {"message": "cancelOrder", "orderId": 7}
+""" + get_create_order(4, side="SELL", price=98, quantity=2, symbol="OAK") + b"\n"
+
+
+def test_parse_line():
+    assert parse_line(b"\n") is None
+    assert parse_line(b'1.5 bob {"message": "x y"}\n') == (1.5, "bob", b'{"message": "x y"}')
+    assert parse_line(b'{"message": "x"}\n') == (None, DEFAULT_PARTICIPANT, b'{"message": "x"}')
+
+
+def test_capture_is_read_as_recording(tmpdir):
+    path = str(tmpdir.join("capture"))
+    capture = Capture(path)
+    capture.record(capture.connection_id(), [b'{"message": "x"}'], timestamp=1.5)
+    capture.close()
+
+    assert read_recording(path) == [(1.5, "connection-1", b'{"message": "x"}')]
+
+
+def test_replay_is_deterministic(event_loop, tmpdir):
+    path = tmpdir.join("recording")
+    path.write_binary(RECORDING)
+    recording = read_recording(str(path))
+    results = []
+    for _ in range(2):
+        replay = Replay(event_loop, symbols=["OAK"])
+        stats = event_loop.run_until_complete(replay.run(recording))
+        results.append((replay.trades(), replay.books(), replay.private_publisher.count))
+        replay.close()
+
+    assert results[0] == results[1]
+    assert stats["messages"] == 6 and stats["trades"] == 2
+    assert results[0][0] == [{"type": "trade", "time": 1001.0, "price": 102, "quantity": 4},
+                             {"type": "trade", "time": 1002.500001, "price": 99, "quantity": 2, "symbol": "OAK"}]
+    book = replay.stock_exchange.limit_order_books["OAK"]
+    assert not replay.stock_exchange.limit_order_book.ask_queue
+    assert [(order.time, order.quantity) for order in book.bid_queue] == [(1001.5, 3)]
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+import pytest
+
+from wood.ring_buffer import RingBuffer, RingReader, RingWriter, channel, is_supported_machine
+
+
+def test_frames_are_read_in_order():
+    ring = RingBuffer(64)
+    assert ring.get() is None
+    assert ring.put(b"first")
+    assert ring.put(b"")
+    assert ring.put(b"second")
+    assert [ring.get(), ring.get(), ring.get(), ring.get()] == [b"first", b"", b"second", None]
+    assert len(ring) == 0
+
+
+def test_frames_wrap_around():
+    ring = RingBuffer(32)
+    for i in range(20):
+        data = "frame {:02}".format(i).encode()
+        assert ring.put(data)
+        assert ring.put(data + b"!")
+        assert ring.get() == data
+        assert ring.get() == data + b"!"
+
+
+def test_full_buffer():
+    ring = RingBuffer(32)
+    assert ring.put(b"x" * 12)
+    assert ring.put(b"y" * 12)
+    assert not ring.put(b"z")
+    assert ring.get() == b"x" * 12
+    assert ring.put(b"z")
+    with pytest.raises(ValueError):
+        ring.put(b"x" * 29)
+
+
+def test_reader_waits_for_writer(event_loop):
+    ring, producer, consumer = channel(32)
+    writer, reader = RingWriter(ring, producer, event_loop), RingReader(ring, consumer, event_loop)
+
+    async def write():
+        for i in range(10):
+            # the buffer is full after two frames, so the writer waits for the reader
+            await writer.write(bytes([i]) * 10)
+        writer.close()
+
+    async def read():
+        frames = []
+        batch = True
+        while batch:
+            batch = await reader.read()
+            frames.extend(batch)
+        return frames
+
+    frames, _ = event_loop.run_until_complete(asyncio.gather(read(), write(), loop=event_loop))
+    assert frames == [bytes([i]) * 10 for i in range(10)]
+    reader.close()
+
+
+def test_supported_machines():
+    assert is_supported_machine("x86_64")
+    assert is_supported_machine("AMD64")
+    assert not is_supported_machine("aarch64")
@@ -5,7 +5,11 @@ import json
 
 import pytest
 
-from wood.server import StockServer
+from wood import binary_protocol, settings
+from wood.clients import PrivateClients
+from wood.pubsub import asyncio_queue_pubsub_factory
+from wood.server import StockServer, PrivateServerProtocol
+from wood.stock_exchange import StockExchange
 
 use_multiple_servers = [False]
 if pytest.config.getoption("--redis"):
@@ -27,7 +31,8 @@ def server(request, event_loop, unused_tcp_port_factory):
     _server = StockServer(public_port=unused_tcp_port_factory(),
                           private_port=unused_tcp_port_factory(),
                           loop=event_loop,
-                          multiple_servers=request.param)
+                          multiple_servers=request.param,
+                          binary_port=unused_tcp_port_factory())
     _server.initialize_tasks()
     yield _server
     _server.shutdown_tasks()
@@ -36,7 +41,7 @@ def server(request, event_loop, unused_tcp_port_factory):
 @asyncio.coroutine
 async def send_message(port, loop, message, interface='127.0.0.1', messages=1):
     reader, writer = await asyncio.open_connection(interface, port, loop=loop)
-    writer.write(message.encode())
+    writer.write(message.encode() + b"\n")
     await writer.drain()
     return await (listen(port, loop, interface, messages, reader, writer))
 
@@ -55,6 +60,139 @@ async def listen(port, loop, interface='127.0.0.1', messages=1, reader=None, wri
     return responses
 
 
+@asyncio.coroutine
+async def listen_all(port, loop, interface='127.0.0.1', timeout=.1):
+    """ Return all messages until no message comes for `timeout` seconds. """
+    reader, writer = await asyncio.open_connection(interface, port, loop=loop)
+    responses = []
+    try:
+        while True:
+            data = await asyncio.wait_for(reader.readline(), timeout)
+            responses.append(json.loads(data.decode()))
+    except asyncio.TimeoutError:
+        return responses
+
+
+def test_pipelined_orders_in_one_write(server):
+    loop = server.loop
+    message = "\n".join(get_create_order(order_id=i, price=100 + i) for i in range(1, 4))
+    responses = loop.run_until_complete(send_message(server.private_port, loop, message, messages=3))
+
+    assert [response["orderId"] for response in responses] == [1, 2, 3]
+    assert all(response["report"] == "NEW" for response in responses)
+
+
+def test_message_split_across_writes(server):
+    loop = server.loop
+    message = get_create_order().encode() + b"\n"
+
+    @asyncio.coroutine
+    async def send_in_parts():
+        reader, writer = await asyncio.open_connection('127.0.0.1', server.private_port, loop=loop)
+        writer.write(message[:10])
+        await writer.drain()
+        await asyncio.sleep(.01, loop=loop)
+        writer.write(message[10:])
+        await writer.drain()
+        return await listen(server.private_port, loop, reader=reader, writer=writer)
+
+    responses = loop.run_until_complete(send_in_parts())
+
+    assert responses[0]["report"] == "NEW"
+    assert responses[0]["orderId"] == 1
+
+
+class FakeTransport:
+    def __init__(self):
+        self.paused = False
+        self.closed = False
+
+    def get_extra_info(self, name):
+        return ("127.0.0.1", 12345)
+
+    def pause_reading(self):
+        self.paused = True
+
+    def resume_reading(self):
+        self.paused = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_private_connection_backpressure(event_loop, monkeypatch):
+    monkeypatch.setitem(settings.private_queue, "high_water", 4)
+    monkeypatch.setitem(settings.private_queue, "low_water", 1)
+    handled = []
+    release = asyncio.Event(loop=event_loop)
+
+    class SlowStockExchange:
+        @asyncio.coroutine
+        async def handle_orders(self, messages, participant):
+            await release.wait()
+            handled.extend(messages)
+
+        def disconnect(self, participant):
+            pass
+
+    subscriber, _ = asyncio_queue_pubsub_factory(event_loop)
+    protocol = PrivateServerProtocol(PrivateClients(subscriber), SlowStockExchange(), event_loop)
+    transport = FakeTransport()
+    protocol.connection_made(transport)
+    protocol.data_received(b"1\n2\n")
+    assert not transport.paused
+    protocol.data_received(b"3\n4\n5")
+    assert transport.paused
+
+    release.set()
+    event_loop.run_until_complete(asyncio.sleep(.01, loop=event_loop))
+    assert not transport.paused
+    assert handled == [b"1", b"2", b"3", b"4"]
+    protocol.connection_lost(None)
+
+
+def test_orders_sent_before_disconnect_are_processed(event_loop, unused_tcp_port_factory, tmpdir, monkeypatch):
+    # every order waits for journal, so messages are still queued when connection is lost
+    monkeypatch.setitem(settings.journal, "durability", "sync")
+    stock_server = StockServer(public_port=unused_tcp_port_factory(), private_port=unused_tcp_port_factory(),
+                               loop=event_loop, journal=str(tmpdir.join("journal")))
+    stock_server.initialize_tasks()
+    book = stock_server.stock_exchange.limit_order_book
+
+    @asyncio.coroutine
+    async def send_and_disconnect():
+        reader, writer = await asyncio.open_connection('127.0.0.1', stock_server.private_port, loop=event_loop)
+        writer.write("\n".join(get_create_order(order_id=i, price=i % 100 + 1) for i in range(2000)).encode() +
+                     b"\n")
+        # closing socket with unread reports would reset the connection and drop orders in kernel
+        writer.write_eof()
+        await reader.read()
+        writer.close()
+        # worker stops after it processed all orders
+        for _ in range(500):
+            if not stock_server.private_clients.workers:
+                return
+            await asyncio.sleep(0.01, loop=event_loop)
+
+    event_loop.run_until_complete(send_and_disconnect())
+    assert len(book.bid_queue) == 2000
+    assert not stock_server.private_clients.workers
+    stock_server.shutdown_tasks()
+
+
+def test_too_long_message_closes_connection(event_loop, monkeypatch):
+    monkeypatch.setattr(settings, "max_message_length", 8)
+    subscriber, _ = asyncio_queue_pubsub_factory(event_loop)
+    protocol = PrivateServerProtocol(PrivateClients(subscriber), StockExchange(None, None, event_loop), event_loop)
+    transport = FakeTransport()
+    protocol.connection_made(transport)
+    protocol.data_received(b"12345678\n1234")
+    assert not transport.closed
+    protocol.data_received(b"56789")
+    assert transport.closed
+    protocol.connection_lost(None)
+
+
 def test_accepts_only_json(server):
     loop = server.loop
     responses = loop.run_until_complete(send_message(server.private_port, loop, "Hello World!"))
@@ -110,11 +248,24 @@ def test_cancel_order(server):
     assert response_cancel[0]["report"] == "CANCELLED"
 
 
+def apply_public_messages(messages):
+    """ Apply public messages to order book like `MarketModel` of datastream client does. """
+    book = {"bid": {}, "ask": {}}
+    trades = []
+    for message in messages:
+        if message["type"] == "trade":
+            trades.append((message["price"], message["quantity"]))
+        else:
+            book[message["side"]][message["price"]] = message["quantity"]
+    return book, trades
+
+
 def test_trade(server):
     loop = server.loop
+    server.stock_exchange.order_book_tick = 0
     message_buy = get_create_order(price=110, quantity=110)
     message_sell = get_create_order(order_id=2, side="SELL", price=100, quantity=100)
-    task_public = loop.create_task(listen(server.public_port, loop, messages=3))
+    task_public = loop.create_task(listen_all(server.public_port, loop))
     task_buy = loop.create_task(send_message(server.private_port, loop, message_buy, messages=2))
     task_sell = loop.create_task(send_message(server.private_port, loop, message_sell, messages=2))
     responses_buy = loop.run_until_complete(task_buy)
@@ -127,16 +278,61 @@ def test_trade(server):
     assert responses_sell[0]["report"] == "NEW"
     assert responses_sell[1]["report"] == "FILL"
 
-    assert responses_public[0]["type"] == "orderbook"
-    assert responses_public[0]["side"] == "bid"
-    assert responses_public[0]["price"] == 110
-    assert responses_public[0]["quantity"] == 110
+    book, trades = apply_public_messages(responses_public)
+    assert book == {"bid": {110: 10}, "ask": {100: 0}}
+    assert trades == [(110, 100)]
 
-    assert responses_public[1]["type"] == "orderbook"
-    assert responses_public[1]["side"] == "ask"
-    assert responses_public[1]["price"] == 100
-    assert responses_public[1]["quantity"] == 100
 
-    assert responses_public[2]["type"] == "trade"
-    assert responses_public[2]["price"] == 110
-    assert responses_public[2]["quantity"] == 100
+def test_order_book_changes_are_conflated(server):
+    loop = server.loop
+    server.stock_exchange.order_book_tick = .02
+    messages = [get_create_order(order_id=i, price=100, quantity=10 * i) for i in range(1, 4)]
+    messages.append(json.dumps(dict(message="cancelOrder", orderId=1)))
+    task_public = loop.create_task(listen_all(server.public_port, loop))
+    loop.run_until_complete(send_message(server.private_port, loop, "\n".join(messages), messages=4))
+    responses_public = loop.run_until_complete(task_public)
+
+    assert responses_public == [{"type": "orderbook", "side": "bid", "price": 100, "quantity": 50}]
+
+
+def test_trade_with_participant_that_left(server):
+    loop = server.loop
+    message_buy = get_create_order(price=110, quantity=100)
+    message_sell = get_create_order(order_id=2, side="SELL", price=100, quantity=100)
+    responses_buy = loop.run_until_complete(send_message(server.private_port, loop, message_buy))
+    loop.run_until_complete(asyncio.sleep(.01, loop=loop))
+    responses_sell = loop.run_until_complete(send_message(server.private_port, loop, message_sell, messages=2))
+    message_buy = get_create_order(order_id=3, price=90, quantity=10)
+    responses_next = loop.run_until_complete(send_message(server.private_port, loop, message_buy))
+
+    assert responses_buy[0]["report"] == "NEW"
+    assert responses_sell[1]["report"] == "FILL"
+    assert responses_next[0]["report"] == "NEW"
+
+
+def test_binary_protocol_trade_with_json_client(server):
+    loop = server.loop
+    report_size = binary_protocol.execution_report_record.size
+
+    @asyncio.coroutine
+    async def send_binary(data, reports):
+        reader, writer = await asyncio.open_connection('127.0.0.1', server.binary_port, loop=loop)
+        writer.write(data)
+        await writer.drain()
+        response = await asyncio.wait_for(reader.readexactly(reports * report_size), .1)
+        return binary_protocol.decode_execution_reports(response)
+
+    buy = binary_protocol.encode_create_order(1, binary_protocol.BUY, 110, 100)
+    cancel = binary_protocol.encode_cancel_order(3)
+    task_binary = loop.create_task(send_binary(buy + cancel, 3))
+    message_sell = get_create_order(order_id=2, side="SELL", price=100, quantity=100)
+    loop.run_until_complete(asyncio.sleep(.01, loop=loop))
+    responses_sell = loop.run_until_complete(send_message(server.private_port, loop, message_sell, messages=2))
+    binary_reports = loop.run_until_complete(task_binary)
+
+    assert binary_reports == [binary_protocol.ExecutionReport(1, "NEW", 0, 0),
+                              binary_protocol.ExecutionReport(3, "REJECTED", 0, 0),
+                              binary_protocol.ExecutionReport(1, "FILL", 110, 100)]
+    assert responses_sell[0]["report"] == "NEW"
+    assert responses_sell[1]["report"] == "FILL"
+    assert responses_sell[1]["price"] == 110
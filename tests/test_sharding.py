@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+
+from wood import settings
+from wood.sharding import ShardedStockExchange, partition, shard_of
+from .test_stock_exchange import RecordingPublisher, get_create_order
+
+
+def test_shard_of_is_stable():
+    assert shard_of(None, 4) == 0
+    assert shard_of("OAK", 4) == shard_of("OAK", 4) == 2364274099 % 4
+    assert all(0 <= shard_of("S{}".format(i), 3) < 3 for i in range(100))
+
+
+def test_partition():
+    symbols = ["S{}".format(i) for i in range(100)]
+    partitions = partition(symbols, 4)
+    assert sorted(sum(partitions, [])) == sorted(symbols)
+    assert all(partitions)
+    for shard, shard_symbols in enumerate(partitions):
+        assert all(shard_of(symbol, 4) == shard for symbol in shard_symbols)
+
+
+def test_orders_are_matched_by_worker_of_their_symbol(event_loop, monkeypatch):
+    monkeypatch.setattr(settings, "symbols", ("OAK", "PINE"))
+    private_publisher, public_publisher = RecordingPublisher(event_loop), RecordingPublisher(event_loop)
+    stock_exchange = ShardedStockExchange(private_publisher, public_publisher, event_loop, workers=2)
+    messages = [get_create_order(1, side="SELL", symbol="OAK"),
+                get_create_order(2, side="SELL", symbol="PINE"),
+                get_create_order(3, symbol="OAK"),
+                get_create_order(4, symbol="ELM"),
+                b"{}"]
+
+    async def trade():
+        await stock_exchange.handle_orders(messages, ("127.0.0.1", 1))
+        while sum(len(batch) for batch in private_publisher.batches) < 7:
+            await asyncio.sleep(0.01, loop=event_loop)
+
+    event_loop.run_until_complete(asyncio.wait_for(trade(), 10, loop=event_loop))
+    stock_exchange.close()
+
+    reports = [json.loads(message.decode()) for batch in private_publisher.batches for _, message in batch]
+    assert {"message": "executionReport", "orderId": 2, "report": "NEW"} in reports
+    assert reports.count({"message": "executionReport", "orderId": 1, "report": "FILL", "price": 100,
+                          "quantity": 10}) == 1
+    assert reports.count({"message": "executionReport", "orderId": 3, "report": "FILL", "price": 100,
+                          "quantity": 10}) == 1
+    # errors are published in order with reports of the preceding orders
+    assert reports.index({"error": "Symbol ELM is not listed."}) > \
+        max(index for index, report in enumerate(reports) if report.get("orderId") == 3)
+    assert "error" in reports[-1]
+    assert all(channel == ("127.0.0.1", 1) for batch in private_publisher.batches for channel, _ in batch)
+    assert not any(process.is_alive() for process in stock_exchange._processes)
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+from wood.journal import Journal
+from wood.snapshot import read_snapshot, snapshot_path, write_snapshot
+from .test_journal import book_state, create_stock_exchange, get_cancel_order
+from .test_stock_exchange import get_create_order
+
+
+def test_restart_loads_snapshot_and_replays_journal_tail(event_loop, tmpdir):
+    path = tmpdir.join("journal")
+    stock_exchange, _ = create_stock_exchange(event_loop, path)
+    messages = [get_create_order(1, side="SELL", price=101),
+                get_create_order(2, side="SELL", price=100, quantity=5),
+                get_create_order(3, price=102, quantity=8),
+                get_create_order(4, price=95, symbol="OAK"),
+                get_create_order(5, price=96, symbol="OAK")]
+    event_loop.run_until_complete(stock_exchange.handle_orders(messages, ("127.0.0.1", 7000)))
+    event_loop.run_until_complete(stock_exchange.snapshot())
+    position = stock_exchange.journal.position
+    messages = [get_create_order(6, price=101, quantity=3),
+                get_cancel_order(4, symbol="OAK"),
+                get_create_order(7, side="SELL", price=96, symbol="OAK")]
+    event_loop.run_until_complete(stock_exchange.handle_orders(messages, ("127.0.0.1", 7000)))
+    state = book_state(stock_exchange)
+    stock_exchange.close()
+
+    assert read_snapshot(snapshot_path(str(path)))[0] == position
+    stock_exchange, _ = create_stock_exchange(event_loop, path)
+    assert book_state(stock_exchange) == state
+    assert state[None][1][0].quantity == 4
+    assert not state["OAK"][0] and not state["OAK"][1]
+    assert stock_exchange.journal.position == Journal(str(path)).length()
+    stock_exchange.close()
+
+
+def test_snapshot_newer_than_journal_is_ignored(event_loop, tmpdir):
+    path = tmpdir.join("journal")
+    stock_exchange, _ = create_stock_exchange(event_loop, path)
+    event_loop.run_until_complete(stock_exchange.handle_order(get_create_order(1, price=100), "participant"))
+    state = book_state(stock_exchange)
+    stock_exchange.close()
+    write_snapshot(snapshot_path(str(path)), Journal(str(path)).length() + 1, {None: []})
+
+    stock_exchange, _ = create_stock_exchange(event_loop, path)
+    assert book_state(stock_exchange) == state
+    stock_exchange.close()
+
+
+def test_damaged_snapshot_is_ignored(tmpdir):
+    path = str(tmpdir.join("snapshot"))
+    assert read_snapshot(path) is None
+    write_snapshot(path, 10, {})
+    assert read_snapshot(path) == (10, {})
+    with open(path, "r+b") as f:
+        f.write(b"X")
+    assert read_snapshot(path) is None
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from wood.pubsub.base import BasePublisher
+from wood.stock_exchange import StockExchange
+
+
+class RecordingPublisher(BasePublisher):
+    def __init__(self, loop):
+        super().__init__(loop)
+        self.batches = []
+
+    async def publish(self, channel, message):
+        self.batches.append([(channel, message)])
+
+    async def publish_many(self, messages):
+        self.batches.append(list(messages))
+
+
+def get_create_order(order_id=1, side="BUY", price=100, quantity=10, symbol=None):
+    message = dict(message="createOrder", orderId=order_id, side=side, price=price, quantity=quantity)
+    if symbol is not None:
+        message["symbol"] = symbol
+    return json.dumps(message).encode()
+
+
+def test_reports_of_one_message_are_published_in_one_batch(event_loop):
+    private_publisher, public_publisher = RecordingPublisher(event_loop), RecordingPublisher(event_loop)
+    stock_exchange = StockExchange(private_publisher, public_publisher, event_loop)
+    stock_exchange.order_book_tick = 0
+    for order_id in range(1, 11):
+        event_loop.run_until_complete(stock_exchange.handle_order(
+            get_create_order(order_id, side="SELL", price=100 + order_id), "seller"))
+    private_publisher.batches.clear()
+    public_publisher.batches.clear()
+
+    event_loop.run_until_complete(stock_exchange.handle_order(get_create_order(11, price=200, quantity=100),
+                                                              "buyer"))
+
+    assert len(private_publisher.batches) == 1
+    reports = private_publisher.batches[0]
+    assert len(reports) == 21
+    assert reports[0] == ("buyer", b'{"message": "executionReport", "orderId": 11, "report": "NEW"}\n')
+    assert [participant for participant, _ in reports[1:]] == ["buyer", "seller"] * 10
+    # trades, then 10 emptied ask levels and the bid level
+    assert [len(batch) for batch in public_publisher.batches] == [10, 11]
+    stock_exchange.close()
+
+
+def test_orders_of_different_symbols_do_not_match(event_loop):
+    private_publisher, public_publisher = RecordingPublisher(event_loop), RecordingPublisher(event_loop)
+    stock_exchange = StockExchange(private_publisher, public_publisher, event_loop, symbols=["OAK"])
+    stock_exchange.order_book_tick = 0
+    messages = [get_create_order(1, side="SELL", price=100),
+                get_create_order(2, price=100, symbol="OAK"),
+                get_create_order(3, side="SELL", price=100, symbol="OAK")]
+
+    event_loop.run_until_complete(stock_exchange.handle_orders(messages, "trader"))
+
+    assert len(stock_exchange.limit_order_book.ask_queue) == 1
+    assert not stock_exchange.limit_order_books["OAK"].bid_queue
+    public_reports = [json.loads(message.decode()) for batch in public_publisher.batches for _, message in batch]
+    assert public_reports[0] == {"type": "orderbook", "side": "ask", "price": 100, "quantity": 10}
+    trades = [report for report in public_reports if report["type"] == "trade"]
+    assert [(trade["symbol"], trade["price"], trade["quantity"]) for trade in trades] == [("OAK", 100, 10)]
+    assert public_reports[-1] == {"type": "orderbook", "side": "bid", "price": 100, "quantity": 0, "symbol": "OAK"}
+    stock_exchange.close()
+
+
+def test_unlisted_symbol_is_rejected(event_loop):
+    private_publisher, public_publisher = RecordingPublisher(event_loop), RecordingPublisher(event_loop)
+    stock_exchange = StockExchange(private_publisher, public_publisher, event_loop, symbols=["OAK"])
+
+    event_loop.run_until_complete(stock_exchange.handle_order(get_create_order(symbol="PINE"), "trader"))
+
+    [[(participant, message)]] = private_publisher.batches
+    assert participant == "trader"
+    assert json.loads(message.decode()) == {"error": "Symbol PINE is not listed."}
+    assert not public_publisher.batches
+    stock_exchange.close()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+
+import pytest
+from voluptuous import Invalid
+
+from wood.stock_exchange import message_schema
+from wood.validation import validate_message, InvalidMessage
+
+valid_messages = [
+    {"message": "createOrder", "orderId": 1, "side": "BUY", "price": 100, "quantity": 10},
+    {"message": "createOrder", "orderId": 2, "side": "SELL", "price": 0, "quantity": 0},
+    {"message": "cancelOrder", "orderId": 1},
+    {"message": "marketOrder", "orderId": 1, "side": "SELL", "quantity": 10},
+    {"message": "cancelOrder", "orderId": True},
+    {"message": "createOrder", "orderId": 1, "side": "BUY", "price": 100, "quantity": 10, "symbol": "WOOD"},
+    {"message": "cancelOrder", "orderId": 1, "symbol": "WOOD"},
+    {"message": "marketOrder", "orderId": 1, "side": "SELL", "quantity": 10, "symbol": "WOOD"},
+]
+
+invalid_messages = [
+    {"message": "cancelOrder"},
+    {"message": "createOrder", "orderId": 1, "side": "BUY", "price": -1, "quantity": 1},
+    {"message": "createOrder", "orderId": 1, "side": "BY", "price": 1, "quantity": 1},
+    {"message": "createOrder", "orderId": "1", "side": "BUY", "price": 1, "quantity": 1},
+    {"message": "createOrder", "orderId": 1, "side": "BUY", "price": 1, "quantity": 1, "extra": 2},
+    {"message": "marketOrder", "orderId": 1, "side": "BUY", "quantity": 1.5},
+    {"message": "cancelOrder", "orderId": 1, "symbol": 5},
+    {"message": "createOrder", "orderId": 1, "side": "BUY", "price": 1, "quantity": 1, "symbol": None},
+    {"symbol": "WOOD", "message": "marketOrder", "orderId": 1, "side": "BUY"},
+    {"orderId": [], "message": "createOrder"},
+    {"message": ["createOrder"]},
+    {"message": "foo"},
+    5,
+    [1],
+    "createOrder",
+    None,
+]
+# all combinations of missing keys
+create_order = valid_messages[0]
+for length in range(len(create_order)):
+    for keys in itertools.combinations(create_order, length):
+        invalid_messages.append({key: create_order[key] for key in keys})
+
+
+@pytest.mark.parametrize("message", valid_messages)
+def test_valid_message(message):
+    assert validate_message(message) == message
+
+
+@pytest.mark.parametrize("message", invalid_messages)
+def test_same_errors_as_voluptuous(message):
+    with pytest.raises(Invalid) as voluptuous_error:
+        message_schema(message)
+    with pytest.raises(InvalidMessage) as error:
+        validate_message(message)
+    assert str(error.value) == str(voluptuous_error.value)
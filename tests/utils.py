@@ -17,3 +17,8 @@ def get_market_bid_order(order_id=1, participant=1, time=1, quantity=50):
 
 def get_market_ask_order(order_id=1, participant=1, time=1, quantity=50):
     return MarketAskOrder(time, order_id, participant, -1, quantity)
+
+
+async def redis_command(connections, command, *args):
+    async with connections.command() as redis:
+        return await getattr(redis, command)(*args)
@@ -1,18 +1,32 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import sys
 
+from . import capture, load_generator, replay, settings
+from .gateway import GatewayServer
 from .server import StockServer
 from .random_client import start_clients
 
 
-if __name__ == '__main__':
+if __name__ == '__main__' and sys.argv[1:2] == ["replay"]:
+    replay.main(sys.argv[2:])
+elif __name__ == '__main__' and sys.argv[1:2] == ["resend"]:
+    capture.main(sys.argv[2:])
+elif __name__ == '__main__' and sys.argv[1:2] == ["load"]:
+    load_generator.main(sys.argv[2:])
+elif __name__ == '__main__':
     parser = argparse.ArgumentParser()
     server_group = parser.add_argument_group("server")
     server_group.add_argument("-s", "--server", default=False, action="store_true", help="Run server.")
     server_group.add_argument("-m", "--multiple-servers", default=False, action="store_true", help="Run multiple server environment (needs redis).")
     server_group.add_argument("--private", default=7001, type=int, help="Private port.")
     server_group.add_argument("--public", default=7002, type=int, help="Public port.")
+    server_group.add_argument("--binary", default=None, type=int, help="Private port with binary protocol (disabled by default).")
+    server_group.add_argument("-w", "--workers", default=None, type=int, help="Number of processes matching orders partitioned by symbol (settings.matching_workers by default).")
+    server_group.add_argument("-g", "--gateways", default=settings.gateways, type=int, help="Number of gateway processes sharing ports of one matching engine process (only without --multiple-servers).")
+    server_group.add_argument("-j", "--journal", default=None, help="Journal file of in memory limit order book (only without --multiple-servers).")
+    server_group.add_argument("--capture", default=None, help="Record messages of private clients to capture file (not with --gateways).")
     server_group.add_argument("--persist", default=False, action="store_true", help="Whether to persist limit order book. Only for multiple server environment.")
 
     client_group = parser.add_argument_group("client")
@@ -21,11 +35,25 @@ if __name__ == '__main__':
     client_group.add_argument("-p", "--port", type=int, default=7001, help="Private port of the server.")
     args = parser.parse_args()
 
-    if args.server:
+    if args.server and args.multiple_servers and (args.gateways or args.journal):
+        parser.error("--gateways and --journal can't be used with --multiple-servers")
+    if args.server and args.gateways and args.capture:
+        parser.error("--capture can't be used with --gateways")
+    if args.server and args.gateways:
+        GatewayServer(private_port=args.private,
+                      public_port=args.public,
+                      binary_port=args.binary,
+                      gateways=args.gateways,
+                      journal=args.journal).run()
+    elif args.server:
         stock_server = StockServer(private_port=args.private,
                                    public_port=args.public,
                                    multiple_servers=args.multiple_servers,
-                                   persist=args.persist)
+                                   persist=args.persist,
+                                   binary_port=args.binary,
+                                   workers=args.workers,
+                                   journal=args.journal,
+                                   capture=args.capture)
         stock_server.run()
     elif args.client:
         start_clients(args.number_of_clients,
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Binary protocol of private port. Every message is a fixed size little endian
+record which starts with one byte of message type:
+
+    createOrder      B type, B side, Q orderId, Q price, Q quantity
+    marketOrder      B type, B side, Q orderId, Q quantity
+    cancelOrder      B type, Q orderId
+    executionReport  B type, B report, Q orderId, Q price, Q quantity
+
+Side is 1 for BUY and 2 for SELL. Records are decoded directly to orders so
+there is no json parsing nor schema validation.
+"""
+
+import struct
+import time
+from collections import namedtuple
+
+from .orders import BidOrder, AskOrder, MarketBidOrder, MarketAskOrder
+
+# Last item of participant tuple of clients connected with binary protocol.
+PARTICIPANT_TAG = "binary"
+
+CREATE_ORDER = 1
+MARKET_ORDER = 2
+CANCEL_ORDER = 3
+EXECUTION_REPORT = 4
+
+BUY = 1
+SELL = 2
+
+REPORTS = {
+    "NEW": 1,
+    "FILL": 2,
+    "CANCELLED": 3,
+    "REJECTED": 4,
+}
+REPORT_NAMES = {code: name for name, code in REPORTS.items()}
+
+create_order_record = struct.Struct("<BBQQQ")
+market_order_record = struct.Struct("<BBQQ")
+cancel_order_record = struct.Struct("<BQ")
+execution_report_record = struct.Struct("<BBQQQ")
+
+record_sizes = {
+    CREATE_ORDER: create_order_record.size,
+    MARKET_ORDER: market_order_record.size,
+    CANCEL_ORDER: cancel_order_record.size,
+    EXECUTION_REPORT: execution_report_record.size,
+}
+
+_limit_orders = {BUY: BidOrder, SELL: AskOrder}
+_market_orders = {BUY: MarketBidOrder, SELL: MarketAskOrder}
+
+Cancel = namedtuple("Cancel", "order_id")
+Rejected = namedtuple("Rejected", "order_id reason")
+ExecutionReport = namedtuple("ExecutionReport", "order_id report price quantity")
+
+
+def is_binary(participant):
+    """ Return True if `participant` is connected with binary protocol. """
+    return type(participant) is tuple and len(participant) > 0 and participant[-1] == PARTICIPANT_TAG
+
+
+def decode(data, participant):
+    """
+    Decode all complete records at the beginning of `data` to orders, `Cancel`
+    or `Rejected` records. Return them together with number of consumed bytes.
+    Decoding stops on incomplete record or unknown message type.
+    """
+    records = []
+    offset = 0
+    length = len(data)
+    while offset < length:
+        record_type = data[offset]
+        size = record_sizes.get(record_type)
+        if size is None or record_type == EXECUTION_REPORT or offset + size > length:
+            break
+        if record_type == CREATE_ORDER:
+            _, side, order_id, price, quantity = create_order_record.unpack_from(data, offset)
+            order_type = _limit_orders.get(side)
+        elif record_type == MARKET_ORDER:
+            _, side, order_id, quantity = market_order_record.unpack_from(data, offset)
+            price = -1
+            order_type = _market_orders.get(side)
+        else:
+            _, order_id = cancel_order_record.unpack_from(data, offset)
+            records.append(Cancel(order_id))
+            offset += size
+            continue
+        offset += size
+        if order_type is None:
+            records.append(Rejected(order_id, "Invalid side {}.".format(side)))
+        else:
+            records.append(order_type(time.time(), order_id, participant, price, quantity))
+    return records, offset
+
+
+def is_valid_start(data):
+    """ Return True if `data` starts with message type that client can send. """
+    return data[0] in (CREATE_ORDER, MARKET_ORDER, CANCEL_ORDER)
+
+
+def encode_create_order(order_id, side, price, quantity):
+    return create_order_record.pack(CREATE_ORDER, side, order_id, price, quantity)
+
+
+def encode_market_order(order_id, side, quantity):
+    return market_order_record.pack(MARKET_ORDER, side, order_id, quantity)
+
+
+def encode_cancel_order(order_id):
+    return cancel_order_record.pack(CANCEL_ORDER, order_id)
+
+
+def encode_execution_report(order_id, report, price=0, quantity=0):
+    return execution_report_record.pack(EXECUTION_REPORT, REPORTS[report], order_id, price, quantity)
+
+
+def decode_execution_reports(data):
+    """ Decode execution reports sent by server. """
+    return [ExecutionReport(order_id, REPORT_NAMES[report], price, quantity)
+            for _, report, order_id, price, quantity in execution_report_record.iter_unpack(data)]
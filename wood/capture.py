@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Capture of messages coming to private port and their replay over TCP. With
+`--capture PATH` the server appends every json message with id of its
+connection and time of arrival to capture file, which starts with `MAGIC`
+followed by records
+
+    d time, I connection id, I length of message, message
+
+`python -m wood resend PATH` opens one connection per captured connection
+and sends the messages again with the original gaps between them divided by
+`--speed` (0 sends them as fast as possible), so the whole path of sockets,
+parsing and publishing is loaded by traffic of the real shape.
+"""
+
+import argparse
+import asyncio
+import struct
+import time
+
+MAGIC = b"WOODCAP1"
+
+_record = struct.Struct("<dII")
+
+
+class Capture:
+    """ Writer of capture file `path`, messages are buffered and written in chunks. """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+        self._connections = 0
+
+    def connection_id(self):
+        """ Return id for new connection. """
+        self._connections += 1
+        return self._connections
+
+    def record(self, connection_id, messages, timestamp=None):
+        """ Append `messages` that came from `connection_id` at `timestamp` (now by default). """
+        timestamp = time.time() if timestamp is None else timestamp
+        self._file.write(b"".join(_record.pack(timestamp, connection_id, len(message)) + message
+                                  for message in messages))
+
+    def close(self):
+        self._file.close()
+
+
+def is_capture(path):
+    """ Return True if file `path` is a capture. """
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def read_capture(path):
+    """ Return list of (time, connection id, message) of capture file `path`, cut record at the end is left out. """
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError("File {} is not a capture.".format(path))
+    records = []
+    offset = len(MAGIC)
+    while offset + _record.size <= len(data):
+        timestamp, connection_id, length = _record.unpack_from(data, offset)
+        offset += _record.size
+        message = data[offset:offset + length]
+        if len(message) < length:
+            break
+        records.append((timestamp, connection_id, message))
+        offset += length
+    return records
+
+
+@asyncio.coroutine
+async def _count_reports(reader, counts):
+    while True:
+        data = await reader.read(65536)
+        if not data:
+            return
+        counts["reports"] += data.count(b"\n")
+
+
+@asyncio.coroutine
+async def resend(records, host="localhost", port=7001, speed=1.0, wait=1.0, loop=None):
+    """
+    Send captured `records` to private port of server at `host`:`port`, gaps
+    between messages are divided by `speed` (0 means no gaps). Connections are
+    closed `wait` seconds after the last message. Return dict with numbers of
+    messages and received reports and duration of sending.
+    """
+    loop = asyncio.get_event_loop() if loop is None else loop
+    counts = {"reports": 0}
+    writers = {}
+    readers = []
+    for connection_id in sorted({connection_id for _, connection_id, _ in records}):
+        reader, writers[connection_id] = await asyncio.open_connection(host, port, loop=loop)
+        readers.append(loop.create_task(_count_reports(reader, counts)))
+    start = loop.time()
+    first = records[0][0] if records else 0.0
+    try:
+        for timestamp, connection_id, message in records:
+            if speed:
+                delay = (timestamp - first) / speed - (loop.time() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay, loop=loop)
+            writer = writers[connection_id]
+            writer.write(message + b"\n")
+            await writer.drain()
+        seconds = loop.time() - start
+        await asyncio.sleep(wait, loop=loop)
+    finally:
+        for reader in readers:
+            reader.cancel()
+        for writer in writers.values():
+            writer.close()
+    return {
+        "connections": len(writers),
+        "messages": len(records),
+        "reports": counts["reports"],
+        "seconds": seconds,
+        "messages_per_second": len(records) / seconds if seconds else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m wood resend",
+                                     description="Send captured private traffic to running server.")
+    parser.add_argument("capture", help="Capture file written by server with --capture.")
+    parser.add_argument("--host", default="localhost", help="Host of the server.")
+    parser.add_argument("-p", "--port", type=int, default=7001, help="Private port of the server.")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Speed up of the original timing, 0 sends as fast as possible.")
+    parser.add_argument("--wait", type=float, default=1.0, help="Seconds to wait for reports after the last message.")
+    args = parser.parse_args(argv)
+
+    records = read_capture(args.capture)
+    loop = asyncio.get_event_loop()
+    stats = loop.run_until_complete(resend(records, args.host, args.port, args.speed, args.wait, loop))
+    print("Sent {messages} messages over {connections} connections in {seconds:.3f} s "
+          "({messages_per_second:.0f} messages/s), received {reports} reports".format(**stats))
@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 
 import asyncio
-import json
 
+from . import codec, settings
+from .fanout import FanOut
 from .utils import get_logger
 from .pubsub.base import BaseSubscriber
 
@@ -23,38 +24,83 @@ class Clients:
     def remove(self, client):
         del self._clients[str(client.peername)]
 
-    def broadcast(self, message: [str, dict]):
-        """Send `message` to all connected clients."""
+    @staticmethod
+    def _encode(message: [bytes, str, dict]):
+        if isinstance(message, bytes):
+            return message
         if isinstance(message, dict):
-            message = json.dumps(message)
-        message += "\n"
-        for participant, client in self._clients.items():
-            self._logger.debug("Broadcast %r to %s", message, participant)
-            client.transport.write(message.encode())
+            return codec.dumps(message)
+        return message.encode() + b"\n"
 
-    def send(self, participant, message: [str, dict]):
+    def broadcast(self, message: [bytes, str, dict]):
+        """
+        Send `message` to all connected clients. Bytes are expected to be
+        already encoded by `codec` including newline.
+        """
+        message = self._encode(message)
+        self._logger.debug("Broadcast %r to %d clients", message, len(self._clients))
+        for client in self._clients.values():
+            client.transport.write(message)
+
+    def send(self, participant, message: [bytes, str, dict]):
         """
         Send message to participant. May raise `KeyError` if participant already left.
         """
         client = self._clients[participant]
-        if isinstance(message, dict):
-            message = json.dumps(message)
-        message += "\n"
+        message = self._encode(message)
         self._logger.debug("Send %r to %s", message, participant)
-        client.transport.write(message.encode())
+        client.transport.write(message)
+
+    @asyncio.coroutine
+    async def wait_ready(self, client):
+        """ Wait until messages for `client` can be received. """
+        await self.subscriber.wait_subscribed(str(client.peername))
+
+    def pause(self, client):
+        """ Called when transport of `client` buffers more than its high water mark. """
+
+    def resume(self, client):
+        """ Called when transport of `client` drained under its low water mark. """
 
 
 class PublicClients(Clients):
     """
     Public extension of `Clients` that listens via subscriber and then
-    broadcasts all incoming messages.
+    broadcasts all incoming messages through `FanOut`, so slow consumers are
+    handled by `settings.slow_consumer` policy.
     """
+    def __init__(self, subscriber: BaseSubscriber, policy=None):
+        super().__init__(subscriber)
+        self._fanout = FanOut(settings.slow_consumer["policy"] if policy is None else policy)
+
+    def add(self, client):
+        super().add(client)
+        client.transport.set_write_buffer_limits(settings.slow_consumer["high_water"],
+                                                 settings.slow_consumer["low_water"])
+        self._fanout.add(str(client.peername), client.transport)
+
+    def remove(self, client):
+        super().remove(client)
+        self._fanout.remove(str(client.peername))
+
+    def pause(self, client):
+        self._fanout.pause(str(client.peername))
+
+    def resume(self, client):
+        self._fanout.resume(str(client.peername))
+
+    def broadcast(self, message: [bytes, str, dict]):
+        message = self._encode(message)
+        self._logger.debug("Broadcast %r to %d clients", message, len(self._fanout))
+        self._fanout.publish(message)
+
+    def handle(self, channel, message):
+        self.broadcast(message)
+
     @asyncio.coroutine
     async def consume(self):
         self.subscriber.subscribe("public")
-        while True:
-            channel, message = await self.subscriber.get()
-            self.broadcast(message)
+        await self.subscriber.listen(self.handle)
 
 
 class PrivateClients(Clients):
@@ -62,6 +108,11 @@ class PrivateClients(Clients):
     Private extension of `Clients` that listens via subscriber and then
     sends messages to corresponding clients.
     """
+    def __init__(self, subscriber: BaseSubscriber):
+        super().__init__(subscriber)
+        # workers of private connections, they finish messages of closed connections too
+        self.workers = set()
+
     def add(self, client):
         super().add(client)
         self.subscriber.subscribe(str(client.peername))
@@ -70,8 +121,12 @@ class PrivateClients(Clients):
         super().remove(client)
         self.subscriber.unsubscribe(str(client.peername))
 
+    def handle(self, participant, message):
+        try:
+            self.send(participant, message)
+        except KeyError:
+            self._logger.debug("Participant %s already left, message %r dropped", participant, message)
+
     @asyncio.coroutine
     async def consume(self):
-        while True:
-            participant, message = await self.subscriber.get()
-            self.send(participant, message)
+        await self.subscriber.listen(self.handle)
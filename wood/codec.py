@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+JSON codec used for all messages sent to clients. Messages are encoded to
+`bytes` terminated by newline so they can be written to transports as they
+are. The fastest installed encoder (orjson, ujson) is used, with fallback to
+stdlib `json`. Reports with fixed shape are formatted from byte templates.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def _json_dumps(obj):
+    return json.dumps(obj).encode() + b"\n"
+
+
+def _has_big_float(obj):
+    """ Return True if integer wider than 64 bits may have been decoded as float. """
+    if type(obj) is not dict:
+        return False
+    for value in obj.values():
+        if type(value) is float and abs(value) >= 2 ** 63:
+            return True
+    return False
+
+
+if orjson is not None:
+    name = "orjson"
+
+    def dumps(obj):
+        """ Encode `obj` to json bytes terminated by newline. """
+        try:
+            return orjson.dumps(obj) + b"\n"
+        except TypeError:
+            # e.g. integers bigger than 64 bits
+            return _json_dumps(obj)
+
+    def loads(data):
+        """ Decode json, integers wider than 64 bits are decoded by stdlib `json`. """
+        try:
+            obj = orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return json.loads(data)
+        if _has_big_float(obj):
+            return json.loads(data)
+        return obj
+elif ujson is not None:
+    name = "ujson"
+
+    def dumps(obj):
+        """ Encode `obj` to json bytes terminated by newline. """
+        try:
+            return ujson.dumps(obj, ensure_ascii=False).encode() + b"\n"
+        except OverflowError:
+            return _json_dumps(obj)
+
+    def loads(data):
+        """ Decode json, integers wider than 64 bits are decoded by stdlib `json`. """
+        try:
+            return ujson.loads(data)
+        except ValueError:
+            return json.loads(data)
+else:
+    name = "json"
+    dumps = _json_dumps
+    loads = json.loads
+
+
+_EXECUTION_REPORT = b'{"message": "executionReport", "orderId": %d, "report": "%s"}\n'
+_FILL_REPORT = b'{"message": "executionReport", "orderId": %d, "report": "FILL", "price": %d, "quantity": %d}\n'
+_TRADE_REPORT = b'{"type": "trade", "time": %r, "price": %d, "quantity": %d}\n'
+_ORDER_BOOK_REPORT = b'{"type": "orderbook", "side": "%s", "price": %d, "quantity": %d}\n'
+
+
+class LevelReport(bytes):
+    """
+    Encoded order book report that carries its level, so that fan-out does
+    not need to decode it. The level is lost when sent through redis.
+    """
+    def __new__(cls, data, symbol, side, price, quantity):
+        report = super().__new__(cls, data)
+        report.symbol = symbol
+        report.side = side
+        report.price = price
+        report.quantity = quantity
+        return report
+
+    def __reduce__(self):
+        return LevelReport, (bytes(self), self.symbol, self.side, self.price, self.quantity)
+
+
+def _are_ints(*values):
+    for value in values:
+        if type(value) is not int:
+            return False
+    return True
+
+
+def execution_report(order_id, report):
+    """ Execution report without additional fields (NEW, CANCELLED). """
+    if type(order_id) is int:
+        return _EXECUTION_REPORT % (order_id, report.encode())
+    return dumps({"message": "executionReport", "orderId": order_id, "report": report})
+
+
+def fill_report(order_id, price, quantity):
+    if _are_ints(order_id, price, quantity):
+        return _FILL_REPORT % (order_id, price, quantity)
+    return dumps({"message": "executionReport", "orderId": order_id, "report": "FILL",
+                  "price": price, "quantity": quantity})
+
+
+def trade_report(time, price, quantity, symbol=None):
+    """ Trade report, `symbol` is left out for the default symbol. """
+    if symbol is None and type(time) is float and _are_ints(price, quantity):
+        return _TRADE_REPORT % (time, price, quantity)
+    report = {"type": "trade", "time": time, "price": price, "quantity": quantity}
+    if symbol is not None:
+        report["symbol"] = symbol
+    return dumps(report)
+
+
+def order_book_report(side, price, quantity, symbol=None):
+    """ Aggregated quantity of price level, `symbol` is left out for the default symbol. """
+    if symbol is None and _are_ints(price, quantity):
+        return LevelReport(_ORDER_BOOK_REPORT % (side.encode(), price, quantity), symbol, side, price, quantity)
+    report = {"type": "orderbook", "side": side, "price": price, "quantity": quantity}
+    if symbol is not None:
+        report["symbol"] = symbol
+    return LevelReport(dumps(report), symbol, side, price, quantity)
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Fan-out of public messages. Every message is encoded once and the same bytes
+object is written to all transports. Clients whose transport buffers more
+than high water mark are slow consumers and they are handled by policy:
+
+    snapshot    stop writing to the client, when its buffer drains send it
+                the current state of all price levels (and levels emptied
+                meanwhile) and continue
+    skip        stop writing to the client, when its buffer drains send it
+                only the latest state of levels that changed meanwhile
+    disconnect  close the connection of the client
+
+Trades published while client is slow are not sent to it with any policy.
+Buffer sizes are tracked by transports themselves via their write buffer
+limits and `pause_writing`/`resume_writing` of protocol.
+"""
+
+from collections import OrderedDict
+
+from . import codec
+from .utils import get_logger
+
+POLICIES = ("snapshot", "skip", "disconnect")
+
+
+class FanOut:
+    """
+    Broadcasts public messages to registered transports, see module docstring.
+    Latest message of every price level is remembered together with sequence
+    number of its publication, so slow clients need to remember only sequence
+    number of the moment they were paused.
+    """
+    def __init__(self, policy="snapshot"):
+        if policy not in POLICIES:
+            raise ValueError("Unknown slow consumer policy {!r}.".format(policy))
+        self.policy = policy
+        self._logger = get_logger()
+        self._transports = {}
+        # key -> transport and sequence number at the time it was paused
+        self._slow = {}
+        # (symbol, side, price) -> (sequence number, message, is empty), oldest first
+        self._levels = OrderedDict()
+        self._sequence = 0
+
+    def add(self, key, transport):
+        self._transports[key] = transport
+
+    def remove(self, key):
+        self._transports.pop(key, None)
+        if self._slow.pop(key, None) is not None and not self._slow:
+            self._prune()
+
+    def __len__(self):
+        return len(self._transports) + len(self._slow)
+
+    @property
+    def levels(self):
+        """ Remembered levels as (symbol, side, price), the least recently changed first. """
+        return list(self._levels)
+
+    def publish(self, message: bytes):
+        """ Write encoded `message` to all clients that are not slow. """
+        if self.policy != "disconnect":
+            self._remember(message)
+        # writes may pause transports and change the dict
+        for transport in tuple(self._transports.values()):
+            transport.write(message)
+
+    def pause(self, key):
+        """ Transport of client `key` is over its high water mark. """
+        transport = self._transports.pop(key, None)
+        if transport is None:
+            return
+        if self.policy == "disconnect":
+            self._logger.warning("Disconnect slow consumer %s", key)
+            transport.abort()
+        else:
+            self._logger.info("Pause slow consumer %s", key)
+            self._slow[key] = (transport, self._sequence)
+
+    def resume(self, key):
+        """ Transport of client `key` drained under its low water mark. """
+        transport, sequence = self._slow.pop(key, (None, None))
+        if transport is None:
+            return
+        self._logger.info("Resume slow consumer %s", key)
+        self._transports[key] = transport
+        messages = self._changed_levels(sequence)
+        if self.policy == "snapshot":
+            messages = [message for _, message, is_empty in self._levels.values() if not is_empty] + messages
+        if not self._slow:
+            self._prune()
+        if messages:
+            transport.write(b"".join(messages))
+
+    @staticmethod
+    def _level(message):
+        """ Return (symbol, side, price, quantity) of order book report or None. """
+        if isinstance(message, codec.LevelReport):
+            return message.symbol, message.side, message.price, message.quantity
+        # plain bytes come from redis, only order book reports are decoded
+        if b'"orderbook"' not in message:
+            return None
+        try:
+            data = codec.loads(message)
+        except ValueError:
+            return None
+        if not isinstance(data, dict) or data.get("type") != "orderbook":
+            return None
+        return data.get("symbol"), data.get("side"), data.get("price"), data.get("quantity")
+
+    def _remember(self, message):
+        report = self._level(message)
+        if report is None:
+            return
+        level = report[:3]
+        is_empty = not report[3]
+        self._levels.pop(level, None)
+        if is_empty and not self._slow:
+            return
+        self._sequence += 1
+        self._levels[level] = (self._sequence, message, is_empty)
+
+    def _changed_levels(self, sequence):
+        """ Messages of levels published after `sequence` which are not part of snapshot. """
+        messages = []
+        for level_sequence, message, is_empty in reversed(self._levels.values()):
+            if level_sequence <= sequence:
+                break
+            if is_empty or self.policy == "skip":
+                messages.append(message)
+        messages.reverse()
+        return messages
+
+    def _prune(self):
+        """ Forget empty levels, they are kept only for paused clients. """
+        for level in [level for level, (_, _, is_empty) in self._levels.items() if is_empty]:
+            del self._levels[level]
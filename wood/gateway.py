@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+"""
+Gateway mode: `GatewayServer` runs `gateways` processes that accept clients
+on the same private and public ports (SO_REUSEPORT), parse and validate
+their messages and one matching engine process with books of all symbols.
+Every gateway passes validated orders and error reports of invalid messages
+to the engine through its own shared memory ring buffer (`ring_buffer`) and
+receives reports through another one. Parsing and I/O scale with number of
+gateways while orders are matched by single event loop in the order the
+engine reads them.
+
+Orders are sent to the engine in records of `binary_protocol` so the engine
+doesn't unpickle them. Consecutive orders of one participant and symbol are
+in one frame:
+
+    B type (ORDERS_FRAME), B has symbol, H length of participant,
+    H length of symbol, participant (`order_encoding`), symbol, records
+
+Other frames are pickled the same as of `sharding` workers: error reports,
+orders with numbers that don't fit the records and control frames.
+
+The engine remembers gateway of every participant from its orders, private
+reports are sent only to that gateway, public reports to all of them.
+Gateway sends ("disconnect", participant, []) when connection of the
+participant is lost and the engine forgets it.
+
+Ring buffers rely on total store order of x86-64, see `ring_buffer`.
+"""
+
+import asyncio
+import pickle
+import platform
+import signal
+import struct
+
+from . import binary_protocol, settings
+from .pubsub.base import BasePublisher
+from .ring_buffer import RingReader, RingWriter, channel, is_supported_machine
+from .journal import Journal
+from .orders import BidOrder, MarketBidOrder, MarketAskOrder
+from .priority_queue.order_encoding import decode_participant, encode_participant
+from .server import StockServer
+from .sharding import append_item, handle_frame, spawn_context
+from .stock_exchange import BaseStockExchange, StockExchange
+from .utils import get_logger
+
+# Type of frames of orders, pickled frames start with 0x80.
+ORDERS_FRAME = 0
+_orders_header = struct.Struct("<BBHH")
+_MAX_VALUE = 2 ** 64 - 1
+_sides = {"BUY": binary_protocol.BUY, "SELL": binary_protocol.SELL}
+
+
+def encode_orders_frame(participant, symbol, records):
+    """ Return frame of `records` of `participant` for limit order book of `symbol`. """
+    participant = encode_participant(participant).encode()
+    symbol_data = b"" if symbol is None else symbol.encode()
+    return (_orders_header.pack(ORDERS_FRAME, symbol is not None, len(participant), len(symbol_data)) +
+            participant + symbol_data + records)
+
+
+def decode_orders_frame(data):
+    """ Return participant, symbol and records of frame encoded by `encode_orders_frame`. """
+    _, has_symbol, participant_length, symbol_length = _orders_header.unpack_from(data)
+    offset = _orders_header.size
+    participant = decode_participant(data[offset:offset + participant_length].decode())
+    offset += participant_length
+    symbol = data[offset:offset + symbol_length].decode() if has_symbol else None
+    return participant, symbol, data[offset + symbol_length:]
+
+
+def encode_order_dict(order_dict):
+    """ Return `binary_protocol` record of valid `order_dict` or None when its numbers don't fit the record. """
+    order_id = order_dict["orderId"]
+    if not (0 <= order_id <= _MAX_VALUE and order_dict.get("price", 0) <= _MAX_VALUE and
+            order_dict.get("quantity", 0) <= _MAX_VALUE):
+        return None
+    if order_dict["message"] == "createOrder":
+        return binary_protocol.encode_create_order(order_id, _sides[order_dict["side"]], order_dict["price"],
+                                                   order_dict["quantity"])
+    if order_dict["message"] == "marketOrder":
+        return binary_protocol.encode_market_order(order_id, _sides[order_dict["side"]], order_dict["quantity"])
+    return binary_protocol.encode_cancel_order(order_id)
+
+
+def encode_record(record):
+    """ Encode order or `Cancel` decoded by `binary_protocol` back to its record. """
+    if isinstance(record, binary_protocol.Cancel):
+        return binary_protocol.encode_cancel_order(record.order_id)
+    side = binary_protocol.BUY if isinstance(record, BidOrder) else binary_protocol.SELL
+    if isinstance(record, (MarketBidOrder, MarketAskOrder)):
+        return binary_protocol.encode_market_order(record.order_id, side, record.quantity)
+    return binary_protocol.encode_create_order(record.order_id, side, record.price, record.quantity)
+
+
+def append_record(frames, participant, symbol, record):
+    """ Append `record` to the last of `frames` if it is orders frame of `symbol`, otherwise start new frame. """
+    if frames and frames[-1][0] == ORDERS_FRAME and frames[-1][2] == symbol:
+        frames[-1][3].append(record)
+    else:
+        frames.append((ORDERS_FRAME, participant, symbol, [record]))
+
+
+class RingStockExchange(BaseStockExchange):
+    """
+    Stock exchange of gateway that validates messages and writes them to ring
+    buffer of the engine. Reports read from the other ring buffer are
+    published by publishers of the gateway.
+    """
+    def __init__(self, private_publisher, public_publisher, loop, writer: RingWriter, reader: RingReader,
+                 validator=None):
+        super().__init__(private_publisher, public_publisher, loop, validator)
+        self._writer = writer
+        self._reader = reader
+        self._forward_task = loop.create_task(self._forward_reports())
+
+    def close(self):
+        self._forward_task.cancel()
+        self._writer.close()
+        self._reader.close()
+
+    @asyncio.coroutine
+    async def _forward_reports(self):
+        while True:
+            frames = await self._reader.read()
+            if not frames:
+                self._logger.error("Matching engine is gone")
+                return
+            for frame in frames:
+                kind, messages = pickle.loads(frame)
+                publisher = self._private_publisher if kind == "private" else self._public_publisher
+                await publisher.publish_many(messages)
+
+    @asyncio.coroutine
+    async def _send(self, frame):
+        if frame[0] == ORDERS_FRAME:
+            _, participant, symbol, records = frame
+            await self._writer.write(encode_orders_frame(participant, symbol, b"".join(records)))
+        else:
+            await self._writer.write(pickle.dumps(frame, pickle.HIGHEST_PROTOCOL))
+
+    @staticmethod
+    def _append_order_dict(frames, order_dict, participant):
+        record = encode_order_dict(order_dict)
+        if record is None:
+            append_item(frames, "orders", participant, order_dict)
+        else:
+            append_record(frames, participant, order_dict.get("symbol"), record)
+
+    @asyncio.coroutine
+    async def handle_orders(self, messages: list, participant: tuple):
+        """
+        Validates batch of messages and sends valid ones and error reports to
+        the engine, consecutive items of one kind in one frame, so the engine
+        publishes all reports in order of messages.
+        """
+        frames = []
+        for message in messages:
+            order_dict, error_report = self._validate(message, participant)
+            if error_report is None:
+                self._append_order_dict(frames, order_dict, participant)
+            else:
+                append_item(frames, "errors", participant, error_report)
+        for frame in frames:
+            await self._send(frame)
+
+    @asyncio.coroutine
+    async def handle_order_dict(self, order_dict: dict, participant: tuple):
+        frames = []
+        self._append_order_dict(frames, order_dict, participant)
+        await self._send(frames[0])
+
+    @asyncio.coroutine
+    async def handle_records(self, records: list, participant: tuple):
+        frames = []
+        for record in records:
+            if isinstance(record, binary_protocol.Rejected):
+                append_item(frames, "errors", participant,
+                            self._get_error_report(record.reason, participant, record.order_id))
+            else:
+                append_record(frames, participant, None, encode_record(record))
+        for frame in frames:
+            await self._send(frame)
+
+    def disconnect(self, participant):
+        self._loop.create_task(self._disconnect(participant))
+
+    @asyncio.coroutine
+    async def _disconnect(self, participant):
+        try:
+            await self._send(("disconnect", participant, []))
+        except ConnectionError:
+            # the engine is gone, there is nobody to forget the participant
+            pass
+
+
+class GatewayStockServer(StockServer):
+    """ `StockServer` of one gateway process with `RingStockExchange`, its ports are shared by all gateways. """
+    reuse_port = True
+
+    def __init__(self, writer: RingWriter, reader: RingReader, **kwargs):
+        self._writer = writer
+        self._reader = reader
+        super().__init__(**kwargs)
+
+    def _create_stock_exchange(self, multiple_servers, workers):
+        return RingStockExchange(self.private_publisher, self.public_publisher, self.loop, self._writer,
+                                 self._reader)
+
+
+class EnginePublisher(BasePublisher):
+    """ Publisher of the engine that writes reports to ring buffers of gateways. """
+    def __init__(self, loop, engine, kind):
+        super().__init__(loop)
+        self._engine = engine
+        self._kind = kind
+
+    @asyncio.coroutine
+    async def connect(self):
+        pass
+
+    @asyncio.coroutine
+    async def publish(self, channel, message):
+        await self.publish_many([(channel, message)])
+
+    @asyncio.coroutine
+    async def publish_many(self, messages):
+        if self._kind == "public":
+            batches = {gateway: messages for gateway in self._engine.writers}
+        else:
+            batches = {}
+            for participant, message in messages:
+                gateway = self._engine.owners.get(participant)
+                if gateway is not None:
+                    batches.setdefault(gateway, []).append((participant, message))
+        for gateway, gateway_messages in batches.items():
+            await self._engine.send(gateway, (self._kind, list(gateway_messages)))
+
+    def close(self):
+        pass
+
+
+class MatchingEngine:
+    """ Single `StockExchange` matching orders read from ring buffers of all gateways. """
+    def __init__(self, loop, readers, writers, journal=None):
+        self.loop = loop
+        self.readers = dict(enumerate(readers))
+        self.writers = dict(enumerate(writers))
+        # participant -> gateway it is connected to
+        self.owners = {}
+        self.stock_exchange = StockExchange(EnginePublisher(loop, self, "private"),
+                                            EnginePublisher(loop, self, "public"), loop, journal=journal)
+        self._logger = get_logger()
+
+    @asyncio.coroutine
+    async def send(self, gateway, frame):
+        writer = self.writers.get(gateway)
+        if writer is None:
+            return
+        try:
+            await writer.write(pickle.dumps(frame, pickle.HIGHEST_PROTOCOL))
+        except ConnectionError:
+            self._logger.warning("Gateway %d is gone", gateway)
+            self.writers.pop(gateway, None)
+
+    @asyncio.coroutine
+    async def _serve(self, gateway):
+        reader = self.readers[gateway]
+        while True:
+            frames = await reader.read()
+            if not frames:
+                return
+            for data in frames:
+                if data[0] == ORDERS_FRAME:
+                    participant, symbol, records = decode_orders_frame(data)
+                    self.owners[participant] = gateway
+                    records, _ = binary_protocol.decode(records, participant)
+                    await self.stock_exchange.handle_records(records, participant, symbol)
+                    continue
+                frame = pickle.loads(data)
+                if frame[0] == "disconnect":
+                    self.owners.pop(frame[1], None)
+                    continue
+                self.owners[frame[1]] = gateway
+                await handle_frame(self.stock_exchange, frame)
+
+    @asyncio.coroutine
+    async def serve(self):
+        """ Match orders until all gateways are gone. """
+        await asyncio.gather(*[self._serve(gateway) for gateway in self.readers], loop=self.loop)
+
+    def close(self):
+        self.stock_exchange.close()
+        for reader in self.readers.values():
+            reader.close()
+        for writer in self.writers.values():
+            writer.close()
+
+
+def run_engine(inbound, outbound, journal_path=None):
+    """ Entry point of engine process, it stops when all gateways are gone. """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    readers = [RingReader(ring, doorbell, loop) for ring, doorbell in inbound]
+    writers = [RingWriter(ring, doorbell, loop) for ring, doorbell in outbound]
+    journal = None if journal_path is None else Journal(journal_path, loop)
+    engine = MatchingEngine(loop, readers, writers, journal)
+    try:
+        loop.run_until_complete(engine.serve())
+    finally:
+        engine.close()
+        loop.close()
+
+
+def run_gateway(inbound, outbound, **kwargs):
+    """ Entry point of gateway process, it stops on SIGTERM. """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = GatewayStockServer(RingWriter(*inbound, loop), RingReader(*outbound, loop), loop=loop, **kwargs)
+    server.initialize_tasks()
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+    try:
+        loop.run_forever()
+    finally:
+        server.shutdown_tasks()
+
+
+class GatewayServer:
+    """
+    Runs `gateways` gateway processes sharing `private_port`, `public_port`
+    and `binary_port` and one matching engine process. Gateway mode is
+    available only for in memory engine, which can be persisted to `journal`.
+    """
+    def __init__(self, private_port=7001, public_port=7002, binary_port=None, gateways=None, journal=None):
+        self.private_port = private_port
+        self.public_port = public_port
+        self.binary_port = binary_port
+        self.gateways = settings.gateways if gateways is None else gateways
+        self.journal = journal
+        self.engine = None
+        self.gateway_processes = []
+        self._logger = get_logger()
+        if not is_supported_machine():
+            self._logger.warning("Ring buffers of gateway mode need total store order of x86-64, %s may reorder "
+                                 "writes", platform.machine())
+
+    def start(self):
+        size = settings.ring_buffer["size"]
+        inbound = [channel(size) for _ in range(self.gateways)]
+        outbound = [channel(size) for _ in range(self.gateways)]
+        self.engine = spawn_context.Process(target=run_engine,
+                                            args=([(ring, consumer) for ring, _, consumer in inbound],
+                                                  [(ring, producer) for ring, producer, _ in outbound],
+                                                  self.journal))
+        self.engine.start()
+        for (to_engine, producer, _), (from_engine, _, consumer) in zip(inbound, outbound):
+            process = spawn_context.Process(target=run_gateway, args=((to_engine, producer), (from_engine, consumer)),
+                                            kwargs={"private_port": self.private_port,
+                                                    "public_port": self.public_port,
+                                                    "binary_port": self.binary_port})
+            process.start()
+            self.gateway_processes.append(process)
+        # only the children keep doorbells, so the engine notices when gateways are gone
+        for _, producer, consumer in inbound + outbound:
+            producer.close()
+            consumer.close()
+        self._logger.info("Started matching engine %d and %d gateways on ports %d and %d", self.engine.pid,
+                          self.gateways, self.private_port, self.public_port)
+
+    def stop(self):
+        for process in self.gateway_processes:
+            process.terminate()
+        for process in self.gateway_processes:
+            process.join()
+        self.engine.join(5)
+        if self.engine.is_alive():
+            self._logger.warning("Terminate matching engine %d", self.engine.pid)
+            self.engine.terminate()
+            self.engine.join()
+        self._logger.info("Server shutdown.")
+
+    def run(self):
+        """ Run gateways and engine until `KeyboardInterrupt` is raised. """
+        self.start()
+        try:
+            for process in self.gateway_processes:
+                process.join()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
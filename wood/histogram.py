@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Log-linear histogram of non-negative integers in the style of HDR histogram.
+Values below 2 ** `significant_bits` are counted exactly, bigger ones in
+buckets whose width grows with the value, so every value is known with
+relative error below 2 ** (1 - `significant_bits`) (0.1 % by default) and
+memory does not depend on number of recorded values. Histograms of more
+processes are merged by `merge`.
+"""
+
+from collections import defaultdict
+
+PERCENTILES = (50.0, 75.0, 90.0, 99.0, 99.9, 99.99, 100.0)
+
+
+class Histogram:
+    """ Histogram of integer values, e.g. latencies in microseconds. """
+    def __init__(self, significant_bits=11):
+        self.significant_bits = significant_bits
+        self.counts = defaultdict(int)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        shift = value.bit_length() - self.significant_bits
+        if shift <= 0:
+            return value
+        return (shift << self.significant_bits) + (value >> shift)
+
+    def _highest_value(self, index):
+        """ Return the highest value counted in bucket `index`. """
+        shift = index >> self.significant_bits
+        if shift == 0:
+            return index
+        return (((index & ((1 << self.significant_bits) - 1)) + 1) << shift) - 1
+
+    def record(self, value, count=1):
+        value = max(0, int(value))
+        self.counts[self._index(value)] += count
+        self.count += count
+        self.total += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        """ Add values of `other` histogram with the same precision. """
+        if other.significant_bits != self.significant_bits:
+            raise ValueError("Histograms with different precision can't be merged.")
+        for index, count in other.counts.items():
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percentile):
+        """ Return value that `percentile` % of recorded values do not exceed. """
+        if not self.count:
+            return 0
+        rank = max(1, -(-self.count * percentile // 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self._highest_value(index), self.max)
+        return self.max
+
+    def percentiles(self, percentiles=PERCENTILES):
+        """ Return list of (percentile, value, number of values up to it). """
+        result = []
+        for percentile in percentiles:
+            value = self.percentile(percentile)
+            last = self._index(value)
+            count = sum(count for index, count in self.counts.items() if index <= last)
+            result.append((percentile, value, count))
+        return result
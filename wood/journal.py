@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Write-ahead journal of in memory limit order books. Accepted orders,
+cancels and trades are appended to binary file and books are rebuilt by
+replaying it on start. Every record is
+
+    I length of payload, I crc32 of kind and payload, B kind, payload
+
+and payload is `H` length of symbol, symbol (empty for the default one) and
+data of the event: order encoded by `order_encoding`, order_id of cancelled
+order or `time|price|quantity|bid order_id|ask order_id` of trade. Record
+cut by crash (or damaged) ends the journal, it is truncated on open.
+
+Records are collected in memory and written by one thread, so concurrent
+events are written (and fsynced) together (group commit). Durability is
+given by `settings.journal`:
+
+    sync    reports are sent after their records are fsynced
+    batch   records are written and fsynced once per commit_interval
+    none    records are written once per commit_interval without fsync
+"""
+
+import asyncio
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from . import settings
+from .priority_queue.order_encoding import decode_order, encode_order
+from .utils import get_logger
+
+ORDER = 1
+CANCEL = 2
+TRADE = 3
+
+DURABILITIES = ("sync", "batch", "none")
+
+_header = struct.Struct("<IIB")
+_symbol_length = struct.Struct("<H")
+
+
+def encode_record(kind, symbol, data):
+    symbol = (symbol or "").encode()
+    payload = _symbol_length.pack(len(symbol)) + symbol + data
+    return _header.pack(len(payload), zlib.crc32(bytes([kind]) + payload), kind) + payload
+
+
+def decode_event(kind, data):
+    """ Return order, order_id of cancelled order or (time, price, quantity, bid_id, ask_id) of trade. """
+    if kind == ORDER:
+        return decode_order(data)
+    if kind == CANCEL:
+        return int(data)
+    time, price, quantity, bid_id, ask_id = data.split(b"|")
+    return float(time), int(price), int(quantity), int(bid_id), int(ask_id)
+
+
+def decode_records(data):
+    """
+    Return list of (kind, symbol, data) of complete records and number of
+    bytes they take. `data` may be memoryview, only data of records is copied.
+    """
+    records = []
+    offset = 0
+    while offset + _header.size <= len(data):
+        length, crc, kind = _header.unpack_from(data, offset)
+        start = offset + _header.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload, zlib.crc32(bytes([kind]))) != crc:
+            break
+        symbol_length = _symbol_length.unpack_from(payload)[0]
+        symbol = bytes(payload[_symbol_length.size:_symbol_length.size + symbol_length]).decode() or None
+        records.append((kind, symbol, bytes(payload[_symbol_length.size + symbol_length:])))
+        offset = start + length
+    return records, offset
+
+
+class Journal:
+    """ Append-only journal in file `path`, call `read` before `open`. """
+    def __init__(self, path, loop=None, durability=None, commit_interval=None):
+        self.path = path
+        self.loop = asyncio.get_event_loop() if loop is None else loop
+        self.durability = settings.journal["durability"] if durability is None else durability
+        if self.durability not in DURABILITIES:
+            raise ValueError("Unknown durability {!r}, use one of {}.".format(self.durability, DURABILITIES))
+        self.commit_interval = settings.journal["commit_interval"] if commit_interval is None else commit_interval
+        self._fd = None
+        self._buffer = bytearray()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._writing = False
+        self._commit_handle = None
+        self._next_commit = None
+        self._valid_length = None
+        # bytes of records appended to the journal, written or not
+        self.position = 0
+        self._logger = get_logger()
+
+    def read(self, offset=0):
+        """
+        Return list of (kind, symbol, data) of records in the journal starting
+        at byte `offset`, see `decode_event`.
+        """
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        records, length = decode_records(data)
+        if length < len(data):
+            self._logger.warning("Journal %s has %d bytes of incomplete record after %d records", self.path,
+                                 len(data) - length, len(records))
+        self._valid_length = self.position = offset + length
+        return records
+
+    def length(self):
+        """ Return size of the journal file in bytes. """
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def open(self):
+        """ Open the journal for appending, incomplete record at the end is cut off. """
+        if self._valid_length is None:
+            self.read()
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        os.ftruncate(self._fd, self._valid_length)
+
+    @staticmethod
+    def order_record(symbol, order):
+        """ Return record of `order`, raises `ValueError` if order can't be encoded. """
+        return encode_record(ORDER, symbol, encode_order(order))
+
+    def append(self, record):
+        self._buffer.extend(record)
+        self.position += len(record)
+
+    def append_cancel(self, symbol, order_id):
+        self.append(encode_record(CANCEL, symbol, str(order_id).encode()))
+
+    def append_trade(self, symbol, trade):
+        self.append(encode_record(TRADE, symbol, "{!r}|{}|{}|{}|{}".format(
+            float(trade.time), trade.price, trade.quantity, trade.bid_order.order_id,
+            trade.ask_order.order_id).encode()))
+
+    @asyncio.coroutine
+    async def commit(self, wait=False):
+        """
+        Make appended records durable as given by durability. With "sync" (or
+        `wait`) it waits until they are written, otherwise it only schedules
+        the write.
+        """
+        if self.durability != "sync" and not wait:
+            if self._commit_handle is None and not self._writing and self._buffer:
+                self._commit_handle = self.loop.call_later(self.commit_interval, self._write_buffer)
+            return
+        commit = self._next_commit
+        if commit is None:
+            commit = self._next_commit = self.loop.create_future()
+            if not self._writing:
+                # records appended in this iteration of the loop are committed together
+                self.loop.call_soon(self._write_buffer)
+        await asyncio.shield(commit, loop=self.loop)
+
+    def _write(self, data):
+        view = memoryview(data)
+        while view:
+            # write may be partial, e.g. when interrupted by signal
+            view = view[os.write(self._fd, view):]
+        if self.durability != "none":
+            os.fsync(self._fd)
+
+    def _write_buffer(self):
+        if self._commit_handle is not None:
+            self._commit_handle.cancel()
+            self._commit_handle = None
+        if self._writing:
+            return
+        data, self._buffer = bytes(self._buffer), bytearray()
+        commit, self._next_commit = self._next_commit, None
+        self._writing = True
+        future = self.loop.run_in_executor(self._executor, self._write, data)
+        future.add_done_callback(lambda future: self._written(future, commit))
+
+    def _written(self, future, commit):
+        self._writing = False
+        if commit is not None:
+            if future.exception() is not None:
+                commit.set_exception(future.exception())
+            else:
+                commit.set_result(None)
+        elif future.exception() is not None:
+            self._logger.error("Failed to write journal %s", self.path, exc_info=future.exception())
+        if self._next_commit is not None:
+            self._write_buffer()
+        elif self._buffer and self._commit_handle is None:
+            self._commit_handle = self.loop.call_later(self.commit_interval, self._write_buffer)
+
+    def close(self):
+        """ Write and fsync the rest of records and close the journal. """
+        if self._commit_handle is not None:
+            self._commit_handle.cancel()
+        if self._fd is not None:
+            # the executor writes in order, so the rest goes after records being written
+            self._executor.submit(self._write, bytes(self._buffer))
+            self._buffer = bytearray()
+            self._executor.shutdown(wait=True)
+            os.fsync(self._fd)
+            os.close(self._fd)
+            self._fd = None
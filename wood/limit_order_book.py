@@ -4,23 +4,111 @@ import asyncio
 import time
 
 from .orders import BidOrder, AskOrder, MarketBidOrder, MarketAskOrder, Trade
-from .priority_queue import MemoryPriorityQueue
+from .priority_queue import LadderPriorityQueue, RedisPriorityQueue
+from .priority_queue.order_encoding import decode_order, encode_order
+from .priority_queue.redis_scripts import ADD_AND_MATCH, MAX_QUANTITY, evaluate
 from .utils import get_logger
 
 
-class LimitOrderBook:
-    """ Structure that where matching of orders happens. """
-    def __init__(self, loop, priority_queue=MemoryPriorityQueue):
-        self.bid_queue = priority_queue(loop, reverse=True, name="bid_queue")
-        loop.run_until_complete(self.bid_queue.connect())
-        self.ask_queue = priority_queue(loop, name="ask_queue")
-        loop.run_until_complete(self.ask_queue.connect())
+def is_market_order(order):
+    """ Return True if `order` is market order. """
+    return isinstance(order, (MarketBidOrder, MarketAskOrder))
+
+
+def queue_names(symbol=None):
+    """ Names of bid and ask queue of the book of `symbol`, default symbol keeps the original names. """
+    if symbol is None:
+        return "bid_queue", "ask_queue"
+    return "{}:bid_queue".format(symbol), "{}:ask_queue".format(symbol)
+
+
+class BaseLimitOrderBook:
+    """
+    Common part of limit order books: matching rules and tracking of price
+    levels changed since last time so their aggregated quantities can be
+    published.
+    """
+    def __init__(self):
+        self.changed_levels = set()
+        # time of trades, replaced by simulated clock in replay
+        self.clock = time.time
         self._logger = get_logger()
 
+    def _level_changed(self, order):
+        if not is_market_order(order):
+            self.changed_levels.add((order.side, order.price))
+
+    @staticmethod
+    def _prices_by_side(levels):
+        """ Return bid prices and ask prices of (side, price) `levels`. """
+        bid_prices = [price for side, price in levels if side == "bid"]
+        ask_prices = [price for side, price in levels if side != "bid"]
+        return bid_prices, ask_prices
+
+    @staticmethod
+    def _join_sides(levels, bid_quantities, ask_quantities):
+        """ Return quantities of `levels` in their order from quantities of both sides. """
+        bid_quantities, ask_quantities = iter(bid_quantities), iter(ask_quantities)
+        return [next(bid_quantities if side == "bid" else ask_quantities) for side, _ in levels]
+
+    def pop_changed_levels(self):
+        """ Return (side, price) of levels changed since last call. """
+        changed_levels = self.changed_levels
+        self.changed_levels = set()
+        return changed_levels
+
     def close(self):
         self.bid_queue.close()
         self.ask_queue.close()
 
+    @staticmethod
+    def can_trade(bid_order, ask_order):
+        """ Return True if `bid_order` and `ask_order` can be traded. """
+        if isinstance(bid_order, MarketBidOrder) or isinstance(ask_order, MarketAskOrder):
+            return True
+        else:
+            return bid_order.price >= ask_order.price
+
+    @staticmethod
+    def get_price(bid_order, ask_order):
+        """ Return price of trade between `bid_order` and `ask_order`. """
+        if isinstance(bid_order, MarketBidOrder) and isinstance(ask_order, MarketAskOrder):
+            return 0  # was not specified, participants exchange stock for free
+        elif isinstance(bid_order, MarketBidOrder):
+            return ask_order.price
+        elif isinstance(ask_order, MarketAskOrder):
+            return bid_order.price
+        else:
+            return bid_order.price
+
+    def __str__(self):
+        return "BID\n{}\n\nASK\n{}\n".format(self.bid_queue, self.ask_queue)
+
+
+class LimitOrderBook(BaseLimitOrderBook):
+    """ Structure that where matching of orders happens. """
+    def __init__(self, loop, priority_queue=LadderPriorityQueue, symbol=None):
+        super().__init__()
+        bid_name, ask_name = queue_names(symbol)
+        self.bid_queue = priority_queue(loop, reverse=True, name=bid_name)
+        loop.run_until_complete(self.bid_queue.connect())
+        self.ask_queue = priority_queue(loop, name=ask_name)
+        loop.run_until_complete(self.ask_queue.connect())
+
+    @asyncio.coroutine
+    async def level_quantity(self, side, price):
+        """ Return aggregated quantity of orders on `side` with `price`. """
+        queue = self.bid_queue if side == "bid" else self.ask_queue
+        return await queue.level_quantity(price)
+
+    @asyncio.coroutine
+    async def level_quantities(self, levels):
+        """ Return list of aggregated quantities of (side, price) `levels`. """
+        bid_prices, ask_prices = self._prices_by_side(levels)
+        bid_quantities = await self.bid_queue.level_quantities(bid_prices) if bid_prices else []
+        ask_quantities = await self.ask_queue.level_quantities(ask_prices) if ask_prices else []
+        return self._join_sides(levels, bid_quantities, ask_quantities)
+
     @asyncio.coroutine
     async def add(self, order):
         """ Add new order to limit order book. """
@@ -28,8 +116,15 @@ class LimitOrderBook:
             await self.bid_queue.put(order)
         elif isinstance(order, AskOrder):
             await self.ask_queue.put(order)
+        self._level_changed(order)
         self._logger.info("Added new order %s", order, extra=order._asdict())
 
+    @asyncio.coroutine
+    async def add_and_match(self, order):
+        """ Add new order and return trades it caused. """
+        await self.add(order)
+        return await self.check_trades()
+
     @asyncio.coroutine
     async def cancel(self, order_id):
         """ Remove order with `order_id` from limit order book. """
@@ -45,42 +140,29 @@ class LimitOrderBook:
             return False
         # Here could be some test to check that participant has right to cancel order
         await queue.remove(order)
+        self._level_changed(order)
         return True
 
-    @staticmethod
-    def can_trade(bid_order, ask_order):
-        """ Return True if `bid_order` and `ask_order` can be traded. """
-        if isinstance(bid_order, MarketBidOrder) or isinstance(ask_order, MarketAskOrder):
-            return True
-        else:
-            return bid_order.price >= ask_order.price
-
-    @staticmethod
-    def get_price(bid_order, ask_order):
-        """ Return price of trade between `bid_order` and `ask_order`. """
-        if isinstance(bid_order, MarketBidOrder) and isinstance(ask_order, MarketAskOrder):
-            return 0  # was not specified, participants exchange stock for free
-        elif isinstance(bid_order, MarketBidOrder):
-            return ask_order.price
-        elif isinstance(ask_order, MarketAskOrder):
-            return bid_order.price
-        else:
-            return bid_order.price
-
     @asyncio.coroutine
     async def check_trades(self):
         """ Main function that trades all orders until it cannot continue. """
         trades = []
         while not await self.bid_queue.empty() and not await self.ask_queue.empty() and \
                 self.can_trade(await self.bid_queue.peek(0), await self.ask_queue.peek(0)):
+            # other server may take the orders meanwhile, so the bid is put back
+            # when there is no ask anymore
             bid_order = await self.bid_queue.get()
-            ask_order = await self.ask_queue.get()
-            if bid_order is None or ask_order is None:
+            if bid_order is None:
                 break
+            ask_order = await self.ask_queue.get()
+            if ask_order is None:
+                await self.bid_queue.put(bid_order)
+                continue
             # if orders are no longer tradeable (because race condition) put them back
             if not self.can_trade(bid_order, ask_order):
                 await self.ask_queue.put(ask_order)
                 await self.bid_queue.put(bid_order)
+                continue
             price = self.get_price(bid_order, ask_order)
             quantity_difference = bid_order.quantity - ask_order.quantity
             if quantity_difference < 0:
@@ -95,12 +177,164 @@ class LimitOrderBook:
                 self._logger.info("Reinsert %s as %s", bid_order, changed_bid_order)
             else:
                 quantity = bid_order.quantity
-            trade = Trade(time.time(), price, quantity, bid_order, ask_order)
+            trade = Trade(self.clock(), price, quantity, bid_order, ask_order)
+            self._level_changed(bid_order)
+            self._level_changed(ask_order)
             self._logger.info("Traded %s with %s", bid_order, ask_order, extra={"bid": bid_order._asdict(),
                                                                                 "ask": ask_order._asdict(),
                                                                                 "price": price, "quantity": quantity})
             trades.append(trade)
         return trades
 
-    def __str__(self):
-        return "BID\n{}\n\nASK\n{}\n".format(self.bid_queue, self.ask_queue)
+
+class RedisLimitOrderBook(LimitOrderBook):
+    """
+    Limit order book for multiple servers with redis priority queues where
+    new order is added and matched by one Lua script (`redis_scripts`) that
+    redis runs atomically. Matching takes one round trip and servers do not
+    race for the same orders. Quantities above `MAX_QUANTITY` are rejected,
+    because the script can't compute them exactly.
+    """
+    def __init__(self, loop, symbol=None):
+        super().__init__(loop, RedisPriorityQueue, symbol)
+        self.connections = self.bid_queue.connections
+
+    @asyncio.coroutine
+    async def _run_add_and_match(self, record):
+        keys = self.bid_queue.keys + self.ask_queue.keys
+        async with self.connections.command() as redis:
+            return await evaluate(redis, ADD_AND_MATCH, keys, [record])
+
+    @asyncio.coroutine
+    async def level_quantities(self, levels):
+        """ Return list of aggregated quantities of (side, price) `levels` in one round trip. """
+        bid_prices, ask_prices = self._prices_by_side(levels)
+        async with self.connections.command() as redis:
+            pipeline = redis.pipeline()
+            bid_quantities = pipeline.hmget(self.bid_queue.depth_name, *bid_prices) if bid_prices else None
+            ask_quantities = pipeline.hmget(self.ask_queue.depth_name, *ask_prices) if ask_prices else None
+            await pipeline.execute()
+        bid_quantities = await bid_quantities if bid_prices else []
+        ask_quantities = await ask_quantities if ask_prices else []
+        return [0 if quantity is None else int(quantity)
+                for quantity in self._join_sides(levels, bid_quantities, ask_quantities)]
+
+    @asyncio.coroutine
+    async def add_and_match(self, order):
+        """ Add new order and return trades it caused, all in one round trip. """
+        if order.quantity > MAX_QUANTITY:
+            raise ValueError("Quantity {} is greater than {}.".format(order.quantity, MAX_QUANTITY))
+        reply = await self._run_add_and_match(encode_order(order))
+        self._level_changed(order)
+        self._logger.info("Added new order %s", order, extra=order._asdict())
+        trades = []
+        for price, quantity, record in zip(reply[::3], reply[1::3], reply[2::3]):
+            resting_order = decode_order(record)
+            if isinstance(order, BidOrder):
+                bid_order, ask_order = order, resting_order
+            else:
+                bid_order, ask_order = resting_order, order
+            price = int(price)
+            trades.append(Trade(self.clock(), price, quantity, bid_order, ask_order))
+            self._level_changed(resting_order)
+            self._logger.info("Traded %s with %s", bid_order, ask_order, extra={"bid": bid_order._asdict(),
+                                                                                "ask": ask_order._asdict(),
+                                                                                "price": price, "quantity": quantity})
+            order = order._replace(quantity=order.quantity - quantity)
+        return trades
+
+    @asyncio.coroutine
+    async def cancel(self, order_id):
+        """ Remove order with `order_id` from limit order book, each side by one script. """
+        self._logger.debug("Cancelling order %s", order_id)
+        cancelled = False
+        for queue in (self.bid_queue, self.ask_queue):
+            order = await queue.remove_by_id(order_id)
+            if order is not None:
+                self._level_changed(order)
+                cancelled = True
+        return cancelled
+
+
+class SyncLimitOrderBook(BaseLimitOrderBook):
+    """
+    Synchronous limit order book for the in memory engine. It has the same
+    matching rules as `LimitOrderBook` but works directly with
+    `LadderPriorityQueue` so adding, cancelling and matching of orders never
+    creates a coroutine.
+    """
+    def __init__(self, loop=None, symbol=None):
+        super().__init__()
+        bid_name, ask_name = queue_names(symbol)
+        self.bid_queue = LadderPriorityQueue(loop, reverse=True, name=bid_name)
+        self.ask_queue = LadderPriorityQueue(loop, name=ask_name)
+
+    def level_quantity(self, side, price):
+        """ Return aggregated quantity of orders on `side` with `price`. """
+        queue = self.bid_queue if side == "bid" else self.ask_queue
+        return queue.level_quantity_nowait(price)
+
+    def level_quantities(self, levels):
+        """ Return list of aggregated quantities of (side, price) `levels`. """
+        return [self.level_quantity(side, price) for side, price in levels]
+
+    def add(self, order):
+        """ Add new order to limit order book. """
+        if isinstance(order, BidOrder):
+            self.bid_queue.put_nowait(order)
+        elif isinstance(order, AskOrder):
+            self.ask_queue.put_nowait(order)
+        self._level_changed(order)
+        self._logger.info("Added new order %s", order, extra=order._asdict())
+
+    def cancel(self, order_id):
+        """ Remove order with `order_id` from limit order book. """
+        self._logger.debug("Cancelling order %s", order_id)
+        cancelled = False
+        for queue in (self.bid_queue, self.ask_queue):
+            order = queue.peek_by_id_nowait(order_id)
+            if order is not None:
+                queue.remove_nowait(order)
+                self._level_changed(order)
+                cancelled = True
+        return cancelled
+
+    def match(self):
+        """
+        Trade all orders until it cannot continue. Partially traded order
+        stays on the top of its queue.
+        """
+        trades = []
+        bid_queue = self.bid_queue
+        ask_queue = self.ask_queue
+        while bid_queue and ask_queue:
+            bid_order = bid_queue.peek_nowait()
+            ask_order = ask_queue.peek_nowait()
+            if not self.can_trade(bid_order, ask_order):
+                break
+            price = self.get_price(bid_order, ask_order)
+            quantity_difference = bid_order.quantity - ask_order.quantity
+            if quantity_difference < 0:
+                changed_ask_order = ask_order._replace(quantity=-quantity_difference)
+                ask_queue.replace_nowait(changed_ask_order)
+                bid_queue.get_nowait()
+                quantity = bid_order.quantity
+                self._logger.info("Update %s to %s", ask_order, changed_ask_order)
+            elif quantity_difference > 0:
+                changed_bid_order = bid_order._replace(quantity=quantity_difference)
+                bid_queue.replace_nowait(changed_bid_order)
+                ask_queue.get_nowait()
+                quantity = ask_order.quantity
+                self._logger.info("Update %s to %s", bid_order, changed_bid_order)
+            else:
+                bid_queue.get_nowait()
+                ask_queue.get_nowait()
+                quantity = bid_order.quantity
+            trade = Trade(self.clock(), price, quantity, bid_order, ask_order)
+            self._level_changed(bid_order)
+            self._level_changed(ask_order)
+            self._logger.info("Traded %s with %s", bid_order, ask_order, extra={"bid": bid_order._asdict(),
+                                                                                "ask": ask_order._asdict(),
+                                                                                "price": price, "quantity": quantity})
+            trades.append(trade)
+        return trades
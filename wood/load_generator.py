@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Open-loop load generator: `python -m wood load`. Orders are sent at target
+`rate` (per second, for all connections together) with exponentially
+distributed gaps, independently of replies of the server, so a slow server
+is not hidden by clients that wait for it. Connections are spread over
+`processes` spawned processes with their own event loops.
+
+Mix of limit, market and cancel orders is given by weights, prices and
+quantities follow `random_client`. Every message is correlated with its
+first reply by orderId: `NEW` of create and market order, `CANCELLED` of
+cancel. Error replies have no orderId, they belong to the oldest waiting
+message of the connection because the server replies to messages of one
+connection in order. Latency is measured from the time the message was
+scheduled to be sent, not from the time it was really written, and it is
+recorded in microseconds to `Histogram`.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import signal
+import time
+from collections import OrderedDict
+
+from tabulate import tabulate
+
+from . import codec
+from .histogram import Histogram
+from .random_client import MU, ORDER_ID_BIT_LEN, QUANTITY_MU, SIDES, SIGMA
+from .sharding import spawn_context
+
+DEFAULT_MIX = "limit=70,market=10,cancel=20"
+# cancels pick one of last orders of the connection
+CANCEL_WINDOW = 100
+
+
+def parse_mix(mix):
+    """ Return dict of weights from "limit=70,market=10,cancel=20". """
+    weights = {}
+    for item in mix.split(","):
+        kind, _, weight = item.partition("=")
+        kind = kind.strip()
+        if kind not in ("limit", "market", "cancel"):
+            raise ValueError("Unknown order kind {!r} in mix.".format(kind))
+        weights[kind] = float(weight)
+    if sum(weights.values()) <= 0:
+        raise ValueError("Mix {!r} has no positive weight.".format(mix))
+    return weights
+
+
+class OrderGenerator:
+    """ Messages of one connection in `mix` of kinds with random order ids like `random_client`. """
+    def __init__(self, mix, generator=None):
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.random = random.Random() if generator is None else generator
+        self.recent = []
+
+    def _kind(self):
+        kind = self.random.choices(self.kinds, self.weights)[0]
+        if kind == "cancel" and not self.recent:
+            return "limit"
+        return kind
+
+    def next(self):
+        """ Return (key of reply, message), key is ("order" or "cancel", orderId). """
+        kind = self._kind()
+        if kind == "cancel":
+            order_id = self.recent.pop(self.random.randrange(len(self.recent)))
+            return ("cancel", order_id), {"message": "cancelOrder", "orderId": order_id}
+        order_id = self.random.getrandbits(ORDER_ID_BIT_LEN)
+        side = self.random.choice(SIDES)
+        message = {"message": "createOrder", "orderId": order_id, "side": side,
+                   "quantity": max(1, round(self.random.gauss(QUANTITY_MU, SIGMA)))}
+        if kind == "market":
+            message["message"] = "marketOrder"
+        else:
+            message["price"] = max(0, round(self.random.gauss(MU[side], SIGMA)))
+            self.recent.append(order_id)
+            del self.recent[:-CANCEL_WINDOW]
+        return ("order", order_id), message
+
+
+class Connection:
+    """ Connection sending messages open-loop and measuring latency of their first replies. """
+    def __init__(self, loop, stats, histogram, generator):
+        self.loop = loop
+        self.stats = stats
+        self.histogram = histogram
+        self.generator = generator
+        # key -> scheduled time of send, oldest first
+        self.pending = OrderedDict()
+
+    def _replied(self, key):
+        scheduled = self.pending.pop(key, None)
+        if scheduled is None:
+            return
+        self.histogram.record((self.loop.time() - scheduled) * 1e6)
+        self.stats["replies"] += 1
+
+    @asyncio.coroutine
+    async def receive(self, reader):
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            try:
+                report = codec.loads(line)
+            except ValueError:
+                continue
+            if "error" in report:
+                if self.pending:
+                    self._replied(next(iter(self.pending)))
+                    self.stats["errors"] += 1
+            elif report.get("report") == "NEW":
+                self._replied(("order", report["orderId"]))
+            elif report.get("report") == "CANCELLED":
+                self._replied(("cancel", report["orderId"]))
+            elif report.get("report") == "FILL":
+                self.stats["fills"] += 1
+
+    @asyncio.coroutine
+    async def send(self, writer, rate, end):
+        scheduled = self.loop.time()
+        while True:
+            scheduled += self.generator.random.expovariate(rate)
+            if scheduled >= end:
+                return
+            delay = scheduled - self.loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay, loop=self.loop)
+            key, message = self.generator.next()
+            self.pending[key] = scheduled
+            writer.write(codec.dumps(message))
+            self.stats["sent"] += 1
+            await writer.drain()
+
+
+@asyncio.coroutine
+async def generate(loop, host, port, connections, rate, duration, mix, wait, seed=None):
+    """ Run `connections` for `duration` seconds at total `rate`, return stats and histogram. """
+    stats = {"connections": 0, "sent": 0, "replies": 0, "errors": 0, "fills": 0, "lost": 0}
+    histogram = Histogram()
+    generator = random.Random(seed)
+    streams = []
+    for _ in range(connections):
+        streams.append(await asyncio.open_connection(host, port, loop=loop))
+        stats["connections"] += 1
+    clients = [Connection(loop, stats, histogram, OrderGenerator(mix, random.Random(generator.random())))
+               for _ in streams]
+    receivers = [loop.create_task(client.receive(reader)) for client, (reader, _) in zip(clients, streams)]
+    start = loop.time()
+    try:
+        await asyncio.gather(*[client.send(writer, rate / connections, start + duration)
+                               for client, (_, writer) in zip(clients, streams)], loop=loop)
+        stats["seconds"] = loop.time() - start
+        deadline = loop.time() + wait
+        while any(client.pending for client in clients) and loop.time() < deadline:
+            await asyncio.sleep(0.01, loop=loop)
+    finally:
+        for receiver in receivers:
+            receiver.cancel()
+        for _, writer in streams:
+            writer.close()
+    stats["lost"] = sum(len(client.pending) for client in clients)
+    return stats, histogram
+
+
+def run_process(host, port, connections, rate, duration, mix, wait, seed):
+    """ Entry point of generator process, return stats and histogram. """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(generate(loop, host, port, connections, rate, duration, mix, wait, seed))
+    finally:
+        loop.close()
+
+
+def run(host="127.0.0.1", port=7001, connections=1, rate=100.0, duration=10.0, mix=DEFAULT_MIX, wait=5.0,
+        processes=1, seed=None):
+    """ Run generator in `processes` processes, return merged stats and histogram. """
+    mix = parse_mix(mix) if isinstance(mix, str) else mix
+    processes = max(1, min(processes, connections))
+    arguments = []
+    for index in range(processes):
+        process_connections = connections // processes + (index < connections % processes)
+        arguments.append((host, port, process_connections, rate * process_connections / connections, duration, mix,
+                          wait, None if seed is None else seed + index))
+    if processes == 1:
+        results = [run_process(*arguments[0])]
+    else:
+        with spawn_context.Pool(processes) as pool:
+            results = pool.starmap(run_process, arguments)
+    stats, histogram = results[0]
+    for process_stats, process_histogram in results[1:]:
+        for key, value in process_stats.items():
+            stats[key] = max(stats[key], value) if key == "seconds" else stats[key] + value
+        histogram.merge(process_histogram)
+    return stats, histogram
+
+
+def summary(stats, histogram):
+    """ Return dict with stats, achieved rate and latency percentiles in milliseconds. """
+    return dict(stats, rate=stats["sent"] / stats["seconds"] if stats.get("seconds") else 0.0,
+                latency_ms={"mean": histogram.mean() / 1000, "min": (histogram.min or 0) / 1000,
+                            "percentiles": [[percentile, value / 1000, count]
+                                            for percentile, value, count in histogram.percentiles()]})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m wood load",
+                                     description="Send orders to server at fixed rate and measure latency.")
+    parser.add_argument("--host", default="127.0.0.1", help="Host of the server.")
+    parser.add_argument("-p", "--port", type=int, default=7001, help="Private port of the server.")
+    parser.add_argument("-c", "--connections", type=int, default=10, help="Number of connections.")
+    parser.add_argument("-r", "--rate", type=float, default=1000.0, help="Target orders per second of all connections.")
+    parser.add_argument("-d", "--duration", type=float, default=10.0, help="Seconds of sending.")
+    parser.add_argument("--processes", type=int, default=1, help="Number of processes sharing the connections.")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Weights of limit, market and cancel orders.")
+    parser.add_argument("--wait", type=float, default=5.0, help="Seconds to wait for replies after sending.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of random orders.")
+    parser.add_argument("--json", action="store_true", help="Print results as json.")
+    args = parser.parse_args(argv)
+    try:
+        parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    started = time.time()
+    stats, histogram = run(args.host, args.port, args.connections, args.rate, args.duration, args.mix, args.wait,
+                           args.processes, args.seed)
+    result = dict(summary(stats, histogram), started=started, target_rate=args.rate, mix=args.mix)
+    if args.json:
+        print(json.dumps(result, indent=2, sort_keys=True))
+        return
+    print("Sent {sent} messages over {connections} connections in {seconds:.1f} s ({rate:.0f}/s of {target_rate:.0f}/s),"
+          " {replies} replies, {errors} errors, {fills} fills, {lost} without reply".format(**result))
+    print(tabulate([(percentile, value, count, 1 / (1 - percentile / 100) if percentile < 100 else None)
+                    for percentile, value, count in result["latency_ms"]["percentiles"]],
+                   headers=["Percentile", "Latency ms", "Count", "1/(1-Percentile)"], floatfmt=".3f"))
+    print("Mean {mean:.3f} ms, min {min:.3f} ms".format(**result["latency_ms"]))
@@ -2,4 +2,5 @@
 
 from .base_priority_queue import BasePriorityQueue
 from .memory_priority_queue import MemoryPriorityQueue
+from .ladder_priority_queue import LadderPriorityQueue
 from .redis_priority_queue import RedisPriorityQueue
\ No newline at end of file
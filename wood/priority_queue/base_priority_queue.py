@@ -51,6 +51,17 @@ class BasePriorityQueue(abc.ABC):
         """ Return True if queue is empty. """
         pass
 
+    @abc.abstractmethod
+    @asyncio.coroutine
+    def level_quantity(self, price):
+        """ Return aggregated quantity of limit orders with `price`. """
+        pass
+
+    @asyncio.coroutine
+    async def level_quantities(self, prices):
+        """ Return list of aggregated quantities of limit orders with `prices`. """
+        return [await self.level_quantity(price) for price in prices]
+
     @asyncio.coroutine
     async def cardinality(self):
         """ Return length of priority queue. """
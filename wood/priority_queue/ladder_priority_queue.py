@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import bisect
+from collections import OrderedDict
+from operator import attrgetter
+
+from tabulate import tabulate
+
+from .base_priority_queue import BasePriorityQueue
+from wood.orders import MarketBidOrder, MarketAskOrder
+
+
+class LadderPriorityQueue(BasePriorityQueue):
+    """
+    In memory priority queue implemented as a sorted ladder of price levels.
+    Every level is a FIFO of orders (`OrderedDict` keyed by order_id) and
+    market orders have their own level that is always on top. Orders are also
+    indexed by order_id so cancel is O(1), insert O(log levels) and best order
+    lookup O(1). Aggregated quantity of every price level is kept up to date.
+    """
+    def __init__(self, loop=None, reverse=False, name=None):
+        super().__init__()
+        self.reverse = reverse
+        # keys of price levels sorted so that the best level is always last
+        self._keys = []
+        self._levels = {}
+        self._market = OrderedDict()
+        self._orders = {}
+        self._quantities = {}
+
+    @asyncio.coroutine
+    async def connect(self):
+        """ Unnecessary method for keep interface"""
+        pass
+
+    def _key(self, price):
+        return price if self.reverse else -price
+
+    def _price(self, key):
+        return key if self.reverse else -key
+
+    def _level(self, item):
+        if isinstance(item, (MarketBidOrder, MarketAskOrder)):
+            return self._market
+        return self._levels.get(item.price)
+
+    def _best_level(self):
+        if self._market:
+            return self._market
+        if self._keys:
+            return self._levels[self._price(self._keys[-1])]
+        return None
+
+    @staticmethod
+    def _insert(level, item):
+        """ Append `item` to `level` so that orders in the level stay ordered by time. """
+        if level and item.time < level[next(reversed(level))].time:
+            first = level[next(iter(level))]
+            level[item.order_id] = item
+            if item.time < first.time:
+                # typically remainder of partially traded order
+                level.move_to_end(item.order_id, last=False)
+            else:
+                orders = sorted(level.values(), key=attrgetter("time"))
+                level.clear()
+                level.update((order.order_id, order) for order in orders)
+        else:
+            level[item.order_id] = item
+
+    def put_nowait(self, item):
+        """ Insert item to the ladder without awaiting. """
+        if item.order_id in self._orders:
+            raise ValueError("Order with order_id %s is already present in queue." % item.order_id)
+        level = self._level(item)
+        if level is None:
+            level = self._levels[item.price] = OrderedDict()
+            self._quantities[item.price] = 0
+            bisect.insort(self._keys, self._key(item.price))
+        self._insert(level, item)
+        self._orders[item.order_id] = item
+        if level is not self._market:
+            self._quantities[item.price] += item.quantity
+
+    def load(self, items):
+        """
+        Fill empty ladder with `items` given in priority order (as iterated)
+        in one step, levels are sorted once at the end.
+        """
+        if self._orders:
+            raise ValueError("Only empty queue can be loaded.")
+        for item in items:
+            level = self._level(item)
+            if level is None:
+                level = self._levels[item.price] = OrderedDict()
+                self._quantities[item.price] = 0
+            level[item.order_id] = item
+            self._orders[item.order_id] = item
+            if level is not self._market:
+                self._quantities[item.price] += item.quantity
+        self._keys = sorted(self._key(price) for price in self._levels)
+
+    def peek_nowait(self, index=0):
+        """ Return item on `index` position without awaiting. """
+        if index == 0:
+            level = self._best_level()
+            if level is None:
+                raise IndexError("peek from an empty queue")
+            return level[next(iter(level))]
+        for position, item in enumerate(self):
+            if position == index:
+                return item
+        raise IndexError("queue index out of range")
+
+    def get_nowait(self):
+        """ Pop best item without awaiting. Return None if the queue is empty. """
+        level = self._best_level()
+        if level is None:
+            return None
+        _, item = level.popitem(last=False)
+        del self._orders[item.order_id]
+        if level is not self._market:
+            if level:
+                self._quantities[item.price] -= item.quantity
+            else:
+                del self._levels[item.price]
+                del self._quantities[item.price]
+                self._keys.pop()
+        return item
+
+    def remove_nowait(self, item):
+        """ Remove item from the ladder without awaiting. """
+        del self._orders[item.order_id]
+        level = self._level(item)
+        item = level.pop(item.order_id)
+        if level is self._market:
+            return
+        if level:
+            self._quantities[item.price] -= item.quantity
+        else:
+            del self._levels[item.price]
+            del self._quantities[item.price]
+            key = self._key(item.price)
+            if self._keys[-1] == key:
+                self._keys.pop()
+            else:
+                del self._keys[bisect.bisect_left(self._keys, key)]
+
+    def replace_nowait(self, item):
+        """
+        Replace order with the same order_id and price by `item` keeping its
+        position in the level (e.g. after partial trade).
+        """
+        old_item = self._orders[item.order_id]
+        level = self._level(item)
+        level[item.order_id] = item
+        self._orders[item.order_id] = item
+        if level is not self._market:
+            self._quantities[item.price] += item.quantity - old_item.quantity
+
+    def peek_by_id_nowait(self, order_id):
+        """ Get order with `order_id` without awaiting. """
+        return self._orders.get(order_id)
+
+    def level_quantity_nowait(self, price):
+        """ Return aggregated quantity of all orders with `price`. """
+        return self._quantities.get(price, 0)
+
+    def best_price(self):
+        """ Return price of the best limit level or None if there is none. """
+        if self._keys:
+            return self._price(self._keys[-1])
+        return None
+
+    @asyncio.coroutine
+    def put(self, item):
+        self.put_nowait(item)
+
+    @asyncio.coroutine
+    def peek(self, index):
+        return self.peek_nowait(index)
+
+    @asyncio.coroutine
+    def get(self):
+        return self.get_nowait()
+
+    @asyncio.coroutine
+    def remove(self, item):
+        self.remove_nowait(item)
+
+    @asyncio.coroutine
+    def peek_by_id(self, order_id):
+        return self.peek_by_id_nowait(order_id)
+
+    @asyncio.coroutine
+    def level_quantity(self, price):
+        return self.level_quantity_nowait(price)
+
+    @asyncio.coroutine
+    def empty(self):
+        return not self._orders
+
+    @asyncio.coroutine
+    async def cardinality(self):
+        return len(self)
+
+    def __len__(self):
+        return len(self._orders)
+
+    def __iter__(self):
+        yield from self._market.values()
+        for key in reversed(self._keys):
+            yield from self._levels[self._price(key)].values()
+
+    def __str__(self):
+        table = [(order.price, order.participant, order.quantity) for order in self]
+        return tabulate(table, headers=["Price", "Participant", "Quantity"])
@@ -3,6 +3,7 @@
 import asyncio
 import queue
 from .base_priority_queue import BasePriorityQueue
+from wood.orders import MarketBidOrder, MarketAskOrder
 from tabulate import tabulate
 
 
@@ -50,6 +51,11 @@ class MemoryPriorityQueue(BasePriorityQueue):
         except KeyError:
             return
 
+    @asyncio.coroutine
+    def level_quantity(self, price):
+        return sum(order.quantity for order in self._orders.values()
+                   if order.price == price and not isinstance(order, (MarketBidOrder, MarketAskOrder)))
+
     @asyncio.coroutine
     def empty(self):
         return self._queue.empty()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Compact encoding of orders stored in redis. Record is delimited by `|` and
+starts with version of the encoding:
+
+    3|<priority>|<kind>|<time>|<order_id>|<price>|<quantity>|<participant>
+
+Priority is fixed width key so that records of one side of the book sorted
+lexicographically are in price-time priority: market orders first, then
+limit orders by price (descending for bids), then by sequence number. It is
+`0` and sequence for market orders, `1`, price (inverted for bids) and
+sequence for limit orders, numbers are 16 and 14 hex digits. Sequence is
+assigned by redis (INCR) when the order is stored, so it doesn't depend on
+clocks of servers; records encoded with sequence 0 get it from the Lua
+scripts of `redis_scripts`. Remainder of partially traded order keeps its
+sequence.
+
+Kind is `B`, `A` for bid and ask order and `b`, `a` for market bid and ask
+order. Participant is `i<int>`, `s<str>` or `t` followed by comma separated
+items of tuple (e.g. `t s127.0.0.1,i7001` without the space).
+
+Records written by older versions (version 2 with time in priority, version
+1 without priority and reprs of order namedtuples) are still decoded (without `eval`) so existing books keep
+working and they can be rewritten by `RedisPriorityQueue.migrate`.
+"""
+
+import ast
+
+from wood.orders import BidOrder, AskOrder, MarketBidOrder, MarketAskOrder
+
+VERSION = 3
+_PREFIX = "{}|".format(VERSION).encode()
+_MAX_PRICE = 2 ** 64 - 1
+_SEQUENCE_DIGITS = 14
+
+_kinds = {
+    BidOrder: "B",
+    AskOrder: "A",
+    MarketBidOrder: "b",
+    MarketAskOrder: "a",
+}
+_order_types = {kind.encode(): order_type for order_type, kind in _kinds.items()}
+_legacy_order_types = {order_type.__name__: order_type for order_type in _kinds}
+
+
+def _encode_value(value, separator=","):
+    if type(value) is int:
+        return "i{}".format(value)
+    if type(value) is str and (separator is None or separator not in value):
+        return "s" + value
+    raise ValueError("Participant {!r} can't be encoded.".format(value))
+
+
+def _decode_value(value):
+    if value[0] == "i":
+        return int(value[1:])
+    return value[1:]
+
+
+def encode_participant(participant):
+    """ Encode `participant` to str, raise `ValueError` when it can't be encoded. """
+    if type(participant) is tuple and len(participant) == 2 and type(participant[1]) is int:
+        # peername of IPv4 client
+        return "t{},i{}".format(_encode_value(participant[0]), participant[1])
+    if type(participant) is tuple:
+        return "t" + ",".join(_encode_value(value) for value in participant)
+    return _encode_value(participant, separator=None)
+
+
+def decode_participant(participant):
+    """ Decode participant encoded by `encode_participant`. """
+    if participant[0] == "t":
+        if len(participant) == 1:
+            return ()
+        return tuple(_decode_value(value) for value in participant[1:].split(","))
+    return _decode_value(participant)
+
+
+def priority(order, sequence=0):
+    """ Return key of `order` with `sequence` that sorts orders of one side in price-time priority. """
+    if type(order) in (MarketBidOrder, MarketAskOrder):
+        return "0{:014x}".format(sequence)
+    if not 0 <= order.price <= _MAX_PRICE:
+        raise ValueError("Price {} can't be encoded.".format(order.price))
+    price = _MAX_PRICE - order.price if type(order) is BidOrder else order.price
+    return "1{:016x}{:014x}".format(price, sequence)
+
+
+def encode_order(order, sequence=0):
+    """ Encode `order` with `sequence` to bytes. Equal orders are always encoded to equal bytes. """
+    return "{}|{}|{}|{!r}|{}|{}|{}|{}".format(VERSION, priority(order, sequence), _kinds[type(order)],
+                                             float(order.time), order.order_id, order.price, order.quantity,
+                                             encode_participant(order.participant)).encode()
+
+
+def sequence(record):
+    """ Return sequence number of `record` of current version. """
+    return int(record.split(b"|", 2)[1][-_SEQUENCE_DIGITS:], 16)
+
+
+def is_legacy(record):
+    """ Return True if `record` was written by older version. """
+    return not record.startswith(_PREFIX)
+
+
+def decode_legacy_order(record):
+    """ Decode repr of order namedtuple without evaluating it. """
+    if isinstance(record, bytes):
+        record = record.decode()
+    call = ast.parse(record, mode="eval").body
+    if not isinstance(call, ast.Call) or getattr(call.func, "id", None) not in _legacy_order_types:
+        raise ValueError("Unknown order record {!r}.".format(record))
+    order_type = _legacy_order_types[call.func.id]
+    args = [ast.literal_eval(arg) for arg in call.args]
+    kwargs = {keyword.arg: ast.literal_eval(keyword.value) for keyword in call.keywords}
+    return order_type(*args, **kwargs)
+
+
+def decode_order(record):
+    """ Decode order from `record` of any version. """
+    if record.startswith(_PREFIX) or record.startswith(b"2|"):
+        _, _, kind, time, order_id, price, quantity, participant = record.split(b"|", 7)
+    elif record.startswith(b"1|"):
+        _, kind, time, order_id, price, quantity, participant = record.split(b"|", 6)
+    else:
+        return decode_legacy_order(record)
+    return _order_types[kind](float(time), int(order_id), decode_participant(participant.decode()),
+                              int(price), int(quantity))
@@ -1,92 +1,159 @@
 # -*- coding: utf-8 -*-
 
 import asyncio
-import aioredis
 import uuid
 from .base_priority_queue import BasePriorityQueue
+from .order_encoding import decode_order, encode_order, is_legacy, sequence
+from .redis_scripts import CANCEL, POP, PUT, evaluate
 
-import wood.settings as settings
-from wood.orders import BidOrder, AskOrder, MarketBidOrder, MarketAskOrder
+from wood.orders import MarketBidOrder, MarketAskOrder
+from wood.redis_connections import get_connections
 
 
 class RedisPriorityQueue(BasePriorityQueue):
+    """
+    Priority queue stored in redis sorted set. Orders are stored in encoding
+    of `order_encoding` with score 0, so the set is ordered by priority key of
+    the records and the first record is the best order. Orders are
+    indexed by order_id in hash `<zset_name>:orders`, so lookup by order_id
+    takes one round trip. Aggregated quantities of price levels are kept in
+    hash `<zset_name>:depth`. Orders are stored, popped and removed by Lua
+    scripts (`redis_scripts`) that update all keys atomically with the record
+    stored in redis. Stored order gets sequence number from counter
+    `<zset_name>:sequence`, remainder of the order popped last is put back
+    with its sequence so it keeps its place. Commands run on connections from
+    the pool shared by the server (`RedisConnections`).
+    """
     def __init__(self, loop, reverse=False, name=None):
         super().__init__()
         self.loop = loop
         self.reverse = reverse
         self.zset_name = str(uuid.uuid4()) if name is None else name
+        self.depth_name = self.zset_name + ":depth"
+        self.orders_name = self.zset_name + ":orders"
+        self.sequence_name = self.zset_name + ":sequence"
+        # time, order_id, participant and price of the order popped last and its sequence
+        self._popped = (None, 0)
+        self.connections = get_connections(loop)
 
-    def str_to_item(self, s):
-        # http://nedbatchelder.com/blog/201206/eval_really_is_dangerous.html
-        # eval can be really dangerous but this is just a toy application
-        return eval(s, {"AskOrder": AskOrder,
-                        "BidOrder": BidOrder,
-                        "MarketAskOrder": MarketAskOrder,
-                        "MarketBidOrder": MarketBidOrder})
+    @staticmethod
+    def str_to_item(record):
+        return decode_order(record)
 
     @asyncio.coroutine
     async def connect(self):
-        self._redis = await aioredis.create_redis((settings.redis["host"], settings.redis["port"]), loop=self.loop)
+        await self.connections.connect()
+        # records of older versions have score of their price (-1 for market
+        # orders) or 0, with score 0 versions 1 and 2 sort before and reprs
+        # after current records, so either the first or the last is legacy
+        async with self.connections.command() as redis:
+            records = await redis.zrange(self.zset_name, 0, 0) + await redis.zrange(self.zset_name, -1, -1)
+        if any(is_legacy(record) for record in records):
+            await self.migrate()
 
     def close(self):
-        self._redis.close()
+        self.connections.release()
+
+    @property
+    def keys(self):
+        """ Redis keys of the sorted set, order_id index, depth and sequence as expected by `redis_scripts`. """
+        return [self.zset_name, self.orders_name, self.depth_name, self.sequence_name]
+
+    @staticmethod
+    def _is_limit_order(item):
+        return not isinstance(item, (MarketBidOrder, MarketAskOrder))
 
     @asyncio.coroutine
     async def put(self, item):
-        record = str(item)
-        await self._redis.zadd(self.zset_name, item.price, record)
+        popped, popped_sequence = self._popped
+        record = encode_order(item, popped_sequence if item[:4] == popped else 0)
+        async with self.connections.command() as redis:
+            await evaluate(redis, PUT, self.keys, [record])
 
     @asyncio.coroutine
     async def peek(self, index):
-        if self.reverse:
-            records = await self._redis.zrevrange(self.zset_name, index, index)
-        else:
-            records = await self._redis.zrange(self.zset_name, index, index)
+        async with self.connections.command() as redis:
+            records = await redis.zrange(self.zset_name, index, index)
         return self.str_to_item(records[0])
 
     @asyncio.coroutine
     async def get(self):
-        while True:
-            # reverse need a little hack because items
-            if self.reverse:
-                records = await self._redis.zrevrange(self.zset_name, 0, 0, withscores=True)
-                # records are list of [key1, score1, key2, score2, ...]
-                if len(records) == 0:
-                    return None
-                best_score = records[1]
-                records = await self._redis.zrangebyscore(self.zset_name, best_score, best_score)
-                # choose first because it has lowest time
-                record = records[0]
-            else:
-                records = await self._redis.zrange(self.zset_name, 0, 0)
-                if len(records) == 0:
-                    return None
-                record = records[0]
-            # removal is not atomic so it may happen that somebody takes this before I can delete it
-            if await self._redis.zrem(self.zset_name, record) == 1:
-                item = self.str_to_item(record)
-                return item
+        async with self.connections.command() as redis:
+            record = await evaluate(redis, POP, self.keys, [])
+        if record is None:
+            return None
+        item = self.str_to_item(record)
+        self._popped = (item[:4], sequence(record))
+        return item
 
     @asyncio.coroutine
     async def remove(self, item):
-        record = str(item)
-        await self._redis.zrem(self.zset_name, record)
+        if await self.remove_by_id(item.order_id) is None:
+            # the order may be still stored by older version without index
+            async with self.connections.command() as redis:
+                await redis.zrem(self.zset_name, str(item))
+
+    @asyncio.coroutine
+    async def remove_by_id(self, order_id):
+        """ Remove order with `order_id` and return it as it was stored, None if there is no such order. """
+        async with self.connections.command() as redis:
+            record = await evaluate(redis, CANCEL, self.keys, [order_id])
+        return None if record is None else self.str_to_item(record)
+
+    @asyncio.coroutine
+    async def migrate(self):
+        """
+        Rewrite orders stored by older versions to current encoding, build
+        order_id index and depth in one transaction. Rewritten orders get
+        sequence numbers in order of their time. Return number of rewritten
+        orders.
+        """
+        async with self.connections.command() as redis:
+            records = await redis.zrange(self.zset_name, 0, -1)
+            legacy = sorted((record for record in records if is_legacy(record)),
+                            key=lambda record: decode_order(record).time)
+            last = await redis.incrby(self.sequence_name, len(legacy)) if legacy else 0
+            sequences = {record: last - len(legacy) + i for i, record in enumerate(legacy, 1)}
+            transaction = redis.multi_exec()
+            transaction.delete(self.depth_name)
+            for record in records:
+                item = decode_order(record)
+                if record in sequences:
+                    transaction.zrem(self.zset_name, record)
+                    record = encode_order(item, sequences[record])
+                    transaction.zadd(self.zset_name, 0, record)
+                transaction.hset(self.orders_name, item.order_id, record)
+                if self._is_limit_order(item):
+                    transaction.hincrby(self.depth_name, item.price, item.quantity)
+            await transaction.execute()
+        return len(legacy)
 
     @asyncio.coroutine
     async def peek_by_id(self, order_id):
-        records = await self._redis.zrange(self.zset_name, 0, -1)
-        for record in records:
-            item = self.str_to_item(record)
-            if item.order_id == order_id:
-                return item
-        return None
+        async with self.connections.command() as redis:
+            record = await redis.hget(self.orders_name, order_id)
+        if record is None:
+            return None
+        return self.str_to_item(record)
+
+    @asyncio.coroutine
+    async def level_quantity(self, price):
+        async with self.connections.command() as redis:
+            quantity = await redis.hget(self.depth_name, price)
+        return 0 if quantity is None else int(quantity)
+
+    @asyncio.coroutine
+    async def level_quantities(self, prices):
+        """ Return quantities of all `prices` fetched by one HMGET. """
+        async with self.connections.command() as redis:
+            quantities = await redis.hmget(self.depth_name, *prices)
+        return [0 if quantity is None else int(quantity) for quantity in quantities]
 
     @asyncio.coroutine
     async def cardinality(self):
-        return await self._redis.zcard(self.zset_name)
+        async with self.connections.command() as redis:
+            return await redis.zcard(self.zset_name)
 
     @asyncio.coroutine
     async def empty(self):
         return await self.cardinality() == 0
-
-
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Lua scripts executed atomically by redis on keys of `RedisPriorityQueue`.
+Orders are records of `order_encoding` stored with score 0, so the best order
+of each side is the first one.
+
+Lua numbers are doubles, so prices are kept as decimal strings of the records
+(compared by length first) and quantities are exact only up to
+`MAX_QUANTITY`. Scripts are run by `evaluate`.
+"""
+
+import hashlib
+
+import aioredis
+
+MAX_QUANTITY = 2 ** 53
+
+# Common part of the scripts: parsing and encoding of records, assigning of
+# sequence numbers and removal of orders from order_id index and depth
+# (KEYS: sorted set, order_id index, depth, sequence).
+_PARSE = """
+local function parse(record)
+    local version, priority, kind, time, order_id, price, quantity, participant =
+        string.match(record, "^([^|]*)|([^|]*)|([^|]*)|([^|]*)|([^|]*)|([^|]*)|([^|]*)|(.*)$")
+    if version ~= "3" then
+        return redis.error_reply("Unsupported order record " .. record)
+    end
+    return {
+        version = version,
+        priority = priority,
+        kind = kind,
+        time = time,
+        order_id = order_id,
+        price = price,
+        quantity = tonumber(quantity),
+        quantity_text = quantity,
+        participant = participant,
+    }
+end
+
+-- quantity is kept as it was parsed unless new one is given
+local function encode(order, quantity)
+    local quantity_text = order.quantity_text
+    if quantity ~= nil then
+        quantity_text = string.format("%d", quantity)
+    end
+    return table.concat({order.version, order.priority, order.kind, order.time, order.order_id, order.price,
+                         quantity_text, order.participant}, "|")
+end
+
+local function assign_sequence(order, key)
+    if tonumber(string.sub(order.priority, -14), 16) == 0 then
+        local sequence = redis.call("INCR", key)
+        order.priority = string.sub(order.priority, 1, -15) .. string.format("%014x", sequence)
+    end
+end
+
+local function is_market(order)
+    return order.kind == "b" or order.kind == "a"
+end
+
+local function forget(order, keys)
+    redis.call("HDEL", keys[2], order.order_id)
+    if not is_market(order) then
+        redis.call("HINCRBY", keys[3], order.price, "-" .. order.quantity_text)
+    end
+end
+"""
+
+# Add order to the limit order book and match it against opposite side.
+# KEYS: bid sorted set, bid order_id index, bid depth, bid sequence,
+#       ask sorted set, ask order_id index, ask depth, ask sequence
+# ARGV: encoded order with sequence 0
+# Returns flat list of trades: price, quantity and record of resting order
+# as it was before the trade.
+ADD_AND_MATCH = _PARSE + """
+local function is_lower(price, other_price)
+    if #price ~= #other_price then
+        return #price < #other_price
+    end
+    return price < other_price
+end
+
+local order = parse(ARGV[1])
+if order.err then
+    return order
+end
+local is_bid = order.kind == "B" or order.kind == "b"
+local own, other = 1, 5
+if not is_bid then
+    own, other = 5, 1
+end
+assign_sequence(order, KEYS[own + 3])
+
+local quantity = order.quantity
+local trades = {}
+while quantity > 0 do
+    local best = redis.call("ZRANGE", KEYS[other], 0, 0)[1]
+    if not best then
+        break
+    end
+    local resting = parse(best)
+    if resting.err then
+        return resting
+    end
+    local bid, ask = order, resting
+    if not is_bid then
+        bid, ask = resting, order
+    end
+    if not (is_market(bid) or is_market(ask)) and is_lower(bid.price, ask.price) then
+        break
+    end
+    local price = bid.price
+    if is_market(bid) and is_market(ask) then
+        price = "0"
+    elseif is_market(bid) then
+        price = ask.price
+    end
+    local traded = math.min(quantity, resting.quantity)
+
+    redis.call("ZREM", KEYS[other], best)
+    if traded < resting.quantity then
+        local record = encode(resting, resting.quantity - traded)
+        redis.call("ZADD", KEYS[other], 0, record)
+        redis.call("HSET", KEYS[other + 1], resting.order_id, record)
+    else
+        redis.call("HDEL", KEYS[other + 1], resting.order_id)
+    end
+    if not is_market(resting) then
+        redis.call("HINCRBY", KEYS[other + 2], resting.price, -traded)
+    end
+    quantity = quantity - traded
+    table.insert(trades, price)
+    table.insert(trades, traded)
+    table.insert(trades, best)
+end
+
+if quantity > 0 or #trades == 0 then
+    local record = encode(order)
+    if quantity < order.quantity then
+        record = encode(order, quantity)
+    end
+    redis.call("ZADD", KEYS[own], 0, record)
+    redis.call("HSET", KEYS[own + 1], order.order_id, record)
+    if not is_market(order) then
+        redis.call("HINCRBY", KEYS[own + 2], order.price, quantity)
+    end
+end
+return trades
+"""
+
+# Store order, it gets new sequence number unless it has one.
+# KEYS: sorted set, order_id index, depth, sequence
+# ARGV: encoded order
+PUT = _PARSE + """
+local order = parse(ARGV[1])
+if order.err then
+    return order
+end
+assign_sequence(order, KEYS[4])
+local record = encode(order)
+redis.call("ZADD", KEYS[1], 0, record)
+redis.call("HSET", KEYS[2], order.order_id, record)
+if not is_market(order) then
+    redis.call("HINCRBY", KEYS[3], order.price, order.quantity_text)
+end
+return record
+"""
+
+# Pop the best order of one side.
+# KEYS: sorted set, order_id index, depth, sequence
+# Returns record of the order or nil if the side is empty.
+POP = _PARSE + """
+local record = redis.call("ZRANGE", KEYS[1], 0, 0)[1]
+if not record then
+    return false
+end
+local order = parse(record)
+if order.err then
+    return order
+end
+redis.call("ZREM", KEYS[1], record)
+forget(order, KEYS)
+return record
+"""
+
+# Remove order by its order_id with quantity it has now.
+# KEYS: sorted set, order_id index, depth, sequence
+# ARGV: order_id
+# Returns record of the removed order or nil if there is no such order.
+CANCEL = _PARSE + """
+local record = redis.call("HGET", KEYS[2], ARGV[1])
+if not record then
+    return false
+end
+local order = parse(record)
+if order.err then
+    return order
+end
+redis.call("ZREM", KEYS[1], record)
+forget(order, KEYS)
+return record
+"""
+
+_digests = {}
+
+
+async def evaluate(redis, script, keys, args):
+    """
+    Run `script` by its digest and send the whole script only when it is not
+    in script cache of redis yet (or the cache was flushed).
+    """
+    digest = _digests.get(script)
+    if digest is None:
+        digest = _digests[script] = hashlib.sha1(script.encode()).hexdigest()
+    try:
+        return await redis.evalsha(digest, keys=keys, args=args)
+    except aioredis.ReplyError as e:
+        if not str(e).startswith("NOSCRIPT"):
+            raise
+        return await redis.eval(script, keys=keys, args=args)
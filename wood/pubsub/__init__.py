@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
 
 from .asyncio_queue import asyncio_queue_pubsub_factory
+from .direct import direct_pubsub_factory
 from .redis import redis_pubsub_factory
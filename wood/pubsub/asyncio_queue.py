@@ -7,7 +7,8 @@ from .base import BasePublisher, BaseSubscriber
 
 def asyncio_queue_pubsub_factory(loop):
     queue = asyncio.Queue(loop=loop)
-    return AsyncioQueueSubscriber(loop, queue), AsyncioQueuePublisher(loop, queue)
+    subscriber = AsyncioQueueSubscriber(loop, queue)
+    return subscriber, AsyncioQueuePublisher(loop, queue, subscriber)
 
 
 class AsyncioQueueSubscriber(BaseSubscriber):
@@ -35,11 +36,24 @@ class AsyncioQueueSubscriber(BaseSubscriber):
 
 
 class AsyncioQueuePublisher(BasePublisher):
-    """ Publisher using the same `asyncio.Queue` as subscriber. """
-    def __init__(self, loop, queue):
+    """
+    Publisher using the same `asyncio.Queue` as subscriber. Messages for
+    channels the subscriber is not subscribed to are not queued at all.
+    """
+    def __init__(self, loop, queue, subscriber):
         super().__init__(loop)
         self._queue = queue
+        self._subscriber = subscriber
 
     @asyncio.coroutine
     async def publish(self, channel, message):
-        await self._queue.put((str(channel), message))
+        channel = str(channel)
+        if channel in self._subscriber.subscribed:
+            await self._queue.put((channel, message))
+
+    @asyncio.coroutine
+    def publish_many(self, messages):
+        for channel, message in messages:
+            channel = str(channel)
+            if channel in self._subscriber.subscribed:
+                self._queue.put_nowait((channel, message))
@@ -27,6 +27,17 @@ class BaseSubscriber(ABC):
     async def get(self):
         pass
 
+    @asyncio.coroutine
+    async def wait_subscribed(self, channel):
+        """ Wait until messages of `channel` are really received. """
+
+    @asyncio.coroutine
+    async def listen(self, handler):
+        """ Call `handler` with channel and message of every incoming message. """
+        while True:
+            channel, message = await self.get()
+            handler(channel, message)
+
     @asyncio.coroutine
     def close(self):
         pass
@@ -45,5 +56,14 @@ class BasePublisher(ABC):
     def publish(self, channel, message):
         pass
 
+    @asyncio.coroutine
+    async def publish_many(self, messages):
+        """
+        Publish list of (channel, message) pairs in order. Implementations send
+        them all at once.
+        """
+        for channel, message in messages:
+            await self.publish(channel, message)
+
     def close(self):
         pass
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+from .base import BasePublisher, BaseSubscriber
+
+
+def direct_pubsub_factory(loop):
+    subscriber = DirectSubscriber(loop)
+    return subscriber, DirectPublisher(loop, subscriber)
+
+
+class DirectSubscriber(BaseSubscriber):
+    """
+    In-process subscriber that has no queue once listening. Messages are
+    delivered directly to handler registered by `listen` already during
+    `publish`, messages for channels that are not subscribed are dropped.
+    Until a handler is registered messages are queued for `get`.
+    """
+    def __init__(self, loop):
+        super().__init__(loop)
+        self.subscribed = set()
+        self._handler = None
+        self._queue = asyncio.Queue(loop=loop)
+
+    def subscribe(self, channel):
+        self.subscribed.add(str(channel))
+
+    def unsubscribe(self, channel):
+        self.subscribed.discard(str(channel))
+
+    @asyncio.coroutine
+    async def get(self):
+        """ Return message published before handler was registered by `listen`. """
+        return await self._queue.get()
+
+    @asyncio.coroutine
+    def listen(self, handler):
+        """
+        Register `handler`, pass it messages queued so far and return,
+        following messages are delivered by publisher.
+        """
+        self._handler = handler
+        while not self._queue.empty():
+            handler(*self._queue.get_nowait())
+
+    def deliver(self, channel, message):
+        if channel not in self.subscribed:
+            return
+        if self._handler is None:
+            self._queue.put_nowait((channel, message))
+        else:
+            self._handler(channel, message)
+
+    def close(self):
+        self._handler = None
+        self.subscribed.clear()
+
+
+class DirectPublisher(BasePublisher):
+    """ Publisher that calls handler of subscriber synchronously. """
+    def __init__(self, loop, subscriber):
+        super().__init__(loop)
+        self._subscriber = subscriber
+
+    @asyncio.coroutine
+    def publish(self, channel, message):
+        self._subscriber.deliver(str(channel), message)
+
+    @asyncio.coroutine
+    def publish_many(self, messages):
+        for channel, message in messages:
+            self._subscriber.deliver(str(channel), message)
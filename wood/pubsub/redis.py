@@ -1,11 +1,17 @@
 # -*- coding: utf-8 -*-
 
 import asyncio
+import functools
 
-import aioredis
-
-import wood.settings as settings
 from .base import BasePublisher, BaseSubscriber
+from wood.redis_connections import get_connections
+
+
+def _plain(message):
+    """ aioredis encodes arguments by exact type, so subclasses of bytes (`codec.LevelReport`) are converted. """
+    if isinstance(message, bytes) and type(message) is not bytes:
+        return bytes(message)
+    return message
 
 
 def redis_pubsub_factory(loop):
@@ -13,54 +19,110 @@ def redis_pubsub_factory(loop):
 
 
 class RedisSubscriber(BaseSubscriber):
-    """ Subscriber that uses redis PubSub functionality. """
+    """
+    Subscriber that uses redis PubSub functionality. Channels are subscribed
+    one by one on pub/sub connection shared by the server (`RedisConnections`)
+    so the server receives only messages for its own clients. Subscriptions
+    and unsubscriptions of one channel run in order they were requested.
+    """
     def __init__(self, loop):
         super().__init__(loop)
         self.subscribed = set()
+        self._queue = asyncio.Queue(loop=loop)
+        self._handler = None
+        # channel -> future of the last requested subscribe or unsubscribe
+        self._operations = {}
+        self._connections = get_connections(loop)
 
     @asyncio.coroutine
     async def connect(self):
-        """
-        Connect to redis and subscribe to everything. This is necessary because
-        we need to subscribe to certain channel before we call `get`.
-        """
-        self._redis = await aioredis.create_redis((settings.redis["host"], settings.redis["port"]),
-                                                  loop=self.loop)
-        channels = await self._redis.psubscribe("*")
-        self._channel = channels[0]
+        await self._connections.connect_pubsub()
 
+    def _schedule(self, channel, operation):
+        """ Run `operation` of `channel` after the previous one finished. """
+        previous = self._operations.get(channel)
+        future = asyncio.ensure_future(self._run_after(previous, operation, channel), loop=self.loop)
+        self._operations[channel] = future
+        future.add_done_callback(functools.partial(self._operation_done, channel))
+
+    def _operation_done(self, channel, future):
+        if self._operations.get(channel) is future:
+            del self._operations[channel]
+
+    @asyncio.coroutine
+    async def _run_after(self, previous, operation, channel):
+        if previous is not None:
+            try:
+                await previous
+            except Exception:
+                pass
+        await operation(channel, self)
 
     def subscribe(self, channel):
-        self.subscribed.add(str(channel))
+        channel = str(channel)
+        self.subscribed.add(channel)
+        self._schedule(channel, self._connections.subscribe)
 
     def unsubscribe(self, channel):
-        self.subscribed.remove(str(channel))
+        channel = str(channel)
+        self.subscribed.discard(channel)
+        self._schedule(channel, self._connections.unsubscribe)
+
+    @asyncio.coroutine
+    async def wait_subscribed(self, channel):
+        operation = self._operations.get(str(channel))
+        if operation is not None:
+            await asyncio.shield(operation, loop=self.loop)
+
+    def deliver(self, channel, message):
+        if channel not in self.subscribed:
+            return
+        if self._handler is not None:
+            self._handler(channel, message)
+        else:
+            self._queue.put_nowait((channel, message))
 
     @asyncio.coroutine
     async def get(self):
-        async for reply in self._channel.iter():
-            channel, message = reply
-            channel = channel.decode()
-            message = message.decode()
-            if channel in self.subscribed:
-                return channel, message
+        return await self._queue.get()
+
+    @asyncio.coroutine
+    def listen(self, handler):
+        """ Register `handler` that is called directly for every incoming message. """
+        self._handler = handler
+        while not self._queue.empty():
+            handler(*self._queue.get_nowait())
 
     def close(self):
-        self._redis.close()
+        self._handler = None
+        for channel in list(self.subscribed):
+            self.unsubscribe(channel)
+        self._connections.release()
 
 
 class RedisPublisher(BasePublisher):
     """ Publisher using Redis. """
     def __init__(self, loop):
         super().__init__(loop)
+        self._connections = get_connections(loop)
 
     @asyncio.coroutine
     async def connect(self):
-        self._redis = await aioredis.create_redis((settings.redis["host"], settings.redis["port"]), loop=self.loop)
+        await self._connections.connect()
 
     @asyncio.coroutine
     async def publish(self, channel, message):
-        await self._redis.publish(str(channel), message)
+        async with self._connections.command() as redis:
+            await redis.publish(str(channel), _plain(message))
+
+    @asyncio.coroutine
+    async def publish_many(self, messages):
+        """ Publish all messages in one pipeline. """
+        async with self._connections.command() as redis:
+            pipeline = redis.pipeline()
+            for channel, message in messages:
+                pipeline.publish(str(channel), _plain(message))
+            await pipeline.execute()
 
     def close(self):
-        self._redis.close()
+        self._connections.release()
@@ -2,7 +2,8 @@
 """
 random_client implements a client that makes periodic requests (with exponential distribution)
 to the server with random side and random price and quantity (normal distribution). It allows
-to run multiple clients at once.
+to run multiple clients at once. Every client waits for response before its next order, to
+measure capacity of the server use open-loop `load_generator` (`python -m wood load`).
 """
 
 import asyncio
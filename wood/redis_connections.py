@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+import aioredis
+
+from . import settings
+from .utils import get_logger
+
+_connections = {}
+
+
+def get_connections(loop):
+    """
+    Return `RedisConnections` shared by all redis backends running in `loop`.
+    Every caller becomes its user and has to call `release` when it is done.
+    """
+    connections = _connections.get(loop)
+    if connections is None or connections.closed:
+        connections = _connections[loop] = RedisConnections(loop)
+    connections.users += 1
+    return connections
+
+
+class _Command:
+    """ Async context manager that lends `aioredis.Redis` from the pool. """
+    def __init__(self, connections):
+        self._connections = connections
+        self._connection = None
+
+    async def __aenter__(self):
+        self._connection = await self._connections.acquire()
+        return self._connection
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._connections.pool.release(self._connection)
+
+
+class RedisConnections:
+    """
+    Redis connections of one server shared by priority queues, publishers and
+    subscribers: pool of command connections (`settings.redis_pool`) that can
+    run commands of concurrent coroutines in parallel and one dedicated pub/sub
+    connection. The pub/sub connection subscribes only channels that some
+    subscriber of this server needs (e.g. its own private clients) and
+    messages of every channel are dispatched to its subscribers.
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        self.users = 0
+        self.closed = False
+        self.pool = None
+        self._pubsub = None
+        # channel name -> subscribers and task reading the channel
+        self._channels = {}
+        self._readers = {}
+        self._lock = asyncio.Lock(loop=loop)
+        self._pubsub_lock = asyncio.Lock(loop=loop)
+        self._logger = get_logger()
+        self._acquired = 0
+        self._waited = 0
+        self._dispatched = 0
+
+    @staticmethod
+    def _address():
+        return settings.redis["host"], settings.redis["port"]
+
+    @asyncio.coroutine
+    async def connect(self):
+        """ Create the pool unless it already exists. """
+        async with self._lock:
+            if self.pool is None:
+                self.pool = await aioredis.create_pool(self._address(), minsize=settings.redis_pool["minsize"],
+                                                       maxsize=settings.redis_pool["maxsize"], loop=self.loop)
+
+    @asyncio.coroutine
+    async def acquire(self):
+        if self.pool.freesize == 0 and self.pool.size >= self.pool.maxsize:
+            self._waited += 1
+        self._acquired += 1
+        return await self.pool.acquire()
+
+    def command(self):
+        """
+        Return async context manager with `aioredis.Redis` on a pooled connection:
+
+            async with connections.command() as redis:
+                await redis.zadd(key, score, member)
+        """
+        return _Command(self)
+
+    @asyncio.coroutine
+    async def connect_pubsub(self):
+        """ Create the pub/sub connection unless it already exists. """
+        async with self._lock:
+            if self._pubsub is None:
+                self._pubsub = await aioredis.create_redis(self._address(), loop=self.loop)
+
+    @asyncio.coroutine
+    async def subscribe(self, channel, subscriber):
+        """ Deliver messages of `channel` to `subscriber.deliver`. """
+        await self.connect_pubsub()
+        async with self._pubsub_lock:
+            subscribers = self._channels.setdefault(channel, [])
+            if subscriber in subscribers:
+                return
+            subscribers.append(subscriber)
+            if len(subscribers) == 1:
+                redis_channel, = await self._pubsub.subscribe(channel)
+                self._readers[channel] = self.loop.create_task(self._read(channel, redis_channel))
+
+    @asyncio.coroutine
+    async def unsubscribe(self, channel, subscriber):
+        """ Stop delivering `channel` to `subscriber`, the last one unsubscribes it in redis. """
+        async with self._pubsub_lock:
+            subscribers = self._channels.get(channel, [])
+            if subscriber not in subscribers:
+                return
+            subscribers.remove(subscriber)
+            if not subscribers:
+                del self._channels[channel]
+                self._readers.pop(channel).cancel()
+                if not self._pubsub.closed:
+                    await self._pubsub.unsubscribe(channel)
+
+    @asyncio.coroutine
+    async def _read(self, channel, redis_channel):
+        async for message in redis_channel.iter():
+            self._dispatched += 1
+            for subscriber in tuple(self._channels.get(channel, ())):
+                try:
+                    subscriber.deliver(channel, message)
+                except Exception:
+                    self._logger.exception("Failed to deliver message from %s", channel)
+
+    def metrics(self):
+        """ Return dict with state and usage of the pool and pub/sub connection. """
+        pool = self.pool
+        return {
+            "pool_size": 0 if pool is None else pool.size,
+            "pool_free": 0 if pool is None else pool.freesize,
+            "pool_used": 0 if pool is None else pool.size - pool.freesize,
+            "pool_minsize": settings.redis_pool["minsize"] if pool is None else pool.minsize,
+            "pool_maxsize": settings.redis_pool["maxsize"] if pool is None else pool.maxsize,
+            "acquired": self._acquired,
+            "waited": self._waited,
+            "channels": len(self._channels),
+            "dispatched": self._dispatched,
+        }
+
+    def release(self):
+        """ Called by user when it does not need connections anymore, the last one closes them. """
+        self.users -= 1
+        if self.users <= 0:
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._logger.info("Redis connections closed, metrics %s", self.metrics())
+        for reader in self._readers.values():
+            reader.cancel()
+        if self._pubsub is not None:
+            self._pubsub.close()
+        if self.pool is not None:
+            self.pool.close()
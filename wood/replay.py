@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Deterministic replay of recorded private messages straight through
+`StockExchange` without sockets: `python -m wood replay FILE`. Every line of
+recording is
+
+    <time> <participant> <message>
+
+where message is json sent on private port, or only the message. Capture
+files of the server (see `capture`) are replayed too. Orders and
+trades get simulated time of their line (lines without time are 1 µs
+apart), so replay of the same recording always gives the same trades and
+book. Levels are published after every message and logging below warning is
+off, throughput is measured for matching only.
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+import time
+
+from . import codec, settings
+from .capture import is_capture, read_capture
+from .pubsub.base import BasePublisher
+from .stock_exchange import StockExchange
+from .utils import get_logger
+
+DEFAULT_PARTICIPANT = "replay"
+
+
+def parse_line(line):
+    """ Return (time or None, participant, message) of recording `line` or None for blank line. """
+    line = line.strip()
+    if not line:
+        return None
+    if line.startswith(b"{"):
+        return None, DEFAULT_PARTICIPANT, line
+    timestamp, participant, message = line.split(b" ", 2)
+    return float(timestamp), participant.decode(), message
+
+
+def read_recording(path):
+    """ Return list of (time, participant, message) of recording or capture in file `path`. """
+    if is_capture(path):
+        return [(timestamp, "connection-{}".format(connection_id), message)
+                for timestamp, connection_id, message in read_capture(path)]
+    with open(path, "rb") as f:
+        return [record for record in map(parse_line, f) if record is not None]
+
+
+class SimulatedClock:
+    """ Clock returning time of message being replayed. """
+    def __init__(self, start=0.0, step=0.000001):
+        self.now = start
+        self.step = step
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, timestamp=None):
+        """ Move to `timestamp` of next message, or by `step` if it has none. """
+        self.now = self.now + self.step if timestamp is None else timestamp
+
+
+class ReplayPublisher(BasePublisher):
+    """ Publisher that only counts reports, `keep` ones are stored in `messages`. """
+    def __init__(self, loop, keep=False):
+        super().__init__(loop)
+        self.keep = keep
+        self.count = 0
+        self.messages = []
+
+    @asyncio.coroutine
+    async def publish(self, channel, message):
+        self.count += 1
+        if self.keep:
+            self.messages.append(message)
+
+    @asyncio.coroutine
+    async def publish_many(self, messages):
+        self.count += len(messages)
+        if self.keep:
+            self.messages.extend(message for _, message in messages)
+
+
+class Replay:
+    """ `StockExchange` with in memory books, simulated clock and publishers that do not send anything. """
+    def __init__(self, loop, symbols=None, start=0.0):
+        self.loop = loop
+        self.clock = SimulatedClock(start)
+        self.private_publisher = ReplayPublisher(loop)
+        self.public_publisher = ReplayPublisher(loop, keep=True)
+        self.stock_exchange = StockExchange(self.private_publisher, self.public_publisher, loop,
+                                            symbols=settings.symbols if symbols is None else symbols,
+                                            clock=self.clock)
+        self.stock_exchange.order_book_tick = 0
+
+    @asyncio.coroutine
+    async def run(self, recording):
+        """ Replay list of (time, participant, message), return dict with throughput. """
+        logger = get_logger()
+        level = logger.level
+        logger.setLevel(logging.WARNING)
+        start = time.perf_counter()
+        try:
+            for timestamp, participant, message in recording:
+                self.clock.advance(timestamp)
+                await self.stock_exchange.handle_order(message, participant)
+        finally:
+            seconds = time.perf_counter() - start
+            logger.setLevel(level)
+        return {
+            "messages": len(recording),
+            "trades": len(self.trades()),
+            "seconds": seconds,
+            "messages_per_second": len(recording) / seconds if seconds else 0.0,
+        }
+
+    def trades(self):
+        """ Return public trade reports published so far as dicts. """
+        reports = (codec.loads(message) for message in self.public_publisher.messages)
+        return [report for report in reports if report.get("type") == "trade"]
+
+    def books(self):
+        """ Return final state of all books as text. """
+        return "\n".join("{}\n{}".format("default" if symbol is None else symbol, limit_order_book)
+                         for symbol, limit_order_book in sorted(self.stock_exchange.limit_order_books.items(),
+                                                                key=lambda item: item[0] or ""))
+
+    def close(self):
+        self.stock_exchange.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m wood replay",
+                                     description="Replay recorded messages through in memory stock exchange.")
+    parser.add_argument("recording", help="File with recorded messages.")
+    parser.add_argument("--symbol", dest="symbols", action="append", default=None,
+                        help="Listed symbol, can be repeated (settings.symbols by default).")
+    parser.add_argument("--trades", default="-", help="File for trades as json lines (stdout by default).")
+    parser.add_argument("--no-book", dest="book", default=True, action="store_false",
+                        help="Do not print the final book.")
+    args = parser.parse_args(argv)
+
+    recording = read_recording(args.recording)
+    loop = asyncio.new_event_loop()
+    replay = Replay(loop, args.symbols)
+    try:
+        stats = loop.run_until_complete(replay.run(recording))
+        trades = b"".join(codec.dumps(trade) for trade in replay.trades())
+        books = replay.books()
+    finally:
+        replay.close()
+        loop.close()
+    if args.trades == "-":
+        sys.stdout.buffer.write(trades)
+        sys.stdout.flush()
+    else:
+        with open(args.trades, "wb") as f:
+            f.write(trades)
+    if args.book:
+        print(books)
+    print("Replayed {messages} messages with {trades} trades in {seconds:.3f} s "
+          "({messages_per_second:.0f} messages/s)".format(**stats))
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Single producer single consumer ring buffer of frames in shared memory
+(`multiprocessing.RawArray`), so two processes can pass bytes without
+copying them through the kernel. Memory starts with two counters of bytes
+ever written (head) and read (tail), each on its own cache line, followed
+by the data. Frame is 4 bytes of length and the data, it may wrap around the
+end of the buffer.
+
+Only the producer moves head and only the consumer moves tail. The consumer
+is woken up by a byte sent to doorbell socket after every write, the
+producer retries after `RETRY_DELAY` when the buffer is full.
+
+Counters are aligned `ctypes.c_uint64` so every move is a single store that
+the other process never sees half done. Python has no memory barriers, the
+producer writes frame before it moves head and the consumer reads frame
+after it loads head, so the buffer relies on stores becoming visible to the
+other process in program order. That holds on x86-64 (total store order),
+on weakly ordered CPUs (e.g. ARM) the consumer could read frame that is not
+written yet, see `is_supported_machine`.
+"""
+
+import asyncio
+import ctypes
+import multiprocessing
+import platform
+import socket
+import struct
+
+_length = struct.Struct("<I")
+_HEAD = 0
+_TAIL = 64
+_DATA = 128
+RETRY_DELAY = 0.001
+# machines with total store order
+TSO_MACHINES = ("x86_64", "amd64", "i386", "i686", "x86")
+
+
+def is_supported_machine(machine=None):
+    """ Return True if stores are seen by other processes in order on `machine` (this one by default). """
+    return (platform.machine() if machine is None else machine).lower() in TSO_MACHINES
+
+
+class RingBuffer:
+    """ Ring buffer of `size` bytes, it can be passed to spawned process at its start. """
+    def __init__(self, size):
+        self.size = size
+        self._memory = multiprocessing.RawArray("B", _DATA + size)
+        self._attach()
+
+    def _attach(self):
+        self._view = memoryview(self._memory).cast("B")
+        self._head = ctypes.c_uint64.from_buffer(self._memory, _HEAD)
+        self._tail = ctypes.c_uint64.from_buffer(self._memory, _TAIL)
+
+    def __getstate__(self):
+        return {"size": self.size, "_memory": self._memory}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._attach()
+
+    def _counters(self):
+        return self._head.value, self._tail.value
+
+    def __len__(self):
+        """ Number of bytes waiting for the consumer (frame headers included). """
+        head, tail = self._counters()
+        return head - tail
+
+    def _write(self, position, data):
+        start = position % self.size
+        first = min(len(data), self.size - start)
+        self._view[_DATA + start:_DATA + start + first] = data[:first]
+        if first < len(data):
+            self._view[_DATA:_DATA + len(data) - first] = data[first:]
+
+    def _read(self, position, length):
+        start = position % self.size
+        first = min(length, self.size - start)
+        data = bytes(self._view[_DATA + start:_DATA + start + first])
+        if first < length:
+            data += bytes(self._view[_DATA:_DATA + length - first])
+        return data
+
+    def put(self, data):
+        """ Write frame with `data`, return False when there is no room for it. """
+        needed = _length.size + len(data)
+        if needed > self.size:
+            raise ValueError("Frame of {} bytes does not fit to ring buffer of {} bytes.".format(len(data), self.size))
+        head, tail = self._counters()
+        if needed > self.size - (head - tail):
+            return False
+        self._write(head, _length.pack(len(data)))
+        self._write(head + _length.size, data)
+        # frame is visible to the consumer after head is moved, see module docstring
+        self._head.value = head + needed
+        return True
+
+    def get(self):
+        """ Return data of the oldest frame or None when buffer is empty. """
+        head, tail = self._counters()
+        if head == tail:
+            return None
+        length = _length.unpack(self._read(tail, _length.size))[0]
+        data = self._read(tail + _length.size, length)
+        self._tail.value = tail + _length.size + length
+        return data
+
+
+def channel(size):
+    """ Return ring buffer of `size` bytes with doorbell sockets of its producer and consumer. """
+    producer_socket, consumer_socket = socket.socketpair()
+    return RingBuffer(size), producer_socket, consumer_socket
+
+
+class RingWriter:
+    """ Producer side of ring buffer used from event loop. """
+    def __init__(self, ring, doorbell, loop):
+        self._ring = ring
+        self._doorbell = doorbell
+        self._doorbell.setblocking(False)
+        self._loop = loop
+
+    def _ring_doorbell(self):
+        try:
+            self._doorbell.send(b"\0")
+        except BlockingIOError:
+            # doorbell is full of unread bytes, so the consumer wakes up anyway
+            pass
+        except OSError as e:
+            raise ConnectionError("Consumer of ring buffer is gone.") from e
+
+    @asyncio.coroutine
+    async def write(self, data):
+        """ Write frame with `data`, raises `ConnectionError` when the consumer is gone. """
+        while not self._ring.put(data):
+            self._ring_doorbell()
+            await asyncio.sleep(RETRY_DELAY, loop=self._loop)
+        self._ring_doorbell()
+
+    def close(self):
+        self._doorbell.close()
+
+
+class RingReader:
+    """ Consumer side of ring buffer used from event loop. """
+    def __init__(self, ring, doorbell, loop):
+        self._ring = ring
+        self._doorbell = doorbell
+        self._doorbell.setblocking(False)
+        self._loop = loop
+
+    @asyncio.coroutine
+    async def read(self):
+        """ Return list of all waiting frames, wait for at least one. Empty list means the producer is gone. """
+        while True:
+            frames = []
+            data = self._ring.get()
+            while data is not None:
+                frames.append(data)
+                data = self._ring.get()
+            if frames:
+                return frames
+            if not await self._loop.sock_recv(self._doorbell, 4096):
+                return frames
+
+    def close(self):
+        self._doorbell.close()
@@ -3,10 +3,15 @@
 import asyncio
 
 from functools import partial
+from . import binary_protocol, settings
+from .capture import Capture
+from .journal import Journal
+from .sharding import ShardedStockExchange
 from .stock_exchange import StockExchange
 from .utils import get_logger
 from .clients import PrivateClients, PublicClients
-from .pubsub import asyncio_queue_pubsub_factory, redis_pubsub_factory
+from .pubsub import direct_pubsub_factory, redis_pubsub_factory
+from .redis_connections import get_connections
 
 
 class StockServer:
@@ -14,36 +19,71 @@ class StockServer:
     Public and private server that handles client orders. Main class of this
     program that uses all other parts. You can run it in `multiple_servers`
     mode that uses redis publisher, subscriber and priority queue. Without
-    `multiple_servers` in memory solution is used.
+    `multiple_servers` in memory solution is used. When `binary_port` is given
+    private clients can connect there using `binary_protocol`. With `workers`
+    (`settings.matching_workers` by default) orders are matched by worker
+    processes, see `sharding`. In memory books are persisted to `journal`
+    file when it is given (see `journal`). Json messages of private clients
+    are recorded to `capture` file when it is given (see `capture`).
     """
-    def __init__(self, private_port=7001, public_port=7002, loop=None, multiple_servers=False, persist=False):
+    # Whether more processes may listen on the same ports (SO_REUSEPORT).
+    reuse_port = False
+
+    def __init__(self, private_port=7001, public_port=7002, loop=None, multiple_servers=False, persist=False,
+                 binary_port=None, workers=None, journal=None, capture=None):
         self.loop = asyncio.get_event_loop() if loop is None else loop
         self.mutliple_servers = multiple_servers
         if self.mutliple_servers:
+            self.redis_connections = get_connections(self.loop)
             self.public_subscriber, self.public_publisher = redis_pubsub_factory(self.loop)
             self.private_subscriber, self.private_publisher = redis_pubsub_factory(self.loop)
         else:
-            self.public_subscriber, self.public_publisher = asyncio_queue_pubsub_factory(self.loop)
-            self.private_subscriber, self.private_publisher = asyncio_queue_pubsub_factory(self.loop)
+            self.public_subscriber, self.public_publisher = direct_pubsub_factory(self.loop)
+            self.private_subscriber, self.private_publisher = direct_pubsub_factory(self.loop)
         self.public_clients = PublicClients(self.public_subscriber)
         self.private_clients = PrivateClients(self.private_subscriber)
         self.public_port = public_port
         self.private_port = private_port
-        self.stock_exchange = StockExchange(self.private_publisher, self.public_publisher, self.loop, multiple_servers)
+        self.binary_port = binary_port
+        self.journal_path = journal
+        self.capture_path = capture
+        self.capture = None
+        self.stock_exchange = self._create_stock_exchange(multiple_servers, workers)
         self._logger = get_logger()
         self._persist = persist
 
+    def _create_stock_exchange(self, multiple_servers, workers):
+        workers = settings.matching_workers if workers is None else workers
+        if workers:
+            return ShardedStockExchange(self.private_publisher, self.public_publisher, self.loop, multiple_servers,
+                                        workers=workers, journal=self.journal_path)
+        journal = None if self.journal_path is None else Journal(self.journal_path, self.loop)
+        return StockExchange(self.private_publisher, self.public_publisher, self.loop, multiple_servers,
+                             journal=journal)
+
     def initialize_tasks(self):
         """
         Initialize all tasks that should be done (servers, consumers for client communication).
         Connect to redis potentially.
          """
+        if self.capture_path is not None:
+            self.capture = Capture(self.capture_path)
         public_protocol = partial(PublicServerProtocol, self.public_clients, self.loop)
-        private_protocol = partial(PrivateServerProtocol, self.private_clients, self.stock_exchange, self.loop)
-        public_server_coro = self.loop.create_server(public_protocol, port=self.public_port)
-        private_server_coro = self.loop.create_server(private_protocol, port=self.private_port)
+        private_protocol = partial(PrivateServerProtocol, self.private_clients, self.stock_exchange, self.loop,
+                                   self.capture)
+        public_server_coro = self.loop.create_server(public_protocol, port=self.public_port,
+                                                     reuse_port=self.reuse_port)
+        private_server_coro = self.loop.create_server(private_protocol, port=self.private_port,
+                                                      reuse_port=self.reuse_port)
         self.public_server = self.loop.run_until_complete(public_server_coro)
         self.private_server = self.loop.run_until_complete(private_server_coro)
+        if self.binary_port is not None:
+            binary_private_protocol = partial(BinaryPrivateServerProtocol, self.private_clients, self.stock_exchange,
+                                              self.loop)
+            binary_server_coro = self.loop.create_server(binary_private_protocol, port=self.binary_port,
+                                                         reuse_port=self.reuse_port)
+            self.binary_server = self.loop.run_until_complete(binary_server_coro)
+            self._logger.info("Serving binary private on %s.", self.binary_server.sockets[0].getsockname())
         self.loop.run_until_complete(self.public_subscriber.connect())
         self.loop.run_until_complete(self.public_publisher.connect())
         self.loop.run_until_complete(self.private_subscriber.connect())
@@ -58,21 +98,39 @@ class StockServer:
         """Clean up all running tasks, shutdown server."""
         self.public_server.close()
         self.private_server.close()
+        if self.binary_port is not None:
+            self.binary_server.close()
 
         if self.mutliple_servers and not self._persist:
-            self.loop.run_until_complete(self.public_publisher._redis.flushdb())
+            self.loop.run_until_complete(self._flushdb())
         self.public_subscriber.close()
         self.public_publisher.close()
         self.private_subscriber.close()
         self.private_publisher.close()
         self.public_clients_consume.cancel()
         self.private_clients_consume.cancel()
+        workers = set(self.private_clients.workers)
+        for worker in workers:
+            worker.cancel()
+        if workers:
+            self.loop.run_until_complete(asyncio.wait(workers, loop=self.loop))
         self.stock_exchange.close()
+        if self.capture is not None:
+            self.capture.close()
+        if self.mutliple_servers:
+            self.redis_connections.release()
         self.loop.run_until_complete(self.public_server.wait_closed())
         self.loop.run_until_complete(self.private_server.wait_closed())
+        if self.binary_port is not None:
+            self.loop.run_until_complete(self.binary_server.wait_closed())
         self.loop.close()
         self._logger.info("Server shutdown.")
 
+    @asyncio.coroutine
+    async def _flushdb(self):
+        async with self.redis_connections.command() as redis:
+            await redis.flushdb()
+
     def run(self):
         """Run server and serve requests until `KeyboardInterrupt` is raised."""
         self.initialize_tasks()
@@ -96,7 +154,7 @@ class PublicServerProtocol(asyncio.Protocol):
 
     def connection_made(self, transport):
         self.transport = transport
-        self.peername = transport.get_extra_info("peername")
+        self.peername = self._get_peername(transport)
         self._logger.debug("Connection made %s", self.peername)
         self._clients.add(self)
 
@@ -104,17 +162,127 @@ class PublicServerProtocol(asyncio.Protocol):
         self._logger.debug("Connection lost %s", self.peername)
         self._clients.remove(self)
 
+    def pause_writing(self):
+        self._clients.pause(self)
+
+    def resume_writing(self):
+        self._clients.resume(self)
+
+    @staticmethod
+    def _get_peername(transport):
+        return transport.get_extra_info("peername")
+
 
 class PrivateServerProtocol(PublicServerProtocol):
     """
     Protocal for private server that differs only in that it handles incoming
-    requests too.
+    requests too. Requests of one connection are queued and processed by single
+    worker so they are handled in order they came, also after the connection
+    is lost. Workers are cancelled only on shutdown of the server. When too
+    many messages are waiting, reading from the connection is paused until
+    worker catches up.
+    Messages are recorded to `capture` when it is given.
     """
-    def __init__(self, clients: PrivateClients, stock_exchange: StockExchange, loop):
+    def __init__(self, clients: PrivateClients, stock_exchange: StockExchange, loop, capture: Capture=None):
         super().__init__(clients, loop)
         self._stock_exchange = stock_exchange
+        self._capture = capture
+        self._buffer = bytearray()
+        self._queue = asyncio.Queue(loop=loop)
+        self._pending = 0
+        self._paused = False
+        self._high_water = settings.private_queue["high_water"]
+        self._low_water = settings.private_queue["low_water"]
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        if self._capture is not None:
+            self._connection_id = self._capture.connection_id()
+        self._worker = self._loop.create_task(self._process_messages())
+        self._clients.workers.add(self._worker)
+        self._worker.add_done_callback(self._clients.workers.discard)
+
+    def connection_lost(self, exc):
+        """ Messages received so far are still processed, then worker tells stock exchange and stops. """
+        super().connection_lost(exc)
+        self._queue.put_nowait(None)
 
     def data_received(self, data):
-        message = data.decode()
-        self._logger.debug("Received %r from %r" % (message, self.peername))
-        asyncio.ensure_future(self._stock_exchange.handle_order(message, self.peername), loop=self._loop)
+        """
+        Messages are separated by newline. All complete messages are passed to
+        worker as one batch, incomplete rest is kept in buffer until next data
+        arrives. Connection is closed when the rest is longer than
+        `settings.max_message_length`.
+        """
+        self._buffer.extend(data)
+        end = self._buffer.rfind(b"\n")
+        messages = []
+        if end != -1:
+            messages = [message for message in bytes(self._buffer[:end]).split(b"\n") if message.strip()]
+            del self._buffer[:end + 1]
+        if len(self._buffer) > settings.max_message_length:
+            self._logger.warning("Message of %r longer than %d bytes, closing connection", self.peername,
+                                 settings.max_message_length)
+            self._buffer.clear()
+            self.transport.close()
+        if messages:
+            if self._capture is not None:
+                self._capture.record(self._connection_id, messages)
+            self._enqueue(messages)
+
+    def _enqueue(self, messages):
+        self._logger.debug("Received %d messages from %r", len(messages), self.peername)
+        self._queue.put_nowait(messages)
+        self._pending += len(messages)
+        if not self._paused and self._pending >= self._high_water:
+            self._logger.debug("Pause reading from %r, %d messages pending", self.peername, self._pending)
+            self.transport.pause_reading()
+            self._paused = True
+
+    def _handle_messages(self, messages):
+        return self._stock_exchange.handle_orders(messages, self.peername)
+
+    @asyncio.coroutine
+    async def _process_messages(self):
+        # reports of the first message must not be published before they can be received
+        await self._clients.wait_ready(self)
+        while True:
+            messages = await self._queue.get()
+            if messages is None:
+                break
+            try:
+                await self._handle_messages(messages)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._logger.exception("Failed to handle messages from %r", self.peername)
+            self._pending -= len(messages)
+            if self._paused and self._pending <= self._low_water:
+                self._logger.debug("Resume reading from %r", self.peername)
+                self.transport.resume_reading()
+                self._paused = False
+        self._stock_exchange.disconnect(self.peername)
+
+
+class BinaryPrivateServerProtocol(PrivateServerProtocol):
+    """
+    Private protocol that accepts fixed size records of `binary_protocol`
+    instead of json messages and sends execution reports in the same way.
+    """
+    @staticmethod
+    def _get_peername(transport):
+        return transport.get_extra_info("peername") + (binary_protocol.PARTICIPANT_TAG,)
+
+    def data_received(self, data):
+        self._buffer.extend(data)
+        records, consumed = binary_protocol.decode(self._buffer, self.peername)
+        del self._buffer[:consumed]
+        if records:
+            self._enqueue(records)
+        if self._buffer and not binary_protocol.is_valid_start(self._buffer):
+            self._logger.warning("Unknown message type %d from %r, closing connection", self._buffer[0], self.peername)
+            self._buffer.clear()
+            self.transport.close()
+
+    def _handle_messages(self, records):
+        return self._stock_exchange.handle_records(records, self.peername)
@@ -17,6 +17,80 @@ redis = {
     "port": 6379,
 }
 
+# Pool of redis command connections shared by all redis backends of a server.
+redis_pool = {
+    "minsize": 1,
+    "maxsize": 10,
+}
+
+# Changes of order book levels are published once per tick (in seconds), so
+# multiple changes of one level are conflated into one message. With 0 they are
+# published after each message.
+order_book_tick = 0.05
+
+# Matching in multiple servers mode, "script" adds and matches every order by
+# one Lua script in redis, "client" matches orders by commands of the server.
+redis_matching = "script"
+
+# Validator of incoming messages, "compiled" (wood.validation) or "voluptuous".
+message_validator = "compiled"
+
+# Number of messages waiting for processing on one private connection when
+# reading from the connection is paused and resumed again.
+private_queue = {
+    "high_water": 1024,
+    "low_water": 256,
+}
+
+# Maximum length in bytes of one private message, connection that sends
+# longer line without newline is closed.
+max_message_length = 64 * 1024
+
+# Public clients whose transport buffers more than high_water bytes are slow
+# consumers handled by policy "snapshot", "skip" or "disconnect" (see
+# wood.fanout). Writing to them is resumed under low_water bytes.
+slow_consumer = {
+    "high_water": 64 * 1024,
+    "low_water": 16 * 1024,
+    "policy": "snapshot",
+}
+
+# Symbols listed besides the default one, which is used by orders without
+# symbol and by binary protocol. Every symbol has its own limit order book.
+symbols = ()
+
+# Number of worker processes that match orders (see wood.sharding), symbols
+# are partitioned across them by hash. With 0 all books are matched by the
+# server process.
+matching_workers = 0
+
+# Number of gateway processes sharing server ports that parse and validate
+# messages for one matching engine process (see wood.gateway), with 0 the
+# server process does everything.
+gateways = 0
+
+# Shared memory ring buffers between gateways and the matching engine, size
+# in bytes of one direction of one gateway.
+ring_buffer = {
+    "size": 4 * 1024 * 1024,
+}
+
+# Journal of in memory books (see wood.journal). With durability "sync"
+# reports are sent after their events are fsynced (concurrent events share
+# one fsync), "batch" writes and fsyncs the journal once per commit_interval
+# seconds and "none" writes it once per commit_interval without fsync.
+journal = {
+    "durability": "batch",
+    "commit_interval": 0.005,
+}
+
+# Snapshots of journaled books (see wood.snapshot) are written every interval
+# seconds next to the journal, restart loads the latest one and replays only
+# the journal after it. With 0 no snapshots are written.
+snapshot = {
+    "interval": 60.0,
+}
+
 try:
     from .settings_local import *
 except ImportError:
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Matching of orders in worker processes. Symbols are partitioned across
+`settings.matching_workers` processes by stable hash of the symbol
+(`shard_of`), every worker runs its own event loop with `StockExchange` for
+books of its symbols. `ShardedStockExchange` is a gateway in the server
+process: it validates incoming messages and routes them to the worker of
+their symbol, reports of workers are published by publishers of the server.
+
+Server and worker talk over socket pair by frames of 4 bytes of length
+followed by pickled tuple:
+
+    ("orders", participant, [order_dict, ...])    server -> worker
+    ("records", participant, [record, ...])       server -> worker
+    ("errors", participant, [error_report, ...])  server -> worker
+    ("private", [(channel, message), ...])        worker -> server
+    ("public", [(channel, message), ...])         worker -> server
+
+Messages of one symbol are matched in order they came, orders of one
+participant for different symbols may be matched in parallel. Error reports
+of invalid messages are sent to the worker of the preceding valid message of
+the batch (default symbol if there is none), so the worker publishes them in
+order with reports of orders.
+"""
+
+import asyncio
+import multiprocessing
+import pickle
+import signal
+import socket
+import struct
+import zlib
+
+from . import settings
+from .journal import Journal
+from .pubsub.base import BasePublisher
+from .stock_exchange import BaseStockExchange, StockExchange
+
+_header = struct.Struct("<I")
+# Workers are spawned so they do not inherit listening sockets of the server
+# nor sockets of other workers, closing the socket always stops the worker.
+spawn_context = multiprocessing.get_context("spawn")
+
+
+def shard_of(symbol, shards):
+    """ Return index of worker matching orders of `symbol`, the same in all processes. """
+    return zlib.crc32((symbol or "").encode()) % shards
+
+
+def partition(symbols, shards):
+    """ Return list of symbols for every worker. Default symbol (None) is left out. """
+    partitions = [[] for _ in range(shards)]
+    for symbol in sorted(symbols):
+        partitions[shard_of(symbol, shards)].append(symbol)
+    return partitions
+
+
+def write_frame(writer, obj):
+    data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    writer.write(_header.pack(len(data)) + data)
+
+
+@asyncio.coroutine
+async def read_frame(reader):
+    """ Return next unpickled frame or None at the end of stream. """
+    try:
+        header = await reader.readexactly(_header.size)
+        return pickle.loads(await reader.readexactly(_header.unpack(header)[0]))
+    except asyncio.IncompleteReadError:
+        return None
+
+
+class WorkerPublisher(BasePublisher):
+    """ Publisher of worker that sends reports to the server as `kind` frames. """
+    def __init__(self, loop, writer, kind):
+        super().__init__(loop)
+        self._writer = writer
+        self._kind = kind
+
+    @asyncio.coroutine
+    async def connect(self):
+        pass
+
+    @asyncio.coroutine
+    async def publish(self, channel, message):
+        await self.publish_many([(channel, message)])
+
+    @asyncio.coroutine
+    async def publish_many(self, messages):
+        write_frame(self._writer, (self._kind, list(messages)))
+        await self._writer.drain()
+
+    def close(self):
+        pass
+
+
+def append_item(frames, kind, participant, item):
+    """ Append `item` to the last of `frames` if it is of the same `kind`, otherwise start new frame. """
+    if frames and frames[-1][0] == kind:
+        frames[-1][2].append(item)
+    else:
+        frames.append((kind, participant, [item]))
+
+
+@asyncio.coroutine
+async def handle_frame(stock_exchange, frame):
+    """ Pass "orders", "records" or "errors" `frame` sent by server to `stock_exchange`. """
+    kind, participant, items = frame
+    if kind == "orders":
+        for order_dict in items:
+            await stock_exchange.handle_order_dict(order_dict, participant)
+    elif kind == "records":
+        await stock_exchange.handle_records(items, participant)
+    elif kind == "errors":
+        await stock_exchange.handle_errors(items, participant)
+
+
+@asyncio.coroutine
+async def _serve(reader, stock_exchange):
+    while True:
+        frame = await read_frame(reader)
+        if frame is None:
+            return
+        await handle_frame(stock_exchange, frame)
+
+
+def run_worker(sock, symbols, multiple_servers, journal_path=None):
+    """ Entry point of worker process, it runs until the server closes its end of `sock`. """
+    # server stops workers by closing the socket
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    reader, writer = loop.run_until_complete(asyncio.open_connection(sock=sock, loop=loop))
+    journal = None if journal_path is None else Journal(journal_path, loop)
+    stock_exchange = StockExchange(WorkerPublisher(loop, writer, "private"), WorkerPublisher(loop, writer, "public"),
+                                   loop, multiple_servers, symbols=symbols, journal=journal)
+    try:
+        loop.run_until_complete(_serve(reader, stock_exchange))
+    finally:
+        stock_exchange.close()
+        writer.close()
+        loop.close()
+
+
+class ShardedStockExchange(BaseStockExchange):
+    """
+    Stock exchange of the server that validates messages and routes them to
+    `workers` processes matching orders of their symbols. Orders without
+    symbol and binary records go to the worker of the default symbol. With
+    `journal` path every worker keeps its journal in `<journal>.<worker>`.
+    """
+    def __init__(self, private_publisher, public_publisher, loop, multiple_servers=False, validator=None,
+                 workers=None, journal=None):
+        super().__init__(private_publisher, public_publisher, loop, validator)
+        self.workers = settings.matching_workers if workers is None else workers
+        self._processes = []
+        self._writers = []
+        self._readers = []
+        for shard, symbols in enumerate(partition(self.symbols, self.workers)):
+            server_socket, worker_socket = socket.socketpair()
+            journal_path = None if journal is None else "{}.{}".format(journal, shard)
+            process = spawn_context.Process(target=run_worker,
+                                            args=(worker_socket, symbols, multiple_servers, journal_path),
+                                            daemon=True)
+            process.start()
+            worker_socket.close()
+            reader, writer = loop.run_until_complete(asyncio.open_connection(sock=server_socket, loop=loop))
+            self._processes.append(process)
+            self._writers.append(writer)
+            self._readers.append(loop.create_task(self._forward_reports(reader)))
+            self._logger.info("Started matching worker %d for %d symbols", process.pid, len(symbols))
+
+    def close(self):
+        for reader in self._readers:
+            reader.cancel()
+        # end of stream stops the worker, close of transport would wait for the loop
+        for writer in self._writers:
+            writer.write_eof()
+        for process in self._processes:
+            process.join(5)
+            if process.is_alive():
+                self._logger.warning("Terminate matching worker %d", process.pid)
+                process.terminate()
+                process.join()
+        for writer in self._writers:
+            writer.close()
+
+    @asyncio.coroutine
+    async def _forward_reports(self, reader):
+        while True:
+            frame = await read_frame(reader)
+            if frame is None:
+                return
+            kind, messages = frame
+            publisher = self._private_publisher if kind == "private" else self._public_publisher
+            await publisher.publish_many(messages)
+
+    @asyncio.coroutine
+    async def _send(self, shard, frame):
+        writer = self._writers[shard]
+        write_frame(writer, frame)
+        await writer.drain()
+
+    @asyncio.coroutine
+    async def handle_orders(self, messages: list, participant: tuple):
+        """
+        Validates batch of messages and sends valid ones and error reports to
+        workers, consecutive items of one kind for the same worker in one frame.
+        """
+        batches = {}
+        shard = shard_of(None, self.workers)
+        for message in messages:
+            order_dict, error_report = self._validate(message, participant)
+            if error_report is None:
+                shard = shard_of(order_dict.get("symbol"), self.workers)
+                append_item(batches.setdefault(shard, []), "orders", participant, order_dict)
+            else:
+                append_item(batches.setdefault(shard, []), "errors", participant, error_report)
+        for shard, frames in batches.items():
+            for frame in frames:
+                await self._send(shard, frame)
+
+    @asyncio.coroutine
+    async def handle_order_dict(self, order_dict: dict, participant: tuple):
+        await self._send(shard_of(order_dict.get("symbol"), self.workers), ("orders", participant, [order_dict]))
+
+    @asyncio.coroutine
+    async def handle_records(self, records: list, participant: tuple):
+        await self._send(shard_of(None, self.workers), ("records", participant, records))
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Binary snapshots of in memory limit order books, so restart does not replay
+the whole journal. Snapshot is header
+
+    8s magic, B version, Q journal position, I number of orders
+
+followed by order records of `journal` (one per resting order) of every
+book, bids and then asks in priority order. Position is number of journal
+bytes whose events are in the snapshot, only records after it are replayed.
+
+Snapshot is written from a copy of the books (orders are immutable tuples)
+by a background thread to temporary file which then replaces the previous
+snapshot. It is loaded through `mmap` and every queue is filled by
+`LadderPriorityQueue.load` in one step.
+"""
+
+import mmap
+import os
+import struct
+from collections import OrderedDict
+
+from .journal import ORDER, Journal, decode_event, decode_records
+from .orders import BidOrder, MarketBidOrder
+
+MAGIC = b"WOODSNAP"
+VERSION = 1
+
+_header = struct.Struct("<8sBQI")
+
+
+def snapshot_path(journal_path):
+    return journal_path + ".snapshot"
+
+
+def copy_books(limit_order_books):
+    """ Return {symbol: list of orders} with bids and then asks of every book in priority order. """
+    return {symbol: list(book.bid_queue) + list(book.ask_queue) for symbol, book in limit_order_books.items()}
+
+
+def write_snapshot(path, position, books):
+    """ Write `books` (see `copy_books`) covering `position` bytes of journal atomically to `path`. """
+    temporary_path = path + ".tmp"
+    count = sum(len(orders) for orders in books.values())
+    with open(temporary_path, "wb") as f:
+        f.write(_header.pack(MAGIC, VERSION, position, count))
+        for symbol, orders in books.items():
+            f.write(b"".join(Journal.order_record(symbol, order) for order in orders))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_path, path)
+
+
+def read_snapshot(path):
+    """
+    Return journal position and {symbol: (bids, asks)} of orders from snapshot
+    at `path`, or None if there is no valid snapshot.
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with f:
+        if os.fstat(f.fileno()).st_size < _header.size:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data, memoryview(data) as view:
+            magic, version, position, count = _header.unpack_from(view)
+            if magic != MAGIC or version != VERSION:
+                return None
+            # records are decoded from the mapped file without copying it
+            records, _ = decode_records(view[_header.size:])
+    if len(records) != count:
+        return None
+    books = OrderedDict()
+    for kind, symbol, record in records:
+        if kind != ORDER:
+            return None
+        order = decode_event(kind, record)
+        bids, asks = books.setdefault(symbol, ([], []))
+        (bids if isinstance(order, (BidOrder, MarketBidOrder)) else asks).append(order)
+    return position, books
@@ -1,13 +1,18 @@
 # -*- coding: utf-8 -*-
+import abc
 import asyncio
+import logging
 import time
-import json
-from voluptuous import Schema, Any, Invalid, All, Range
+from voluptuous import Schema, Any, Invalid, All, Optional, Range
 
-from .priority_queue import MemoryPriorityQueue, RedisPriorityQueue
-from .limit_order_book import LimitOrderBook
+from . import binary_protocol, codec, settings, validation
+from .priority_queue import RedisPriorityQueue
+from .journal import CANCEL, ORDER, decode_event
+from .limit_order_book import LimitOrderBook, RedisLimitOrderBook, SyncLimitOrderBook
+from .snapshot import copy_books, read_snapshot, snapshot_path, write_snapshot
 from wood.orders import BidOrder, AskOrder, MarketBidOrder, MarketAskOrder
 from .utils import get_logger
+from .validation import InvalidMessage
 
 
 message_schema = Schema(Any(
@@ -17,35 +22,291 @@ message_schema = Schema(Any(
         "side": Any("BUY", "SELL"),
         "price": All(int, Range(min=0)),
         "quantity": All(int, Range(min=0)),
+        Optional("symbol"): str,
     },
     {
         "message": "cancelOrder",
         "orderId": int,
+        Optional("symbol"): str,
     },
     {
         "message": "marketOrder",
         "orderId": int,
         "side": Any("BUY", "SELL"),
         "quantity": All(int, Range(min=0)),
+        Optional("symbol"): str,
     },
     required=True))
 
+validators = {
+    "compiled": validation.validate_message,
+    "voluptuous": message_schema,
+}
 
-class StockExchange:
+
+class BaseStockExchange(abc.ABC):
     """
-    This class handles all interaction between `StockServer` and `LimitOrderBook`.
-    It validates incomming messages, adds new orders and performs trades. It also
-    reports results of such actions back to `StockServer` using publishers.
+    Common part of stock exchanges: validation of incoming messages and
+    reporting of errors back to participants. Valid order dicts are passed to
+    `handle_order_dict` of subclass. Orders without `symbol` are for the
+    default symbol, other symbols have to be listed in `settings.symbols`.
     """
-    def __init__(self, private_publisher, public_publisher, loop, multiple_servers=False):
+    def __init__(self, private_publisher, public_publisher, loop, validator=None):
         self._private_publisher = private_publisher
         self._public_publisher = public_publisher
-        priority_queue = RedisPriorityQueue if multiple_servers else MemoryPriorityQueue
-        self.limit_order_book = LimitOrderBook(loop, priority_queue)
+        self._validator = validators[settings.message_validator if validator is None else validator]
+        self._loop = loop
+        self.symbols = frozenset(settings.symbols)
         self._logger = get_logger()
 
     def close(self):
-        self.limit_order_book.close()
+        pass
+
+    def disconnect(self, participant):
+        """ Called when connection of `participant` is lost. """
+        pass
+
+    def is_listed(self, symbol):
+        """ Return True if orders of `symbol` are accepted. """
+        return symbol is None or symbol in self.symbols
+
+    @staticmethod
+    def _get_error_report(error, participant=None, order_id=0):
+        if binary_protocol.is_binary(participant):
+            return binary_protocol.encode_execution_report(order_id, "REJECTED")
+        result = {
+            "error": error
+        }
+        return codec.dumps(result)
+
+    @asyncio.coroutine
+    async def handle_orders(self, messages: list, participant: tuple):
+        """
+        Handles batch of incoming messages from one participant in order they came.
+        """
+        for message in messages:
+            await self.handle_order(message, participant)
+
+    @asyncio.coroutine
+    async def handle_order(self, message: [str, bytes], participant: tuple):
+        """
+        Handles incoming order, validate message, create new order or cancel existing.
+        """
+        order_dict = await self.validate_message(message, participant)
+        if order_dict is None:
+            return
+        await self.handle_order_dict(order_dict, participant)
+
+    @abc.abstractmethod
+    @asyncio.coroutine
+    async def handle_order_dict(self, order_dict: dict, participant: tuple):
+        """ Handles valid order message of listed symbol decoded to dict. """
+        pass
+
+    @abc.abstractmethod
+    @asyncio.coroutine
+    async def handle_records(self, records: list, participant: tuple):
+        """
+        Handles batch of records decoded by `binary_protocol` from one participant.
+        """
+        pass
+
+    @asyncio.coroutine
+    async def handle_errors(self, error_reports: list, participant: tuple):
+        """
+        Publishes error reports of messages rejected by other process, so they
+        are published in order with reports of orders of the participant.
+        """
+        await self._private_publisher.publish_many([(participant, error_report) for error_report in error_reports])
+
+    @staticmethod
+    def _message_text(message):
+        if isinstance(message, (bytes, bytearray)):
+            return message.decode(errors="replace")
+        return message
+
+    def _validate(self, message: [str, bytes], participant: tuple):
+        """ Return order dict and None for valid message, None and error report otherwise. """
+        try:
+            order_dict = codec.loads(message)
+        except ValueError:
+            return None, self._get_error_report("Message '{}' is not valid json.".format(self._message_text(message)))
+        try:
+            self._validator(order_dict)
+        except (Invalid, InvalidMessage) as e:
+            return None, self._get_error_report("Message '{}' is not valid order message because {}.".format(
+                self._message_text(message), e))
+        symbol = order_dict.get("symbol")
+        if not self.is_listed(symbol):
+            return None, self._get_error_report("Symbol {} is not listed.".format(symbol), participant,
+                                                order_dict["orderId"])
+        return order_dict, None
+
+    @asyncio.coroutine
+    async def validate_message(self, message: [str, bytes], participant: tuple):
+        """
+        Validates incoming message and possibly sends clients info about errors
+        """
+        order_dict, error_report = self._validate(message, participant)
+        if error_report is not None:
+            await self._private_publisher.publish(participant, error_report)
+        return order_dict
+
+
+class StockExchange(BaseStockExchange):
+    """
+    This class handles all interaction between `StockServer` and `LimitOrderBook`.
+    It validates incomming messages, adds new orders and performs trades. It also
+    reports results of such actions back to `StockServer` using publishers.
+    Without `multiple_servers` the synchronous `SyncLimitOrderBook` is used,
+    otherwise `RedisLimitOrderBook` (or `LimitOrderBook` with redis priority
+    queues when `settings.redis_matching` is "client"). Aggregated
+    quantities of changed price levels are published once per
+    `order_book_tick`.
+
+    There is one limit order book for every symbol in `symbols` (all listed
+    symbols by default) and one for the default symbol (key None in
+    `limit_order_books`).
+
+    In memory books can be persisted by `journal` (see `wood.journal`), they
+    are rebuilt from it on start and every accepted order, cancel and trade is
+    appended to it before reports are published. Every
+    `settings.snapshot["interval"]` seconds snapshot of the books is written
+    (see `wood.snapshot`), so restart replays only the rest of the journal.
+
+    Time of orders and trades is given by `clock` (`time.time` by default).
+    """
+    def __init__(self, private_publisher, public_publisher, loop, multiple_servers=False, validator=None,
+                 symbols=None, journal=None, clock=None):
+        super().__init__(private_publisher, public_publisher, loop, validator)
+        if symbols is not None:
+            self.symbols = frozenset(symbols)
+        self.synchronous = not multiple_servers
+        self.clock = time.time if clock is None else clock
+        self.limit_order_books = {symbol: self._create_limit_order_book(loop, symbol)
+                                  for symbol in (None,) + tuple(sorted(self.symbols))}
+        self.limit_order_book = self.limit_order_books[None]
+        self.order_book_tick = settings.order_book_tick
+        self._publish_levels_handle = None
+        self.journal = journal
+        self.snapshot_interval = settings.snapshot["interval"]
+        self._snapshot_handle = None
+        self._snapshot_task = None
+        self._snapshot_position = None
+        if journal is not None:
+            if not self.synchronous:
+                raise ValueError("Journal is available only for in memory limit order books.")
+            self.replay_journal(self.load_snapshot())
+            journal.open()
+            if self.snapshot_interval:
+                self._schedule_snapshot()
+
+    def load_snapshot(self):
+        """ Fill limit order books from the latest snapshot, return journal position it covers. """
+        snapshot = read_snapshot(snapshot_path(self.journal.path))
+        if snapshot is None:
+            return 0
+        position, books = snapshot
+        if position > self.journal.length():
+            self._logger.warning("Ignore snapshot of journal %s newer than the journal", self.journal.path)
+            return 0
+        for symbol, (bids, asks) in books.items():
+            limit_order_book = self.limit_order_books.get(symbol)
+            if limit_order_book is None:
+                self._logger.warning("Skip snapshot of unlisted symbol %s", symbol)
+                continue
+            limit_order_book.bid_queue.load(bids)
+            limit_order_book.ask_queue.load(asks)
+        self._snapshot_position = position
+        self._logger.info("Loaded snapshot of journal %s at %d bytes", self.journal.path, position)
+        return position
+
+    def replay_journal(self, offset=0):
+        """
+        Rebuild limit order books from journal starting at byte `offset`,
+        return number of replayed orders and cancels.
+        """
+        replayed = 0
+        # books log every order and trade, which would slow the replay down
+        level = self._logger.level
+        self._logger.setLevel(logging.WARNING)
+        try:
+            for kind, symbol, data in self.journal.read(offset):
+                limit_order_book = self.limit_order_books.get(symbol)
+                if limit_order_book is None or kind not in (ORDER, CANCEL):
+                    continue
+                try:
+                    event = decode_event(kind, data)
+                    if kind == ORDER:
+                        limit_order_book.add(event)
+                        limit_order_book.match()
+                    else:
+                        limit_order_book.cancel(event)
+                except ValueError:
+                    self._logger.warning("Skip invalid journal record %r", data)
+                    continue
+                replayed += 1
+        finally:
+            self._logger.setLevel(level)
+        for limit_order_book in self.limit_order_books.values():
+            limit_order_book.pop_changed_levels()
+        self._logger.info("Replayed %d events from journal %s", replayed, self.journal.path)
+        return replayed
+
+    @asyncio.coroutine
+    async def snapshot(self):
+        """
+        Write snapshot of all books. Books are copied at once, the journal is
+        written up to the copy and the snapshot is encoded and written by
+        executor, so matching goes on meanwhile.
+        """
+        position = self.journal.position
+        books = copy_books(self.limit_order_books)
+        await self.journal.commit(wait=True)
+        await self._loop.run_in_executor(None, write_snapshot, snapshot_path(self.journal.path), position, books)
+        self._snapshot_position = position
+
+    def _schedule_snapshot(self):
+        self._snapshot_handle = self._loop.call_later(self.snapshot_interval, self._snapshot_later)
+
+    def _snapshot_later(self):
+        self._snapshot_handle = None
+        if self.journal.position == self._snapshot_position:
+            self._schedule_snapshot()
+            return
+        self._snapshot_task = asyncio.ensure_future(self.snapshot(), loop=self._loop)
+        self._snapshot_task.add_done_callback(self._snapshot_done)
+
+    def _snapshot_done(self, task):
+        self._snapshot_task = None
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            self._logger.error("Failed to write snapshot of journal %s", self.journal.path,
+                               exc_info=task.exception())
+        self._schedule_snapshot()
+
+    def _create_limit_order_book(self, loop, symbol):
+        if self.synchronous:
+            limit_order_book = SyncLimitOrderBook(loop, symbol)
+        elif settings.redis_matching == "script":
+            limit_order_book = RedisLimitOrderBook(loop, symbol)
+        else:
+            limit_order_book = LimitOrderBook(loop, RedisPriorityQueue, symbol)
+        limit_order_book.clock = self.clock
+        return limit_order_book
+
+    def close(self):
+        if self._publish_levels_handle is not None:
+            self._publish_levels_handle.cancel()
+        if self._snapshot_handle is not None:
+            self._snapshot_handle.cancel()
+        if self._snapshot_task is not None:
+            self._snapshot_task.cancel()
+        for limit_order_book in self.limit_order_books.values():
+            limit_order_book.close()
+        if self.journal is not None:
+            self.journal.close()
 
     def create_order(self, order_dict, participant):
         order_types = {
@@ -60,115 +321,156 @@ class StockExchange:
         }
         Order = order_types[order_dict["side"]][order_dict["message"]]
         price = -1 if order_dict["message"] == "marketOrder" else order_dict["price"]
-        return Order(time.time(),
+        return Order(self.clock(),
                      order_dict["orderId"],
                      participant,
                      price,
                      order_dict["quantity"])
 
     @staticmethod
-    def _get_execution_report(order_id, report, **kwargs):
+    def _get_execution_report(order_id, report, participant=None, **kwargs):
+        if binary_protocol.is_binary(participant):
+            return binary_protocol.encode_execution_report(order_id, report, **kwargs)
+        if not kwargs:
+            return codec.execution_report(order_id, report)
         result = {
             "message": "executionReport",
             "orderId": order_id,
             "report": report
         }
         result.update(kwargs)
-        return json.dumps(result)
-
-    def _get_fill_report(self, trade, order):
-        return self._get_execution_report(order.order_id, "FILL", price=trade.price, quantity=trade.quantity)
+        return codec.dumps(result)
 
     @staticmethod
-    def _get_trade_report(trade):
-        result = {
-            "type": "trade",
-            "time": trade.time,
-            "price": trade.price,
-            "quantity": trade.quantity,
-        }
-        return json.dumps(result)
+    def _get_fill_report(trade, order):
+        if binary_protocol.is_binary(order.participant):
+            return binary_protocol.encode_execution_report(order.order_id, "FILL", trade.price, trade.quantity)
+        return codec.fill_report(order.order_id, trade.price, trade.quantity)
 
     @staticmethod
-    def _get_order_book_report(side, price, quantity):
-        result = {
-            "type": "orderbook",
-            "side": side,
-            "price": price,
-            "quantity": quantity
-        }
-        return json.dumps(result)
+    def _get_trade_report(trade, symbol=None):
+        return codec.trade_report(trade.time, trade.price, trade.quantity, symbol)
 
     @staticmethod
-    def _get_error_report(error):
-        result = {
-            "error": error
-        }
-        return json.dumps(result)
+    def _get_order_book_report(side, price, quantity, symbol=None):
+        return codec.order_book_report(side, price, quantity, symbol)
 
     @asyncio.coroutine
-    async def handle_order(self, message: str, participant: tuple):
+    async def handle_order_dict(self, order_dict: dict, participant: tuple):
         """
-        Handles incoming order, validate message, create new order or cancel existing.
+        Create new order or cancel existing one in limit order book of its symbol.
         """
-        order_dict = await self.validate_message(message, participant)
-        if order_dict is None:
-            return
         if order_dict["message"] in ("createOrder", "marketOrder"):
             await self._handle_create_order(order_dict, participant)
         elif order_dict["message"] == "cancelOrder":
             await self._handle_cancel_order(order_dict, participant)
 
+    @asyncio.coroutine
+    async def handle_records(self, records: list, participant: tuple, symbol=None):
+        """
+        Handles batch of records decoded by `binary_protocol` from one participant.
+        """
+        for record in records:
+            if isinstance(record, binary_protocol.Cancel):
+                await self._cancel_order(record.order_id, participant, symbol)
+            elif isinstance(record, binary_protocol.Rejected):
+                await self._private_publisher.publish(participant, self._get_error_report(
+                    record.reason, participant, record.order_id))
+            else:
+                await self._add_order(record, symbol)
+
     @asyncio.coroutine
     async def _handle_create_order(self, order_dict: dict, participant: tuple):
         """
         Create new order, return execution report and try to match those orders in trades.
         """
-        order = self.create_order(order_dict, participant)
+        await self._add_order(self.create_order(order_dict, participant), order_dict.get("symbol"))
+
+    @asyncio.coroutine
+    async def _add_order(self, order, symbol=None):
+        participant = order.participant
+        limit_order_book = self.limit_order_books[symbol]
         try:
-            await self.limit_order_book.add(order)
+            record = None if self.journal is None else self.journal.order_record(symbol, order)
+            if self.synchronous:
+                limit_order_book.add(order)
+                trades = limit_order_book.match()
+            else:
+                trades = await limit_order_book.add_and_match(order)
         except ValueError as e:
-            await self._private_publisher.publish(participant, self._get_error_report(str(e)))
+            await self._private_publisher.publish(participant, self._get_error_report(str(e), participant,
+                                                                                      order.order_id))
             return
-        new_report = self._get_execution_report(order_dict["orderId"], "NEW")
-        await self._private_publisher.publish(participant, new_report)
-        await self._public_publisher.publish("public", self._get_order_book_report(order.side, order.price, order.quantity))
-        trades = await self.limit_order_book.check_trades()
+        if self.journal is not None:
+            self.journal.append(record)
+            for trade in trades:
+                self.journal.append_trade(symbol, trade)
+            await self.journal.commit()
+        private_reports = [(participant, self._get_execution_report(order.order_id, "NEW", participant))]
+        public_reports = []
         for trade in trades:
-            bid_fill_report = self._get_fill_report(trade, trade.bid_order)
-            await self._private_publisher.publish(trade.bid_order.participant, bid_fill_report)
-            ask_fill_report = self._get_fill_report(trade, trade.ask_order)
-            await self._private_publisher.publish(trade.ask_order.participant, ask_fill_report)
-            await self._public_publisher.publish("public", self._get_trade_report(trade))
+            private_reports.append((trade.bid_order.participant, self._get_fill_report(trade, trade.bid_order)))
+            private_reports.append((trade.ask_order.participant, self._get_fill_report(trade, trade.ask_order)))
+            public_reports.append(("public", self._get_trade_report(trade, symbol)))
+        await self._private_publisher.publish_many(private_reports)
+        if public_reports:
+            await self._public_publisher.publish_many(public_reports)
+        await self._levels_changed(limit_order_book)
 
     @asyncio.coroutine
     async def _handle_cancel_order(self, order_dict: dict, participant: tuple):
         """
         Cancel order and report to client if order is in `LimitOrderBook`.
         """
-        cancelled = await self.limit_order_book.cancel(order_dict["orderId"])
+        await self._cancel_order(order_dict["orderId"], participant, order_dict.get("symbol"))
+
+    @asyncio.coroutine
+    async def _cancel_order(self, order_id, participant, symbol=None):
+        limit_order_book = self.limit_order_books[symbol]
+        if self.synchronous:
+            cancelled = limit_order_book.cancel(order_id)
+        else:
+            cancelled = await limit_order_book.cancel(order_id)
         if cancelled:
-            cancel_report = self._get_execution_report(order_dict["orderId"], "CANCELLED")
+            if self.journal is not None:
+                self.journal.append_cancel(symbol, order_id)
+                await self.journal.commit()
+            cancel_report = self._get_execution_report(order_id, "CANCELLED", participant)
             await self._private_publisher.publish(participant, cancel_report)
+            await self._levels_changed(limit_order_book)
         else:
-            error_report = self._get_error_report("OrderId {} was not in our database.".format(order_dict["orderId"]))
+            error_report = self._get_error_report("OrderId {} was not in our database.".format(order_id),
+                                                  participant, order_id)
             await self._private_publisher.publish(participant, error_report)
 
     @asyncio.coroutine
-    async def validate_message(self, message: str, participant: tuple):
+    async def _levels_changed(self, limit_order_book):
         """
-        Validates incoming message and possibly sends clients info about errors
+        Publish changed levels immediately or schedule it to the end of tick
+        if it is not scheduled yet.
         """
-        try:
-            order_dict = json.loads(message)
-        except ValueError:
-            error_report = self._get_error_report("Message '{}' is not valid json.".format(message))
-            await self._private_publisher.publish(participant, error_report)
-            return None
-        try:
-            message_schema(order_dict)
-        except Invalid as e:
-            error_report = self._get_error_report("Message '{}' is not valid order message because {}.".format(message, e))
-            await self._private_publisher.publish(participant, error_report)
-            return None
-        return order_dict
+        if not self.order_book_tick:
+            await self.publish_levels()
+        elif self._publish_levels_handle is None and limit_order_book.changed_levels:
+            self._publish_levels_handle = self._loop.call_later(self.order_book_tick, self._publish_levels_later)
+
+    def _publish_levels_later(self):
+        self._publish_levels_handle = None
+        asyncio.ensure_future(self.publish_levels(), loop=self._loop)
+
+    @asyncio.coroutine
+    async def publish_levels(self):
+        """ Publish aggregated quantity of each price level changed since last time in all books. """
+        reports = []
+        for symbol, limit_order_book in self.limit_order_books.items():
+            if not limit_order_book.changed_levels:
+                continue
+            levels = sorted(limit_order_book.pop_changed_levels())
+            if self.synchronous:
+                quantities = limit_order_book.level_quantities(levels)
+            else:
+                quantities = await limit_order_book.level_quantities(levels)
+            for (side, price), quantity in zip(levels, quantities):
+                reports.append(("public", self._get_order_book_report(side, price, quantity, symbol)))
+        if reports:
+            await self._public_publisher.publish_many(reports)
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Fast validation of incoming order messages. It is replacement of voluptuous
+`message_schema` from `stock_exchange` that dispatches on `message` key to
+check written for each message type. Only when the check fails the message is
+validated in the same way as voluptuous does, so error texts are the same.
+"""
+
+SIDES = ("BUY", "SELL")
+# Keys that may be left out of any message.
+OPTIONAL_KEYS = ("symbol",)
+
+
+class InvalidMessage(ValueError):
+    """ Raised when message is not valid order message. """
+
+
+def _has_symbol(message):
+    """ Return number of optional keys in `message` (0 or 1) or None when symbol is not valid. """
+    if "symbol" not in message:
+        return 0
+    if type(message["symbol"]) is str:
+        return 1
+    return None
+
+
+def _is_create_order(message):
+    optional = _has_symbol(message)
+    return (optional is not None and len(message) == 5 + optional and
+            type(message.get("orderId")) is int and
+            message.get("side") in SIDES and
+            type(message.get("price")) is int and message["price"] >= 0 and
+            type(message.get("quantity")) is int and message["quantity"] >= 0)
+
+
+def _is_cancel_order(message):
+    optional = _has_symbol(message)
+    return optional is not None and len(message) == 2 + optional and type(message.get("orderId")) is int
+
+
+def _is_market_order(message):
+    optional = _has_symbol(message)
+    return (optional is not None and len(message) == 4 + optional and
+            type(message.get("orderId")) is int and
+            message.get("side") in SIDES and
+            type(message.get("quantity")) is int and message["quantity"] >= 0)
+
+
+_checks = {
+    "createOrder": _is_create_order,
+    "cancelOrder": _is_cancel_order,
+    "marketOrder": _is_market_order,
+}
+
+
+def _literal(expected):
+    def validate(value):
+        if value != expected:
+            return "not a valid value"
+    return validate
+
+
+def _one_of(*expected):
+    def validate(value):
+        if value not in expected:
+            return "not a valid value"
+    return validate
+
+
+def _integer(value):
+    if not isinstance(value, int):
+        return "expected int"
+
+
+def _string(value):
+    if not isinstance(value, str):
+        return "expected str"
+
+
+def _non_negative_integer(value):
+    if not isinstance(value, int):
+        return "expected int"
+    if value < 0:
+        return "value must be at least 0"
+
+
+# The same schemas as `stock_exchange.message_schema` in the same order.
+_schemas = (
+    (
+        ("message", _literal("createOrder")),
+        ("orderId", _integer),
+        ("side", _one_of(*SIDES)),
+        ("price", _non_negative_integer),
+        ("quantity", _non_negative_integer),
+        ("symbol", _string),
+    ),
+    (
+        ("message", _literal("cancelOrder")),
+        ("orderId", _integer),
+        ("symbol", _string),
+    ),
+    (
+        ("message", _literal("marketOrder")),
+        ("orderId", _integer),
+        ("side", _one_of(*SIDES)),
+        ("quantity", _non_negative_integer),
+        ("symbol", _string),
+    ),
+)
+_schemas = tuple((dict(schema), set(key for key, _ in schema if key not in OPTIONAL_KEYS)) for schema in _schemas)
+
+
+def _schema_error(schema, required_keys, message):
+    """
+    Return first error of `message` against `schema` the same way voluptuous
+    reports it: invalid values and extra keys in order of message keys, then
+    missing required keys.
+    """
+    for key, value in message.items():
+        validate = schema.get(key)
+        if validate is None:
+            return "extra keys not allowed @ data[{!r}]".format(key)
+        error = validate(value)
+        if error is not None:
+            return "{} for dictionary value @ data[{!r}]".format(error, key)
+    missing_keys = required_keys.copy()
+    for key in message:
+        missing_keys.discard(key)
+    for key in missing_keys:
+        return "required key not provided @ data[{!r}]".format(key)
+    return None
+
+
+def get_error(message):
+    """ Return error text of invalid `message` or None if it is valid. """
+    if not isinstance(message, dict):
+        return "expected a dictionary"
+    first_error = None
+    for schema, required_keys in _schemas:
+        error = _schema_error(schema, required_keys, message)
+        if error is None:
+            return None
+        if first_error is None:
+            first_error = error
+    return first_error
+
+
+def validate_message(message):
+    """
+    Validate order message decoded from json. Raises `InvalidMessage` when it
+    is not valid, returns the message otherwise.
+    """
+    try:
+        check = _checks[message["message"]]
+    except (KeyError, TypeError):
+        check = None
+    if check is None or not check(message):
+        error = get_error(message)
+        if error is not None:
+            raise InvalidMessage(error)
+    return message